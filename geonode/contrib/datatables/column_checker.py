@@ -9,7 +9,7 @@ Attempting such a join will throw a Postgres error anyway--this is give a better
 error message.
 """
 import logging
-import psycopg2
+from geonode import dbpool
 from geonode.contrib.msg_util import msg, msgt
 from geonode.contrib.datatables.db_helper import get_datastore_connection_string
 
@@ -191,7 +191,7 @@ class ColumnChecker(object):
             " {0} TYPE varchar(255) USING {0}::varchar;".format(attr_name)
 
         try:
-            conn = psycopg2.connect(get_datastore_connection_string())
+            conn = dbpool.connect(get_datastore_connection_string())
 
             cur = conn.cursor()
             cur.execute(stmt)
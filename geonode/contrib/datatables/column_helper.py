@@ -10,7 +10,7 @@ Used before attempting a SQL join between a Layer column and a DataTable column.
 import sys
 import traceback
 import logging
-import psycopg2
+from geonode import dbpool
 #from geonode.contrib.msg_util import msg, msgt
 from geonode.contrib.datatables.db_helper import get_datastore_connection_string
 
@@ -50,7 +50,7 @@ class ColumnHelper(object):
         #msg ('sql_target_data_type: %s' % sql_target_data_type)
 
         try:
-            conn = psycopg2.connect(get_datastore_connection_string())
+            conn = dbpool.connect(get_datastore_connection_string())
             cur = conn.cursor()
             cur.execute(sql_target_data_type)
             data_type = cur.fetchone()[0]
@@ -1,4 +1,4 @@
-import psycopg2
+from geonode import dbpool
 import json
 from django.db import models
 from django.db.models import signals
@@ -88,7 +88,7 @@ dt.as_json()
 
     def remove_table(self):
         #conn = psycopg2.connect("dbname=geonode user=geonode")
-        conn = psycopg2.connect(get_datastore_connection_string())
+        conn = dbpool.connect(get_datastore_connection_string())
         cur = conn.cursor()
         cur.execute('drop table if exists %s;' % self.table_name)
         conn.commit()
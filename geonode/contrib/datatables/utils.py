@@ -12,7 +12,7 @@ from geonode.contrib.msg_util import msg, msgt
 from geoserver.catalog import Catalog
 from geoserver.store import datastore_from_index
 
-import psycopg2
+from geonode import dbpool
 
 from django.contrib.auth.models import User
 from django.conf import settings
@@ -161,7 +161,7 @@ def process_csv_file(data_table,
     # -----------------------------------------------------
     # Execute the SQL and Create the Table (No data is loaded)
     # -----------------------------------------------------
-    conn = psycopg2.connect(get_datastore_connection_string(is_dataverse_db=is_dataverse_db))
+    conn = dbpool.connect(get_datastore_connection_string(is_dataverse_db=is_dataverse_db))
 
     try:
         cur = conn.cursor()
@@ -425,7 +425,7 @@ def setup_join(new_table_owner, table_name, layer_typename,
     drop_view_by_name(view_name)
 
     try:
-        conn = psycopg2.connect(get_datastore_connection_string())
+        conn = dbpool.connect(get_datastore_connection_string())
         cur = conn.cursor()
 
         # Create the new view
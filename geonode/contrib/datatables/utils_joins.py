@@ -5,7 +5,7 @@ import sys
 import traceback
 import logging
 
-import psycopg2
+from geonode import dbpool
 
 from django.template.defaultfilters import slugify
 
@@ -29,7 +29,7 @@ def drop_view_by_name(view_name):
     # -----------------------------------------------------
     # Execute the SQL and Drop the View
     # -----------------------------------------------------
-    conn = psycopg2.connect(get_datastore_connection_string())
+    conn = dbpool.connect(get_datastore_connection_string())
 
     try:
         cur = conn.cursor()
@@ -63,7 +63,7 @@ def does_table_name_exist(table_name):
             table_name))
 
     #print 'stmt_count', stmt_count
-    conn = psycopg2.connect(get_datastore_connection_string())
+    conn = dbpool.connect(get_datastore_connection_string())
 
     try:
         cur = conn.cursor()
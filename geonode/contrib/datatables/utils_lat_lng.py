@@ -9,7 +9,7 @@ import traceback
 import uuid
 
 # Postgres
-import psycopg2
+from geonode import dbpool
 from geonode.contrib.datatables.db_helper import get_datastore_connection_string
 
 from django.conf import settings
@@ -160,7 +160,7 @@ def create_point_col_from_lat_lon(new_table_owner, table_name, lat_column, lng_c
     # Run the SQL
     # ---------------------------------------------
     try:
-        conn = psycopg2.connect(get_datastore_connection_string(is_dataverse_db=False))
+        conn = dbpool.connect(get_datastore_connection_string(is_dataverse_db=False))
 
         cur = conn.cursor()
 
@@ -342,7 +342,7 @@ def remove_bad_lat_lng_numbers(lat_lng_map_record):
                 datatable_name, lat_lng_clause_or_err_msg)
 
     try:
-        conn = psycopg2.connect(get_datastore_connection_string(is_dataverse_db=False))
+        conn = dbpool.connect(get_datastore_connection_string(is_dataverse_db=False))
         cur = conn.cursor()
 
         # Are there any bad rows?
@@ -472,7 +472,7 @@ def get_layer_feature_count(table_name):
 
     # Make the query
     try:
-        conn = psycopg2.connect(get_datastore_connection_string(db_name=layer.store))
+        conn = dbpool.connect(get_datastore_connection_string(db_name=layer.store))
         cur = conn.cursor()
         cur.execute(num_features_sql)
         return (True, cur.fetchone()[0])
@@ -19,7 +19,7 @@ from __future__ import print_function
 import sys
 import json
 import logging
-import psycopg2
+from geonode import dbpool
 
 from django.conf import settings
 from geoserver.catalog import FailedRequestError
@@ -87,7 +87,7 @@ class StyleOrganizer(object):
                        ' where f_table_name = \'%s\';')\
                        % layer.typename.split(':')[-1]
 
-            conn = psycopg2.connect(conn_str_or_err)
+            conn = dbpool.connect(conn_str_or_err)
             cur = conn.cursor()
             cur.execute(sql_str)
             data_type = cur.fetchone()[0]
@@ -1,7 +1,9 @@
 from datetime import datetime
+from django.contrib.auth import get_backends
 from django.contrib.auth.backends import ModelBackend
 from django.contrib.contenttypes.models import ContentType 
 from django.db import models
+from geonode.core.permcache import get_permission_cache
 from geonode.core.models import ANONYMOUS_USERS, AUTHENTICATED_USERS, CUSTOM_GROUP_USERS, \
      GenericObjectRoleMapping, Permission, UserObjectRoleMapping
 
@@ -36,8 +38,8 @@ class GranularBackend(ModelBackend):
                 return set()
             
             if not hasattr(user_obj, '_obj_perm_cache'):
-                # TODO: this cache should really be bounded.
-                # repoze.lru perhaps?
+                # Only lives for the request, the permissions are also kept
+                # across requests in the bounded permcache
                 user_obj._obj_perm_cache = dict()
             try:
                 obj_key = self._cache_key_for_obj(obj)
@@ -50,47 +52,98 @@ class GranularBackend(ModelBackend):
     def has_perm(self, user_obj, perm, obj=None):
         return perm in self.get_all_permissions(user_obj, obj=obj)
 
+    def perms_for_objects(self, user_obj, objs, model=None):
+        """
+        Resolve the permissions of the user on every object of ``objs`` (a
+        queryset or list of instances of one model, or a list of ids of
+        ``model``) with two queries, and store them in the per-user cache used
+        by has_perm.  Returns a dict of object id -> list of permission
+        strings.
+        """
+        if model is None:
+            if isinstance(objs, models.query.QuerySet):
+                model = objs.model
+                ids = list(objs.values_list('id', flat=True))
+            else:
+                objs = list(objs)
+                if not objs:
+                    return {}
+                model = objs[0].__class__
+                ids = [obj.id for obj in objs]
+        else:
+            ids = list(objs)
+
+        if not hasattr(user_obj, '_obj_perm_cache'):
+            user_obj._obj_perm_cache = dict()
+        result = {}
+        missing = []
+        for obj_id in ids:
+            try:
+                result[obj_id] = user_obj._obj_perm_cache[self._cache_key(model, obj_id)]
+            except KeyError:
+                missing.append(obj_id)
+
+        if missing:
+            ct = ContentType.objects.get_for_model(model)
+            resolved = self._get_obj_perms(user_obj, ct, missing)
+            for obj_id in missing:
+                all_perms = ['%s.%s' % p for p in resolved.get(obj_id, ())]
+                user_obj._obj_perm_cache[self._cache_key(model, obj_id)] = all_perms
+                result[obj_id] = all_perms
+        return result
+
     def _cache_key_for_obj(self, obj):
-        model = obj.__class__
+        return self._cache_key(obj.__class__, obj.id)
+
+    def _cache_key(self, model, obj_id):
         opts = model._meta
         while opts.proxy:
             model = opts.proxy_for_model
             opts = model._meta
-        key = (opts.app_label, opts.object_name.lower(), obj.id)
+        key = (opts.app_label, opts.object_name.lower(), obj_id)
         return key
-    
-        
-    def _get_generic_obj_perms(self, generic_roles, obj):
-        perms = set()
-        ct = ContentType.objects.get_for_model(obj)
-        for rm in GenericObjectRoleMapping.objects.select_related('role', 'role__permissions', 'role__permissions__content_type').filter(object_id=obj.id, object_ct=ct, subject__in=generic_roles).all():
-            for perm in rm.role.permissions.all():
-                perms.add((perm.content_type.app_label, perm.codename))
-        return perms
 
+    def _generic_roles(self, user_obj):
+        return generic_roles(user_obj)
 
-    def _get_all_obj_perms(self, user_obj, obj):
+    def _get_obj_perms(self, user_obj, ct, obj_ids):
         """
-        get all permissions for user in the context of ob (not cached)
+        get all permissions for user in the context of the objects of content
+        type ct with the given ids, as a dict of object id -> set of
+        (app_label, codename).  The permissions granted through generic roles
+        and to the user are cached separately in the permission cache.
         """
-        obj_perms = set()
-        generic_roles = [ANONYMOUS_USERS]
-        if not user_obj.is_anonymous():
-            generic_roles.append(AUTHENTICATED_USERS)
-            profile = user_obj.get_profile()
-            if profile and profile.is_org_member and profile.member_expiration_dt >= datetime.today().date():
-                generic_roles.append(CUSTOM_GROUP_USERS)
-        obj_perms.update(self._get_generic_obj_perms(generic_roles, obj))
-        
-        ct = ContentType.objects.get_for_model(obj)
+        perm_cache = get_permission_cache()
+        generic_roles = tuple(self._generic_roles(user_obj))
+        subjects = [(generic_roles, GenericObjectRoleMapping.objects.filter(subject__in=generic_roles))]
         if not user_obj.is_anonymous():
-            for rm in UserObjectRoleMapping.objects.select_related('role', 'role__permissions', 'role__permissions__content_type').filter(object_id=obj.id, object_ct=ct, user=user_obj).all():
-                for perm in rm.role.permissions.all():
-                    obj_perms.add((perm.content_type.app_label, perm.codename))
+            subjects.append((user_obj.id, UserObjectRoleMapping.objects.filter(user=user_obj)))
 
+        obj_perms = {}
+        fields = ('object_id', 'role__permissions__content_type__app_label', 'role__permissions__codename')
+        for subject, mappings in subjects:
+            found = perm_cache.get_many(ct.id, obj_ids, subject)
+            missing = [obj_id for obj_id in obj_ids if obj_id not in found]
+            if missing:
+                resolved = dict((obj_id, set()) for obj_id in missing)
+                for obj_id, app_label, codename in mappings.filter(object_id__in=missing, object_ct=ct).values_list(*fields):
+                    # roles without permissions
+                    if codename is not None:
+                        resolved[obj_id].add((app_label, codename))
+                resolved = dict((obj_id, frozenset(perms)) for obj_id, perms in resolved.iteritems())
+                perm_cache.set_many(ct.id, resolved, subject)
+                found.update(resolved)
+            for obj_id, perms in found.iteritems():
+                obj_perms.setdefault(obj_id, set()).update(perms)
         return obj_perms
 
-        
+    def _get_all_obj_perms(self, user_obj, obj):
+        """
+        get all permissions for user in the context of ob
+        """
+        ct = ContentType.objects.get_for_model(obj)
+        return self._get_obj_perms(user_obj, ct, [obj.id]).get(obj.id, set())
+
     def objects_with_perm(self, user_obj, perm, ModelType):
         """
         select identifiers of objects the type specified that the 
@@ -124,3 +177,36 @@ class GranularBackend(ModelBackend):
         app_label = perm[0:ps]
         codename = perm[ps+1:]
         return Permission.objects.get(content_type__app_label=app_label, codename=codename)
+
+
+def generic_roles(user_obj):
+    """
+    The generic roles (anonymous, authenticated, customgroup users) the
+    user belongs to.
+    """
+    roles = [ANONYMOUS_USERS]
+    if not user_obj.is_anonymous():
+        roles.append(AUTHENTICATED_USERS)
+        profile = user_obj.get_profile()
+        if profile and profile.is_org_member and profile.member_expiration_dt >= datetime.today().date():
+            roles.append(CUSTOM_GROUP_USERS)
+    return roles
+
+
+def perms_for_objects(user_obj, objs, model=None):
+    """
+    Resolve the permissions of a user on a set of objects up front with the
+    backends that support it (see GranularBackend.perms_for_objects), so
+    that the has_perm calls that follow do not query the database.  Returns
+    a dict of object id -> set of permission strings, or None for active
+    superusers, who have every permission.
+    """
+    if user_obj.is_active and user_obj.is_superuser:
+        # has_perm does not ask the backends
+        return None
+    perms = {}
+    for backend in get_backends():
+        if hasattr(backend, 'perms_for_objects'):
+            for obj_id, obj_perms in backend.perms_for_objects(user_obj, objs, model).iteritems():
+                perms.setdefault(obj_id, set()).update(obj_perms)
+    return perms
@@ -1,22 +1,104 @@
 from django.contrib.auth.models import User, Permission
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.generic import GenericForeignKey
-from django.db import models
+from django.db import connections, models, router, transaction
+from django.db.models import signals
+from django.dispatch import Signal
 from django.utils.translation import ugettext_lazy as _
 from django.core.exceptions import ObjectDoesNotExist
 from django.conf import settings
+from django.core.cache import cache
 import logging
+import time
+from geonode.core.permcache import invalidate_all, invalidate_objects
 
 logger = logging.getLogger("geonode.core.models")
 
+# Bumped when a role is saved or deleted, so that every process reloads its
+# role registry
+ROLE_REGISTRY_SERIAL_KEY = 'core_role_registry_serial'
+ROLE_REGISTRY_SERIAL_TIMEOUT = 60 * 60 * 24 * 30
+
 
 class ObjectRoleManager(models.Manager):
+    # Process-level registry of all roles, (value of ROLE_REGISTRY_SERIAL_KEY
+    # when it was loaded, (content type id, codename) -> role).  Replaced as
+    # a whole, never modified in place.
+    _registry = None
+
     def get_by_natural_key(self, codename, app_label, model):
         return self.get(
             codename=codename,
             content_type=ContentType.objects.get_by_natural_key(app_label, model)
         )
 
+    def _registry_serial(self):
+        """
+        The shared serial of the role registry, or None if the cache backend
+        does not keep values (dummy://).
+        """
+        serial = cache.get(ROLE_REGISTRY_SERIAL_KEY)
+        if serial is None:
+            # Not 0, so that an evicted serial does not match an old registry
+            cache.add(ROLE_REGISTRY_SERIAL_KEY, int(time.time()), ROLE_REGISTRY_SERIAL_TIMEOUT)
+            serial = cache.get(ROLE_REGISTRY_SERIAL_KEY)
+        return serial
+
+    def _current_registry(self):
+        """
+        This process's registry, or None if it is not loaded or a role
+        changed since it was.
+        """
+        loaded = ObjectRoleManager._registry
+        if loaded is None or loaded[0] != self._registry_serial():
+            return None
+        return loaded[1]
+
+    def _load_registry(self):
+        serial = self._registry_serial()
+        registry = dict(((role.content_type_id, role.codename), role)
+                        for role in self.order_by('list_order'))
+        ObjectRoleManager._registry = (serial, registry)
+        return registry
+
+    def clear_registry(self):
+        """
+        Make every process reload its role registry.
+        """
+        try:
+            cache.add(ROLE_REGISTRY_SERIAL_KEY, int(time.time()), ROLE_REGISTRY_SERIAL_TIMEOUT)
+            cache.incr(ROLE_REGISTRY_SERIAL_KEY)
+        except ValueError:
+            # Cache backend does not keep values (dummy://)
+            pass
+        ObjectRoleManager._registry = None
+
+    def get_role(self, content_type, codename):
+        """
+        Return the role with the given codename for the content type from
+        the registry, loading it on first use, after a role changed in any
+        process (with a shared cache backend), and for roles created since.
+        Raises ObjectRole.DoesNotExist for unknown roles.
+        """
+        key = (content_type.id, codename)
+        registry = self._current_registry()
+        if registry is None or key not in registry:
+            registry = self._load_registry()
+        try:
+            return registry[key]
+        except KeyError:
+            raise self.model.DoesNotExist("ObjectRole matching query does not exist.")
+
+    def roles_for(self, content_type):
+        """
+        The roles of a content type from the registry, by list_order.
+        """
+        registry = self._current_registry()
+        if registry is None:
+            registry = self._load_registry()
+        return sorted([role for (ct_id, codename), role in registry.iteritems() if ct_id == content_type.id],
+                      key=lambda role: role.list_order)
+
 class ObjectRole(models.Model):
     """
     A bundle of object permissions representing
@@ -99,6 +181,28 @@ class GenericObjectRoleMapping(models.Model):
     class Meta:
         unique_together = (('subject', 'object_ct', 'object_id', 'role'), )
 
+def invalidate_mapping_perms(sender, instance, **kwargs):
+    invalidate_objects(instance.object_ct_id, [instance.object_id])
+
+
+def invalidate_role_perms(sender, instance, **kwargs):
+    if kwargs['action'] in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_all()
+
+# Cached permissions are dropped whenever role mappings are written or
+# deleted, including by QuerySet.delete()
+for mapping_model in (UserObjectRoleMapping, GenericObjectRoleMapping):
+    signals.post_save.connect(invalidate_mapping_perms, sender=mapping_model)
+    signals.post_delete.connect(invalidate_mapping_perms, sender=mapping_model)
+signals.m2m_changed.connect(invalidate_role_perms, sender=ObjectRole.permissions.through)
+
+
+def clear_role_registry(sender, **kwargs):
+    ObjectRole.objects.clear_registry()
+
+signals.post_save.connect(clear_role_registry, sender=ObjectRole)
+signals.post_delete.connect(clear_role_registry, sender=ObjectRole)
+
 class PermissionLevelError(Exception):
     pass
 
@@ -119,7 +223,7 @@ class PermissionLevelMixin(object):
         """
         levels = [self.LEVEL_NONE]
         content_type = ContentType.objects.get_for_model(self)
-        for role in ObjectRole.objects.filter(content_type=content_type).order_by('list_order'):
+        for role in ObjectRole.objects.roles_for(content_type):
             levels.append(role.codename)
         return levels
 
@@ -130,8 +234,8 @@ class PermissionLevelMixin(object):
         """
         try:
             my_ct = ContentType.objects.get_for_model(self)
-            mapping = UserObjectRoleMapping.objects.get(user=user, object_id=self.id, object_ct=my_ct)
-            return mapping.role.codename
+            return UserObjectRoleMapping.objects.filter(user=user, object_id=self.id, object_ct=my_ct).values_list(
+                'role__codename', flat=True).get()
         except Exception, e:
             return self.LEVEL_NONE
 
@@ -151,7 +255,7 @@ class PermissionLevelMixin(object):
         else:
             # lookup new role...
             try:
-                role = ObjectRole.objects.get(codename=level, content_type=my_ct)
+                role = ObjectRole.objects.get_role(my_ct, level)
             except ObjectDoesNotExist:
                 raise PermissionLevelError("Invalid Permission Level (%s)" % level)
             # remove any existing mapping
@@ -168,8 +272,8 @@ class PermissionLevelMixin(object):
 
         try:
             my_ct = ContentType.objects.get_for_model(self)
-            mapping = GenericObjectRoleMapping.objects.get(subject=gen_role, object_id=self.id, object_ct=my_ct)
-            return mapping.role.codename
+            return GenericObjectRoleMapping.objects.filter(subject=gen_role, object_id=self.id, object_ct=my_ct).values_list(
+                'role__codename', flat=True).get()
         except Exception:
             return self.LEVEL_NONE
 
@@ -185,7 +289,7 @@ class PermissionLevelMixin(object):
             GenericObjectRoleMapping.objects.filter(subject=gen_role, object_id=self.id, object_ct=my_ct).delete()
         else:
             try:
-                role = ObjectRole.objects.get(codename=level, content_type=my_ct)
+                role = ObjectRole.objects.get_role(my_ct, level)
             except ObjectRole.DoesNotExist:
                 raise PermissionLevelError("Invalid Permission Level (%s)" % level)
             # remove any existing mapping
@@ -223,13 +327,11 @@ class PermissionLevelMixin(object):
         my_ct = ContentType.objects.get_for_model(self)
 
         # get all user-specific permissions
-        user_levels = {}
-        for rm in UserObjectRoleMapping.objects.filter(object_id=self.id, object_ct=my_ct).all():
-            user_levels[rm.user.username] = rm.role.codename
+        user_levels = dict(UserObjectRoleMapping.objects.filter(object_id=self.id, object_ct=my_ct).values_list(
+            'user__username', 'role__codename'))
 
-        levels = {}
-        for rm in GenericObjectRoleMapping.objects.filter(object_id=self.id, object_ct=my_ct).all():
-            levels[rm.subject] = rm.role.codename
+        levels = dict(GenericObjectRoleMapping.objects.filter(object_id=self.id, object_ct=my_ct).values_list(
+            'subject', 'role__codename'))
         levels['users'] = user_levels
 
         return levels
@@ -258,18 +360,99 @@ class PermissionLevelMixin(object):
         # get all user-specific permissions
         user_levels = {}
         user_names = {}
-        for rm in UserObjectRoleMapping.objects.filter(object_id=self.id, object_ct=my_ct).all():
-            user_levels[rm.user.email] = rm.role.codename
-            user_names[rm.user.email] = rm.user.username
+        for email, username, codename in UserObjectRoleMapping.objects.filter(object_id=self.id, object_ct=my_ct).values_list(
+                'user__email', 'user__username', 'role__codename'):
+            user_levels[email] = codename
+            user_names[email] = username
 
-        levels = {}
-        for rm in GenericObjectRoleMapping.objects.filter(object_id=self.id, object_ct=my_ct).all():
-            levels[rm.subject] = rm.role.codename
+        levels = dict(GenericObjectRoleMapping.objects.filter(object_id=self.id, object_ct=my_ct).values_list(
+            'subject', 'role__codename'))
         levels['users'] = user_levels
         levels['names'] = user_names
 
         return levels
 
+# Sent after set_permission_levels changed the role mappings of objects
+# without model signals
+permission_levels_changed = Signal(providing_args=['content_type', 'object_ids'])
+
+
+def set_permission_levels(objs, gen_levels, user_levels):
+    """
+    Set the permission levels of many objects of one model at once, in a
+    single transaction.  ``gen_levels`` maps generic roles to levels; the
+    roles it does not mention are left alone.  ``user_levels`` maps users to
+    levels, all the other user levels of the objects are removed.  As with
+    set_user_level, object owners always keep the admin level.
+
+    The mappings to remove and to add are computed for all the objects
+    together and written with one DELETE and one bulk INSERT per mapping
+    table, so model signals are not sent; permission_levels_changed is sent
+    instead.  Returns a dict of object id -> {'added': n, 'removed': n}.
+    """
+    objs = list(objs)
+    if not objs:
+        return {}
+    model = objs[0]
+    ct = ContentType.objects.get_for_model(model)
+    obj_ids = [obj.id for obj in objs]
+
+    def role_id(level):
+        try:
+            return ObjectRole.objects.get_role(ct, level).id
+        except ObjectRole.DoesNotExist:
+            raise PermissionLevelError("Invalid Permission Level (%s)" % level)
+
+    gen_roles = dict((subject, role_id(level)) for subject, level in gen_levels.iteritems()
+                     if level != model.LEVEL_NONE)
+    user_roles = dict((user.id, role_id(level)) for user, level in user_levels.iteritems()
+                      if level != model.LEVEL_NONE)
+    admin_role = role_id(model.LEVEL_ADMIN)
+
+    target_generic = set()
+    target_user = set()
+    for obj in objs:
+        for subject, role in gen_roles.iteritems():
+            target_generic.add((obj.id, subject, role))
+        for user_id, role in user_roles.iteritems():
+            if user_id != obj.owner_id:
+                target_user.add((obj.id, user_id, role))
+        if obj.owner_id is not None:
+            target_user.add((obj.id, obj.owner_id, admin_role))
+
+    summary = dict((obj_id, {'added': 0, 'removed': 0}) for obj_id in obj_ids)
+    using = router.db_for_write(UserObjectRoleMapping)
+    with transaction.commit_on_success(using=using):
+        for mapping_model, grantee, grantee_field, target, existing in (
+                (GenericObjectRoleMapping, 'subject', 'subject', target_generic,
+                 GenericObjectRoleMapping.objects.filter(subject__in=gen_levels.keys())),
+                (UserObjectRoleMapping, 'user', 'user_id', target_user, UserObjectRoleMapping.objects.all())):
+            current = dict(((obj_id, grantee_id, role), pk) for pk, obj_id, grantee_id, role in
+                           existing.filter(object_ct=ct, object_id__in=obj_ids).values_list(
+                               'id', 'object_id', grantee, 'role'))
+            stale = [key for key in current if key not in target]
+            added = [key for key in target if key not in current]
+            if stale:
+                # A single statement, QuerySet.delete() loads every row to send signals
+                connection = connections[using]
+                connection.cursor().execute("DELETE FROM %s WHERE id = ANY(%%s)" %
+                                            connection.ops.quote_name(mapping_model._meta.db_table),
+                                            [[current[key] for key in stale]])
+            if added:
+                mapping_model.objects.using(using).bulk_create([
+                    mapping_model(object_ct=ct, object_id=obj_id, role_id=role, **{grantee_field: grantee_id})
+                    for obj_id, grantee_id, role in added])
+            for obj_id, grantee_id, role in stale:
+                summary[obj_id]['removed'] += 1
+            for obj_id, grantee_id, role in added:
+                summary[obj_id]['added'] += 1
+
+    changed = [obj_id for obj_id, counts in summary.iteritems() if counts['added'] or counts['removed']]
+    if changed:
+        invalidate_objects(ct.id, changed)
+        permission_levels_changed.send(sender=type(model), content_type=ct, object_ids=changed)
+    return summary
+
 from registration.signals import user_activated
 from django.contrib.auth import login
 # Logic to login a user automatically when it has successfully
@@ -0,0 +1,219 @@
+"""
+Cross-request cache of object permissions for GranularBackend.
+
+Each process keeps the permissions it resolved in a bounded LRU cache whose
+entries expire after settings.PERMISSION_CACHE_TIMEOUT seconds.  Entries are
+keyed by (content type, object id, subject), where the subject is either a
+user id (permissions granted to the user) or the tuple of generic roles the
+user belongs to (permissions granted to anonymous, authenticated or custom
+group users), so that users share the generic part and a change of group
+membership is picked up without invalidation.
+
+When the role mappings of an object change, invalidate_objects records it
+in a change log kept in the Django cache; other processes apply the log
+before their next lookup.  The cache is only used across requests when
+CACHE_BACKEND keeps values (i.e. not with dummy://), since the processes
+would not see each other's invalidations otherwise.
+"""
+
+import logging
+import threading
+import time
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger("geonode.core.permcache")
+
+PERM_CACHE_SERIAL_KEY = 'core_perm_cache_serial'
+PERM_CACHE_LOG_KEY = 'core_perm_cache_log'
+# Number of invalidations kept for processes catching up; a process that
+# falls further behind drops its whole cache
+PERM_CACHE_LOG_SIZE = 500
+PERM_CACHE_LOG_TIMEOUT = 60 * 60 * 24 * 30
+
+
+class PermissionCache(object):
+    """
+    Bounded LRU cache of permission sets with a time to live.
+    """
+
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.serial = None
+        self.counters = dict.fromkeys(('hits', 'misses', 'evictions', 'invalidations'), 0)
+        self._entries = OrderedDict()
+        # (content type, object id) -> subjects cached for the object
+        self._subjects = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_many(self, ct_id, obj_ids, subject):
+        """
+        Return a dict of object id -> cached permissions of ``subject``, for
+        the objects of ``obj_ids`` that are cached.
+        """
+        found = {}
+        now = time.time()
+        with self._lock:
+            for obj_id in obj_ids:
+                key = (ct_id, obj_id, subject)
+                entry = self._entries.pop(key, None)
+                if entry is None or entry[0] < now:
+                    if entry is not None:
+                        self._forget(key)
+                    self.counters['misses'] += 1
+                    continue
+                # Most recently used entries go last
+                self._entries[key] = entry
+                found[obj_id] = entry[1]
+                self.counters['hits'] += 1
+        return found
+
+    def set_many(self, ct_id, perms, subject):
+        """
+        Cache the permissions of ``subject`` on objects, ``perms`` is a dict
+        of object id -> permissions.
+        """
+        if self.max_size <= 0:
+            return
+        expires = time.time() + self.timeout
+        with self._lock:
+            for obj_id, obj_perms in perms.iteritems():
+                key = (ct_id, obj_id, subject)
+                self._entries.pop(key, None)
+                self._entries[key] = (expires, obj_perms)
+                self._subjects.setdefault((ct_id, obj_id), set()).add(subject)
+            while len(self._entries) > self.max_size:
+                key, entry = self._entries.popitem(last=False)
+                self._forget(key)
+                self.counters['evictions'] += 1
+
+    def _forget(self, key):
+        ct_id, obj_id, subject = key
+        subjects = self._subjects.get((ct_id, obj_id))
+        if subjects is not None:
+            subjects.discard(subject)
+            if not subjects:
+                del self._subjects[(ct_id, obj_id)]
+
+    def invalidate(self, ct_id, obj_ids):
+        with self._lock:
+            for obj_id in obj_ids:
+                for subject in self._subjects.pop((ct_id, obj_id), ()):
+                    self._entries.pop((ct_id, obj_id, subject), None)
+                self.counters['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._subjects.clear()
+
+    def sync(self):
+        """
+        Apply the invalidations recorded by other processes since the last
+        sync.  Drops everything if the change log does not reach back far
+        enough, or if the cache backend does not keep values.
+        """
+        serial = cache.get(PERM_CACHE_SERIAL_KEY)
+        if serial is None:
+            cache.add(PERM_CACHE_SERIAL_KEY, 0, PERM_CACHE_LOG_TIMEOUT)
+            serial = cache.get(PERM_CACHE_SERIAL_KEY)
+            if serial is None:
+                # No shared cache, entries must not outlive the request
+                self.clear()
+                self.serial = None
+                return
+        if serial == self.serial:
+            return
+        log = cache.get(PERM_CACHE_LOG_KEY) or []
+        changes = [entry for entry in log if self.serial is not None and entry[0] > self.serial]
+        # Concurrent invalidations can overwrite each other's log entries,
+        # so every change since the last sync must be there
+        if self.serial is None or serial < self.serial or len(changes) != serial - self.serial:
+            self.clear()
+        else:
+            changed = {}
+            for change, ct_id, obj_ids in changes:
+                changed.setdefault(ct_id, set()).update(obj_ids)
+            for ct_id, obj_ids in changed.iteritems():
+                self.invalidate(ct_id, obj_ids)
+        self.serial = serial
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        stats['size'] = len(self._entries)
+        stats['max_size'] = self.max_size
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = lookups and float(stats['hits']) / lookups
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_permission_cache():
+    """
+    Return this process's permission cache, up to date with the
+    invalidations of other processes.
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = PermissionCache(settings.PERMISSION_CACHE_SIZE, settings.PERMISSION_CACHE_TIMEOUT)
+    _cache.sync()
+    return _cache
+
+
+def invalidate_objects(ct_id, obj_ids):
+    """
+    Drop the cached permissions on the objects of content type ``ct_id``
+    with the given ids, in every process.
+    """
+    obj_ids = list(obj_ids)
+    if not obj_ids:
+        return
+    try:
+        cache.add(PERM_CACHE_SERIAL_KEY, 0, PERM_CACHE_LOG_TIMEOUT)
+        serial = cache.incr(PERM_CACHE_SERIAL_KEY)
+        log = cache.get(PERM_CACHE_LOG_KEY) or []
+        log.append((serial, ct_id, obj_ids))
+        cache.set(PERM_CACHE_LOG_KEY, log[-PERM_CACHE_LOG_SIZE:], PERM_CACHE_LOG_TIMEOUT)
+    except ValueError:
+        # Cache backend does not keep values (dummy://), nothing is cached
+        # across requests
+        pass
+    if _cache is not None:
+        _cache.invalidate(ct_id, obj_ids)
+
+
+def invalidate_all():
+    """
+    Drop every cached permission in every process, e.g. after the
+    permissions of a role changed.
+    """
+    try:
+        # A serial without log entry makes other processes start over
+        cache.add(PERM_CACHE_SERIAL_KEY, 0, PERM_CACHE_LOG_TIMEOUT)
+        cache.incr(PERM_CACHE_SERIAL_KEY)
+    except ValueError:
+        pass
+    if _cache is not None:
+        _cache.clear()
+
+
+def permission_cache_stats():
+    """
+    Hit, miss, eviction and invalidation counters of this process's
+    permission cache.
+    """
+    return get_permission_cache().stats()
@@ -1,5 +1,11 @@
 from django.test.client import Client
 from django.test import TestCase
+from mock import patch
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from geonode.core import permcache
+from geonode.core.permcache import PermissionCache
+from geonode.dbpool import ConnectionPool, PooledConnection, PoolTimeout
 import os
 
 class GeoNodeClientTests(TestCase):
@@ -43,4 +49,109 @@ class GeoNodeClientTests(TestCase):
 
         c = Client()
         response = c.get('/profiles/')
-        self.failUnlessEqual(response.status_code, 200)
\ No newline at end of file
+        self.failUnlessEqual(response.status_code, 200)
+
+class FakeConnection(object):
+    """
+    Stands in for a psycopg2 connection in the connection pool tests
+    """
+
+    def __init__(self):
+        self.closed = 0
+        self.rolled_back = 0
+
+    def get_transaction_status(self):
+        return 0
+
+    def rollback(self):
+        self.rolled_back += 1
+
+    def close(self):
+        self.closed = 1
+
+
+class ConnectionPoolTest(TestCase):
+
+    def setUp(self):
+        self.pool = ConnectionPool("dbname='test'", max_size=2, timeout=0.1, check_interval=30, max_idle=600)
+        self.connect = patch.object(ConnectionPool, '_connect', side_effect=lambda: FakeConnection())
+        self.connect.start()
+
+    def tearDown(self):
+        self.connect.stop()
+
+    def test_connections_are_reused(self):
+        conn = PooledConnection(self.pool, self.pool.getconn())
+        raw = conn._conn
+        conn.close()
+        self.assertTrue(conn.closed)
+        self.assertFalse(raw.closed)
+        self.assertTrue(self.pool.getconn() is raw)
+        stats = self.pool.stats()
+        self.assertEquals(1, stats['connects'])
+        self.assertEquals(2, stats['checkouts'])
+        self.assertEquals('test', self.pool.name)
+
+    def test_full_pool_times_out(self):
+        self.pool.getconn()
+        self.pool.getconn()
+        self.assertRaises(PoolTimeout, self.pool.getconn)
+        stats = self.pool.stats()
+        self.assertEquals(2, stats['in_use'])
+        self.assertEquals(1, stats['timeouts'])
+
+    def test_closed_connections_are_replaced(self):
+        raw = self.pool.getconn()
+        self.pool.putconn(raw)
+        raw.closed = 1
+        self.assertFalse(self.pool.getconn() is raw)
+        self.assertEquals(1, self.pool.stats()['discarded'])
+
+
+class PermissionCacheTest(TestCase):
+
+    def setUp(self):
+        shared_cache = LocMemCache('permcache-test', {})
+        shared_cache.clear()
+        self.shared = patch.object(permcache, 'cache', shared_cache)
+        self.shared.start()
+
+    def tearDown(self):
+        self.shared.stop()
+
+    def test_lru_eviction_and_expiry(self):
+        perm_cache = PermissionCache(max_size=2, timeout=60)
+        perm_cache.set_many(1, {1: frozenset(['a']), 2: frozenset(['b'])}, 'anonymous')
+        self.assertEquals({1: frozenset(['a'])}, perm_cache.get_many(1, [1], 'anonymous'))
+        perm_cache.set_many(1, {3: frozenset()}, 'anonymous')
+        # 2 was the least recently used
+        self.assertEquals([1, 3], sorted(perm_cache.get_many(1, [1, 2, 3], 'anonymous')))
+        perm_cache.timeout = -1
+        perm_cache.set_many(1, {4: frozenset()}, 7)
+        self.assertEquals({}, perm_cache.get_many(1, [4], 7))
+        stats = perm_cache.stats()
+        self.assertEquals(3, stats['hits'])
+        self.assertEquals(2, stats['misses'])
+        self.assertEquals(2, stats['evictions'])
+
+    def test_invalidations_reach_other_processes(self):
+        other = PermissionCache(max_size=10, timeout=60)
+        other.sync()
+        other.set_many(1, {1: frozenset(['a']), 2: frozenset(['b'])}, 'anonymous')
+        other.set_many(1, {1: frozenset(['c'])}, 42)
+        permcache.invalidate_objects(1, [1])
+        other.sync()
+        self.assertEquals({}, other.get_many(1, [1], 'anonymous'))
+        self.assertEquals({}, other.get_many(1, [1], 42))
+        self.assertEquals([2], other.get_many(1, [1, 2], 'anonymous').keys())
+
+        permcache.invalidate_all()
+        other.sync()
+        self.assertEquals(0, len(other))
+
+    def test_no_shared_cache(self):
+        with patch.object(permcache, 'cache', DummyCache('permcache-none', {})):
+            perm_cache = PermissionCache(max_size=10, timeout=60)
+            perm_cache.set_many(1, {1: frozenset()}, 'anonymous')
+            perm_cache.sync()
+            self.assertEquals(0, len(perm_cache))
@@ -0,0 +1,295 @@
+"""
+Process-wide pools of raw psycopg2 connections.
+
+Code that talks to PostGIS stores directly (the gazetteer, layer bounds,
+datatables joins...) gets its connections from here instead of calling
+psycopg2.connect() for every operation:
+
+    conn = dbpool.connect(dsn)
+    try:
+        cur = conn.cursor()
+        ...
+        conn.commit()
+    finally:
+        conn.close()    # returns the connection to the pool
+
+There is one pool per connection string, so in practice one per database
+or layer store.  A pool opens at most settings.DB_POOL_MAX_SIZE
+connections; callers wait up to settings.DB_POOL_TIMEOUT seconds for one
+to be returned before PoolTimeout is raised.  Returned connections are
+rolled back, and a connection that sat idle for more than
+settings.DB_POOL_CHECK_INTERVAL seconds is checked with a trivial query
+before it is handed out again.  Setting DB_POOL_MAX_SIZE to 0 disables
+pooling: connect() then opens a new connection and close() closes it.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+import psycopg2
+import psycopg2.extensions
+from django.conf import settings
+
+logger = logging.getLogger("geonode.dbpool")
+
+_DBNAME = re.compile(r"dbname\s*=\s*'?([^'\s]+)")
+
+
+class PoolError(psycopg2.Error):
+    pass
+
+
+class PoolTimeout(PoolError):
+    """
+    No connection was returned to a full pool within the checkout timeout
+    """
+    pass
+
+
+class ConnectionPool(object):
+    """
+    Bounded pool of connections to a single database.
+    """
+
+    def __init__(self, dsn, max_size, timeout, check_interval, max_idle, connect_timeout=None):
+        match = _DBNAME.search(dsn)
+        self.name = match.group(1) if match else dsn
+        self.dsn = dsn
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self.max_idle = max_idle
+        self.connect_timeout = connect_timeout
+        self._cond = threading.Condition(threading.Lock())
+        self._reset()
+
+    def _reset(self):
+        # (connection, time it was returned), most recently returned last
+        self._idle = []
+        self._size = 0
+        self._pid = os.getpid()
+        self.counters = dict.fromkeys(('connects', 'checkouts', 'waits', 'timeouts', 'discarded',
+                                       'failed_checks'), 0)
+        self.wait_time = 0.0
+
+    def _connect(self):
+        if self.connect_timeout:
+            return psycopg2.connect(self.dsn, connect_timeout=self.connect_timeout)
+        return psycopg2.connect(self.dsn)
+
+    def _check_fork(self):
+        # Connections inherited from a parent process must not be used or
+        # closed here, that would break the parent's session.
+        if self._pid != os.getpid():
+            self._reset()
+
+    def _discard(self, conn):
+        self._size -= 1
+        self.counters['discarded'] += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _healthy(self, conn):
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error, e:
+            logger.info("Discarding broken connection to %s: %s", self.name, e)
+            self.counters['failed_checks'] += 1
+            return False
+
+    def getconn(self):
+        """
+        Check out a connection, opening a new one if none is idle and the
+        pool is not full.
+        """
+        deadline = waited = None
+        with self._cond:
+            self._check_fork()
+            self.counters['checkouts'] += 1
+            while True:
+                now = time.time()
+                # Close connections that have not been used for a while
+                while self._idle and self.max_idle and now - self._idle[0][1] > self.max_idle:
+                    self._discard(self._idle.pop(0)[0])
+                if self._idle:
+                    conn, returned = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    conn, returned = None, None
+                    self._size += 1
+                    break
+                if deadline is None:
+                    waited, deadline = now, now + self.timeout
+                    self.counters['waits'] += 1
+                if now >= deadline:
+                    self.counters['timeouts'] += 1
+                    self.wait_time += now - waited
+                    raise PoolTimeout("No connection to %s available after %s seconds" % (self.name, self.timeout))
+                self._cond.wait(deadline - now)
+            if waited is not None:
+                self.wait_time += time.time() - waited
+
+        # Health checks and new connections happen outside the lock
+        if conn is not None:
+            if conn.closed or (time.time() - returned > self.check_interval and not self._healthy(conn)):
+                with self._cond:
+                    self._discard(conn)
+                conn = None
+            else:
+                return conn
+        try:
+            conn = self._connect()
+        except:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self.counters['connects'] += 1
+        return conn
+
+    def putconn(self, conn):
+        """
+        Return a checked out connection, rolling back any transaction left
+        open.  Broken connections are closed instead of being kept.
+        """
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+        keep = not conn.closed
+        if keep and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                keep = False
+        with self._cond:
+            if keep:
+                self._idle.append((conn, time.time()))
+            else:
+                self._discard(conn)
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            self._check_fork()
+            while self._idle:
+                self._discard(self._idle.pop()[0])
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self.counters)
+            stats.update({
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'max_size': self.max_size,
+                'wait_time': round(self.wait_time, 3),
+            })
+            return stats
+
+
+class PooledConnection(object):
+    """
+    Wrapper around a checked out psycopg2 connection whose close() returns
+    the connection to its pool.  Everything else is passed through.
+    """
+
+    def __init__(self, pool, conn):
+        self.__dict__['_pool'] = pool
+        self.__dict__['_conn'] = conn
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise psycopg2.InterfaceError("connection already closed")
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+    @property
+    def closed(self):
+        return self._conn is None or self._conn.closed
+
+    def close(self):
+        conn = self._conn
+        if conn is not None:
+            self.__dict__['_conn'] = None
+            self._pool.putconn(conn)
+
+    def __del__(self):
+        # Do not lose the pool slot if a caller forgets to close
+        if self.__dict__.get('_conn') is not None:
+            self.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(dsn):
+    pool = _pools.get(dsn)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(dsn)
+            if pool is None:
+                pool = _pools[dsn] = ConnectionPool(
+                    dsn, settings.DB_POOL_MAX_SIZE, settings.DB_POOL_TIMEOUT, settings.DB_POOL_CHECK_INTERVAL,
+                    settings.DB_POOL_MAX_IDLE, settings.DB_POOL_CONNECT_TIMEOUT)
+    return pool
+
+
+def connect(dsn):
+    """
+    Return a pooled connection for a libpq connection string, see the
+    module documentation.
+    """
+    if not settings.DB_POOL_MAX_SIZE:
+        return psycopg2.connect(dsn)
+    pool = get_pool(dsn)
+    return PooledConnection(pool, pool.getconn())
+
+
+def datastore_dsn(dbname=None):
+    """
+    Connection string of the PostGIS datastore (settings.DB_DATASTORE_*),
+    or of another database (layer store) on the same server.
+    """
+    return "dbname='%s' user='%s' password='%s' port=%s host='%s'" % (
+        dbname or settings.DB_DATASTORE_DATABASE, settings.DB_DATASTORE_USER, settings.DB_DATASTORE_PASSWORD,
+        settings.DB_DATASTORE_PORT, settings.DB_DATASTORE_HOST)
+
+
+def pool_stats():
+    """
+    Return a dict of database name -> pool counters for this process
+    (summed over the pools of a database opened with different credentials).
+    """
+    with _pools_lock:
+        pools = _pools.values()
+    stats = {}
+    for pool in pools:
+        pool_stats = pool.stats()
+        if pool.name in stats:
+            for key, value in pool_stats.items():
+                stats[pool.name][key] += value
+        else:
+            stats[pool.name] = pool_stats
+    return stats
+
+
+def close_idle():
+    """
+    Close the idle connections of every pool in this process.
+    """
+    with _pools_lock:
+        pools = _pools.values()
+    for pool in pools:
+        pool.closeall()
@@ -0,0 +1,449 @@
+"""
+In-process prefix index of gazetteer placenames.
+
+When settings.GAZETTEER_PREFIX_INDEX is enabled, placename autocomplete
+searches are answered from a sorted, array-backed key table held in each
+worker instead of an istartswith query against gazetteer_gazetteerentry.
+The table is partitioned by layer so that add_to_gazetteer and
+delete_from_gazetteer only have to rebuild the partition of the layer they
+touched.
+
+Workers learn about layers changed by other processes through a short change
+log kept in the Django cache, so a shared cache backend (memcached) is needed
+for the index to stay current across processes.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+import heapq
+from itertools import chain, groupby
+import logging
+import sys
+import threading
+from django.core.cache import cache
+from geonode.gazetteer.models import GazetteerEntry
+
+__author__ = 'mbertrand'
+
+logger = logging.getLogger("geonode.gazetteer.index")
+
+INDEX_FIELDS = ('id', 'place_name', 'layer_name', 'project', 'username',
+                'julian_start', 'julian_end', 'latitude', 'longitude',
+                'start_date', 'end_date')
+
+# Rows are exposed with the same attribute names as GazetteerEntry so that
+# callers can format index results and ORM results the same way.
+IndexedPlacename = namedtuple('IndexedPlacename', INDEX_FIELDS)
+
+INDEX_SERIAL_KEY = 'gazetteer_index_serial'
+INDEX_LOG_KEY = 'gazetteer_index_log'
+INDEX_LOG_SIZE = 200
+# Sentinels for open-ended placename dates
+JULIAN_MIN = -sys.maxint - 1
+JULIAN_MAX = sys.maxint
+# Prefix matches above which a date query goes through the interval trees
+INTERVAL_TREE_THRESHOLD = 1000
+# Placenames per interval tree, see LayerKeyTable.date_positions
+DATE_BLOCK_SIZE = 512
+# Placenames per id ordered block, small and large, see LayerKeyTable.by_id
+ID_BLOCK_SIZES = (512 * 64, 512)
+# Longest relative expiry memcached accepts
+INDEX_CACHE_TIMEOUT = 60 * 60 * 24 * 30
+
+
+def date_match(julian_start, julian_end, start_date=None, end_date=None):
+    """
+    Apply the gazetteer start/end date filter to a single placename, with the
+    same NULL handling as the ORM criteria in getGazetteerResults.
+    """
+    if start_date and end_date:
+        return (julian_end is None or julian_end >= start_date) and \
+               (julian_start is None or julian_start <= end_date)
+    elif start_date:
+        if julian_end is not None:
+            return julian_end >= start_date
+        return julian_start is None or julian_start <= start_date
+    elif end_date:
+        if julian_start is not None:
+            return julian_start <= end_date
+        return julian_end is None or julian_end >= end_date
+    return True
+
+
+def bbox_parts(bbox):
+    """
+    Split a (min longitude, min latitude, max longitude, max latitude) box
+    that crosses the antimeridian (min longitude > max longitude) into two
+    boxes.
+    """
+    minx, miny, maxx, maxy = bbox
+    if minx <= maxx:
+        return [(minx, miny, maxx, maxy)]
+    return [(minx, miny, 180.0, maxy), (-180.0, miny, maxx, maxy)]
+
+
+def in_bbox(latitude, longitude, boxes):
+    for minx, miny, maxx, maxy in boxes:
+        if minx <= longitude <= maxx and miny <= latitude <= maxy:
+            return True
+    return False
+
+
+def julian_interval(julian_start, julian_end):
+    """
+    Normalize the dates of a placename to a closed interval, with open ends
+    mapped to sentinels (the in-process equivalent of the
+    gazetteer_julian_range SQL function).
+    """
+    lower = JULIAN_MIN if julian_start is None else julian_start
+    upper = JULIAN_MAX if julian_end is None else julian_end
+    if lower > upper:
+        lower, upper = upper, lower
+    return lower, upper
+
+
+def query_interval(start_date=None, end_date=None):
+    """
+    Interval that every placename matching a start/end date filter overlaps;
+    date_match still has to be applied to the overlapping placenames.
+    """
+    return (start_date or JULIAN_MIN), (end_date or JULIAN_MAX)
+
+
+class IntervalTree(object):
+    """
+    Static centered interval tree over closed (lower, upper, value) intervals.
+    """
+    __slots__ = ('center', 'by_lower', 'by_upper', 'left', 'right')
+
+    def __init__(self, intervals):
+        endpoints = sorted(i[0] for i in intervals) if intervals else [0]
+        self.center = endpoints[len(endpoints) // 2]
+        here, left, right = [], [], []
+        for interval in intervals:
+            if interval[1] < self.center:
+                left.append(interval)
+            elif interval[0] > self.center:
+                right.append(interval)
+            else:
+                here.append(interval)
+        self.by_lower = sorted(here, key=lambda i: i[0])
+        self.by_upper = sorted(here, key=lambda i: i[1], reverse=True)
+        self.left = IntervalTree(left) if left else None
+        self.right = IntervalTree(right) if right else None
+
+    def overlapping(self, lower, upper):
+        """
+        Yield the values of all intervals that overlap [lower, upper]
+        """
+        pending = [self]
+        while pending:
+            node = pending.pop()
+            if upper < node.center:
+                for interval in node.by_lower:
+                    if interval[0] > upper:
+                        break
+                    yield interval[2]
+                if node.left is not None:
+                    pending.append(node.left)
+            elif lower > node.center:
+                for interval in node.by_upper:
+                    if interval[1] < lower:
+                        break
+                    yield interval[2]
+                if node.right is not None:
+                    pending.append(node.right)
+            else:
+                for interval in node.by_lower:
+                    yield interval[2]
+                if node.left is not None:
+                    pending.append(node.left)
+                if node.right is not None:
+                    pending.append(node.right)
+
+
+class LayerKeyTable(object):
+    """
+    Placenames of a single layer, sorted by lowercased name so that a prefix
+    lookup is a binary search followed by a scan of the matching run.  When
+    the prefix matches many names, date queries go through interval trees
+    over the placename dates of consecutive blocks of DATE_BLOCK_SIZE names,
+    built on first use, so that only the blocks of the matching run are
+    searched.  Paged searches read the matching run in id order by merging
+    the id ordered copies of its blocks (ID_BLOCK_SIZES), also built on
+    first use.
+    """
+    __slots__ = ('keys', 'rows', '_date_blocks', '_id_blocks')
+
+    def __init__(self, rows):
+        rows = sorted(rows, key=lambda r: (r.place_name or u'').lower())
+        self.keys = [(r.place_name or u'').lower() for r in rows]
+        self.rows = rows
+        self._date_blocks = {}
+        self._id_blocks = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def prefix_range(self, prefix):
+        return bisect_left(self.keys, prefix), bisect_left(self.keys, prefix + u'\uffff')
+
+    def prefix(self, prefix):
+        first, last = self.prefix_range(prefix)
+        for i in xrange(first, last):
+            yield self.rows[i]
+
+    def date_block(self, block):
+        """
+        Interval tree over the dates of the placenames of a block, with their
+        positions as values.
+        """
+        tree = self._date_blocks.get(block)
+        if tree is None:
+            first = block * DATE_BLOCK_SIZE
+            tree = IntervalTree([julian_interval(r.julian_start, r.julian_end) + (first + i,)
+                                 for i, r in enumerate(self.rows[first:first + DATE_BLOCK_SIZE])])
+            self._date_blocks[block] = tree
+        return tree
+
+    def date_positions(self, first, last, lower, upper):
+        """
+        Positions in [first, last), in order, of the placenames whose dates
+        may overlap [lower, upper]: the blocks entirely within the range are
+        searched with their interval trees, the partial blocks at its ends
+        are scanned.
+        """
+        first_block = -(-first // DATE_BLOCK_SIZE)
+        last_block = last // DATE_BLOCK_SIZE
+        if first_block >= last_block:
+            return xrange(first, last)
+        return chain(xrange(first, first_block * DATE_BLOCK_SIZE),
+                     chain.from_iterable(sorted(self.date_block(block).overlapping(lower, upper))
+                                         for block in xrange(first_block, last_block)),
+                     xrange(last_block * DATE_BLOCK_SIZE, last))
+
+    def id_block(self, size, block):
+        """
+        (ids, positions) of the placenames of a block of ``size`` names,
+        ordered by id.
+        """
+        entry = self._id_blocks.get((size, block))
+        if entry is None:
+            first = block * size
+            positions = sorted(xrange(first, min(first + size, len(self.rows))), key=lambda i: self.rows[i].id)
+            entry = (array('l', [self.rows[i].id for i in positions]), array('l', positions))
+            self._id_blocks[(size, block)] = entry
+        return entry
+
+    def _rows_at(self, positions, start):
+        for i in xrange(start, len(positions)):
+            yield self.rows[positions[i]]
+
+    def by_id(self, prefix, after=None):
+        """
+        Yield rows whose name starts with ``prefix`` and whose id is greater
+        than ``after``, in id order.  The matching run is split into the
+        largest whole blocks it contains, plus at most two partial blocks
+        at its ends that are sorted here, and the blocks are merged.
+        """
+        first, last = self.prefix_range(prefix)
+        small = ID_BLOCK_SIZES[-1]
+        runs = []
+        position = first
+        while position < last:
+            for size in ID_BLOCK_SIZES:
+                if position % size == 0 and position + size <= last:
+                    ids, positions = self.id_block(size, position // size)
+                    start = 0 if after is None else bisect_right(ids, after)
+                    runs.append(self._rows_at(positions, start))
+                    position += size
+                    break
+            else:
+                end = min(last, (position // small + 1) * small)
+                runs.append(iter(sorted(row for row in self.rows[position:end]
+                                        if after is None or row.id > after)))
+                position = end
+        # Rows compare by their first field, the id
+        return heapq.merge(*runs)
+
+    def search(self, prefix, start_date=None, end_date=None):
+        """
+        Yield rows whose name starts with ``prefix`` and that match the date
+        filter.
+        """
+        first, last = self.prefix_range(prefix)
+        if (start_date or end_date) and last - first > INTERVAL_TREE_THRESHOLD:
+            positions = self.date_positions(first, last, *query_interval(start_date, end_date))
+        else:
+            positions = xrange(first, last)
+        for i in positions:
+            row = self.rows[i]
+            if date_match(row.julian_start, row.julian_end, start_date, end_date):
+                yield row
+
+
+class PlacenameIndex(object):
+    """
+    Prefix index over all gazetteer placenames, partitioned by layer name.
+    """
+
+    def __init__(self):
+        self._layers = {}
+        self._lock = threading.RLock()
+        self.serial = None
+
+    def __len__(self):
+        return sum(len(table) for table in self._layers.values())
+
+    def build(self, rows):
+        """
+        Replace the index contents with ``rows`` (IndexedPlacename tuples
+        ordered by layer name).
+        """
+        layers = {}
+        for layer_name, layer_rows in groupby(rows, lambda r: r.layer_name):
+            layers[layer_name] = LayerKeyTable(list(layer_rows))
+        with self._lock:
+            self._layers = layers
+
+    def load(self):
+        """
+        Load every placename from the gazetteer table.
+        """
+        serial = cache.get(INDEX_SERIAL_KEY)
+        entries = GazetteerEntry.objects.values_list(*INDEX_FIELDS).order_by('layer_name')
+        self.build(IndexedPlacename(*row) for row in entries.iterator())
+        self.serial = serial or 0
+        logger.info("Loaded %d placenames into gazetteer index", len(self))
+
+    def set_layer(self, layer_name, rows):
+        with self._lock:
+            if rows:
+                self._layers[layer_name] = LayerKeyTable(rows)
+            else:
+                self._layers.pop(layer_name, None)
+
+    def reload_layer(self, layer_name):
+        """
+        Rebuild the partition of a single layer from the gazetteer table.
+        """
+        entries = GazetteerEntry.objects.filter(layer_name__exact=layer_name).values_list(*INDEX_FIELDS)
+        self.set_layer(layer_name, [IndexedPlacename(*row) for row in entries.iterator()])
+
+    def remove_layer(self, layer_name):
+        self.set_layer(layer_name, [])
+
+    def sync(self):
+        """
+        Apply layer changes recorded by other processes since the last sync.
+        Falls back to a full reload if the change log does not have every
+        change since then, because it no longer reaches back far enough or
+        concurrent writers overwrote each other's entries.
+        """
+        serial = cache.get(INDEX_SERIAL_KEY)
+        if serial is None or serial == self.serial:
+            return
+        log = cache.get(INDEX_LOG_KEY) or []
+        changes = dict((change, name) for change, name in log
+                       if self.serial is not None and self.serial < change <= serial)
+        if self.serial is None or serial < self.serial or len(changes) != serial - self.serial:
+            self.load()
+            return
+        changed = set(changes.values())
+        for layer_name in changed:
+            self.reload_layer(layer_name)
+        self.serial = serial
+
+    def search(self, place_name, layers=None, start_date=None, end_date=None,
+               project=None, user=None, limit=None, bbox=None, after=None):
+        """
+        Return IndexedPlacename rows whose name starts with ``place_name``
+        (case-insensitive), filtered the same way as getGazetteerResults.
+        With a ``limit``, return the first ``limit`` matches with an id
+        greater than ``after``, ordered by id, reading no further.
+        """
+        prefix = place_name.lower()
+        boxes = bbox_parts(bbox) if bbox else None
+        with self._lock:
+            if layers:
+                tables = [self._layers[name] for name in layers if name in self._layers]
+            else:
+                tables = self._layers.values()
+        if limit:
+            rows = heapq.merge(*[table.by_id(prefix, after) for table in tables])
+            dated = start_date or end_date
+        else:
+            rows = chain.from_iterable(table.search(prefix, start_date, end_date) for table in tables)
+            dated = False
+        results = []
+        for row in rows:
+            if dated and not date_match(row.julian_start, row.julian_end, start_date, end_date):
+                continue
+            if project and row.project != project:
+                continue
+            if user and row.username != user:
+                continue
+            if boxes and not in_bbox(row.latitude, row.longitude, boxes):
+                continue
+            results.append(row)
+            if limit and len(results) >= limit:
+                break
+        return results
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """
+    Return this process's placename index, loading it on first use.
+    """
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                index = PlacenameIndex()
+                index.load()
+                _index = index
+    _index.sync()
+    return _index
+
+
+def warm_index():
+    """
+    Load the index in the background so that the first autocomplete request
+    of a new worker does not pay for it.
+    """
+    loader = threading.Thread(target=get_index, name="gazetteer-index-loader")
+    loader.daemon = True
+    loader.start()
+
+
+def layer_changed(layer_name):
+    """
+    Record that the placenames of a layer were rewritten, and bring the local
+    index up to date if it is loaded.
+
+    The serial is bumped atomically; the log is not, so entries lost to a
+    concurrent writer make the other processes reload their whole index
+    (see PlacenameIndex.sync).
+    """
+    serial = None
+    try:
+        cache.add(INDEX_SERIAL_KEY, 0, INDEX_CACHE_TIMEOUT)
+        serial = cache.incr(INDEX_SERIAL_KEY)
+        log = cache.get(INDEX_LOG_KEY) or []
+        log.append((serial, layer_name))
+        cache.set(INDEX_LOG_KEY, log[-INDEX_LOG_SIZE:], INDEX_CACHE_TIMEOUT)
+    except ValueError:
+        # Cache backend does not keep values (dummy://), no change log
+        pass
+
+    if _index is None:
+        return
+    if serial is None:
+        _index.reload_layer(layer_name)
+    else:
+        _index.sync()
@@ -0,0 +1,128 @@
+from multiprocessing import Pool, cpu_count
+from optparse import make_option
+import json
+import os
+import tempfile
+import time
+import traceback
+from django.core.management import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Count
+from geonode.gazetteer.models import GazetteerEntry, GazetteerSyncState
+from geonode.maps.models import Layer
+
+
+def close_connections():
+    # Forked workers must not share the parent's database sockets
+    for connection in connections.all():
+        connection.close()
+
+
+def rebuild_layer(layer_id):
+    """
+    Rebuild the gazetteer entries of one layer, in its own transaction.
+    Returns (layer name, number of placenames, seconds, error or None).
+    """
+    started = time.time()
+    name = str(layer_id)
+    try:
+        layer = Layer.objects.get(pk=layer_id)
+        name = layer.name
+        # Forget incremental sync progress so that every feature is reloaded
+        GazetteerSyncState.objects.filter(layer_name=layer.name).delete()
+        layer.update_gazetteer()
+        count = GazetteerEntry.objects.filter(layer_name__exact=layer.name).count()
+        return name, count, time.time() - started, None
+    except Exception:
+        return name, 0, time.time() - started, traceback.format_exc()
+    finally:
+        close_connections()
+
+
+class Command(BaseCommand):
+    help = """
+    Rebuild the gazetteer entries of all layers with in_gazetteer=True (or of
+    the named layers), several layers at a time in a pool of processes.
+    Progress is saved to a state file after each layer; if the rebuild is
+    interrupted, running the command again skips the layers already done.
+    """
+    args = '[layer_name ...]'
+
+    option_list = BaseCommand.option_list + (
+        make_option('-p', '--processes', dest='processes', type='int', default=cpu_count(),
+                    help='Number of layers to rebuild in parallel (default: number of CPUs)'),
+        make_option('--state-file', dest='state_file',
+                    default=os.path.join(tempfile.gettempdir(), 'rebuild_gazetteer.json'),
+                    help='File recording the layers already rebuilt'),
+        make_option('--restart', action='store_true', dest='restart', default=False,
+                    help='Ignore the progress of a previous, interrupted rebuild'),
+    )
+
+    def load_state(self, path, restart):
+        if restart or not os.path.exists(path):
+            return {'started': time.time(), 'done': [], 'failed': {}}
+        with open(path) as state_file:
+            return json.load(state_file)
+
+    def save_state(self, path, state):
+        with open(path + '.tmp', 'w') as state_file:
+            json.dump(state, state_file)
+        os.rename(path + '.tmp', path)
+
+    def handle(self, *args, **options):
+        processes = options['processes']
+        if processes < 1:
+            raise CommandError("--processes must be at least 1")
+        state_path = options['state_file']
+        state = self.load_state(state_path, options['restart'])
+        done = set(state['done'])
+        if done:
+            print("Resuming the rebuild started %s, %d layers already done" %
+                  (time.ctime(state['started']), len(done)))
+
+        layers = Layer.objects.filter(in_gazetteer=True)
+        if args:
+            layers = layers.filter(name__in=args)
+        layers = dict((name, pk) for pk, name in layers.values_list('id', 'name') if name not in done)
+
+        # Start with the layers that had the most placenames, so that the
+        # largest ones do not end up running alone at the end
+        sizes = dict(GazetteerEntry.objects.filter(layer_name__in=layers.keys()).values_list(
+            'layer_name').annotate(Count('id')).order_by())
+        names = sorted(layers, key=lambda name: sizes.get(name, 0), reverse=True)
+
+        total = len(names)
+        print("Rebuilding the gazetteer for %d layers with %d processes" % (total, processes))
+        close_connections()
+        pool = Pool(max(min(processes, total), 1))
+        started = time.time()
+        rebuilt = placenames = 0
+        try:
+            results = pool.imap_unordered(rebuild_layer, [layers[name] for name in names])
+            for i, (name, count, seconds, error) in enumerate(results, 1):
+                if error:
+                    state['failed'][name] = error
+                    print("[%d/%d] %s failed after %.1fs:\n%s" % (i, total, name, seconds, error))
+                else:
+                    state['done'].append(name)
+                    state['failed'].pop(name, None)
+                    rebuilt += 1
+                    placenames += count
+                    print("[%d/%d] %s: %d placenames in %.1fs" % (i, total, name, count, seconds))
+                self.save_state(state_path, state)
+            pool.close()
+        except KeyboardInterrupt:
+            pool.terminate()
+            raise CommandError("Interrupted, run the command again to resume")
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+        print("Rebuilt %d layers (%d placenames) in %.1fs" % (rebuilt, placenames, time.time() - started))
+        if state['failed']:
+            raise CommandError("%d layers failed: %s; run the command again to retry them" %
+                               (len(state['failed']), ", ".join(sorted(state['failed']))))
+        if os.path.exists(state_path):
+            os.remove(state_path)
@@ -0,0 +1,54 @@
+# encoding: utf-8
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'GazetteerSyncState'
+        db.create_table('gazetteer_gazetteersyncstate', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('layer_name', self.gf('django.db.models.fields.CharField')(unique=True, max_length=255)),
+            ('signature', self.gf('django.db.models.fields.CharField')(max_length=32)),
+            ('watermark', self.gf('django.db.models.fields.BigIntegerField')(default=0)),
+            ('last_sync', self.gf('django.db.models.fields.DateTimeField')(auto_now=True, blank=True)),
+        ))
+        db.send_create_signal('gazetteer', ['GazetteerSyncState'])
+
+    def backwards(self, orm):
+        # Deleting model 'GazetteerSyncState'
+        db.delete_table('gazetteer_gazetteersyncstate')
+
+    models = {
+        'gazetteer.gazetteerentry': {
+            'Meta': {'unique_together': "(('layer_name', 'layer_attribute', 'feature_fid'),)", 'object_name': 'GazetteerEntry'},
+            'end_date': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'feature': ('django.contrib.gis.db.models.fields.GeometryField', [], {'null': 'True', 'blank': 'True'}),
+            'feature_fid': ('django.db.models.fields.BigIntegerField', [], {}),
+            'feature_type': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'julian_end': ('django.db.models.fields.IntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'julian_start': ('django.db.models.fields.IntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'latitude': ('django.db.models.fields.FloatField', [], {}),
+            'layer_attribute': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'layer_name': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'longitude': ('django.db.models.fields.FloatField', [], {}),
+            'place_name': ('django.db.models.fields.TextField', [], {}),
+            'project': ('django.db.models.fields.CharField', [], {'max_length': '255', 'null': 'True', 'blank': 'True'}),
+            'start_date': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'username': ('django.db.models.fields.CharField', [], {'max_length': '30', 'null': 'True', 'blank': 'True'})
+        },
+        'gazetteer.gazetteersyncstate': {
+            'Meta': {'object_name': 'GazetteerSyncState'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_sync': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'layer_name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '255'}),
+            'signature': ('django.db.models.fields.CharField', [], {'max_length': '32'}),
+            'watermark': ('django.db.models.fields.BigIntegerField', [], {'default': '0'})
+        }
+    }
+
+    complete_apps = ['gazetteer']
@@ -0,0 +1,63 @@
+# encoding: utf-8
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def range_types_supported(self):
+        # Range types need PostgreSQL 9.2 or later
+        if db.backend_name != 'postgres':
+            return False
+        return int(db.execute("SHOW server_version_num")[0][0]) >= 90200
+
+    def forwards(self, orm):
+        if not self.range_types_supported():
+            return
+        # Function and GiST index for temporal searches (GAZETTEER_TEMPORAL_INDEX)
+        db.execute("""
+            CREATE OR REPLACE FUNCTION gazetteer_julian_range(integer, integer) RETURNS int4range AS $$
+                SELECT CASE WHEN $1 > $2 THEN int4range($2, $1, '[]') ELSE int4range($1, $2, '[]') END
+            $$ LANGUAGE SQL IMMUTABLE
+        """)
+        db.execute("CREATE INDEX gazetteer_julian_range_idx ON gazetteer_gazetteerentry "
+                   "USING gist (gazetteer_julian_range(julian_start, julian_end))")
+
+    def backwards(self, orm):
+        if not self.range_types_supported():
+            return
+        db.execute("DROP INDEX IF EXISTS gazetteer_julian_range_idx")
+        db.execute("DROP FUNCTION IF EXISTS gazetteer_julian_range(integer, integer)")
+
+    models = {
+        'gazetteer.gazetteerentry': {
+            'Meta': {'unique_together': "(('layer_name', 'layer_attribute', 'feature_fid'),)", 'object_name': 'GazetteerEntry'},
+            'end_date': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'feature': ('django.contrib.gis.db.models.fields.GeometryField', [], {'null': 'True', 'blank': 'True'}),
+            'feature_fid': ('django.db.models.fields.BigIntegerField', [], {}),
+            'feature_type': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'julian_end': ('django.db.models.fields.IntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'julian_start': ('django.db.models.fields.IntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'latitude': ('django.db.models.fields.FloatField', [], {}),
+            'layer_attribute': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'layer_name': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'longitude': ('django.db.models.fields.FloatField', [], {}),
+            'place_name': ('django.db.models.fields.TextField', [], {}),
+            'project': ('django.db.models.fields.CharField', [], {'max_length': '255', 'null': 'True', 'blank': 'True'}),
+            'start_date': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'username': ('django.db.models.fields.CharField', [], {'max_length': '30', 'null': 'True', 'blank': 'True'})
+        },
+        'gazetteer.gazetteersyncstate': {
+            'Meta': {'object_name': 'GazetteerSyncState'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_sync': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'layer_name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '255'}),
+            'signature': ('django.db.models.fields.CharField', [], {'max_length': '32'}),
+            'watermark': ('django.db.models.fields.BigIntegerField', [], {'default': '0'})
+        }
+    }
+
+    complete_apps = ['gazetteer']
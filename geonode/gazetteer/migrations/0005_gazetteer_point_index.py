@@ -0,0 +1,51 @@
+# encoding: utf-8
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        if db.backend_name != 'postgres':
+            return
+        # GiST index on placename points for bounding box searches
+        db.execute("CREATE INDEX gazetteer_point_idx ON gazetteer_gazetteerentry "
+                   "USING gist (ST_SetSRID(ST_MakePoint(longitude, latitude), 4326))")
+
+    def backwards(self, orm):
+        if db.backend_name != 'postgres':
+            return
+        db.execute("DROP INDEX IF EXISTS gazetteer_point_idx")
+
+    models = {
+        'gazetteer.gazetteerentry': {
+            'Meta': {'unique_together': "(('layer_name', 'layer_attribute', 'feature_fid'),)", 'object_name': 'GazetteerEntry'},
+            'end_date': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'feature': ('django.contrib.gis.db.models.fields.GeometryField', [], {'null': 'True', 'blank': 'True'}),
+            'feature_fid': ('django.db.models.fields.BigIntegerField', [], {}),
+            'feature_type': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'julian_end': ('django.db.models.fields.IntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'julian_start': ('django.db.models.fields.IntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'latitude': ('django.db.models.fields.FloatField', [], {}),
+            'layer_attribute': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'layer_name': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'longitude': ('django.db.models.fields.FloatField', [], {}),
+            'place_name': ('django.db.models.fields.TextField', [], {}),
+            'project': ('django.db.models.fields.CharField', [], {'max_length': '255', 'null': 'True', 'blank': 'True'}),
+            'start_date': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'username': ('django.db.models.fields.CharField', [], {'max_length': '30', 'null': 'True', 'blank': 'True'})
+        },
+        'gazetteer.gazetteersyncstate': {
+            'Meta': {'object_name': 'GazetteerSyncState'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_sync': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'layer_name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '255'}),
+            'signature': ('django.db.models.fields.CharField', [], {'max_length': '32'}),
+            'watermark': ('django.db.models.fields.BigIntegerField', [], {'default': '0'})
+        }
+    }
+
+    complete_apps = ['gazetteer']
@@ -1,5 +1,8 @@
 from django.utils.translation import ugettext as _
 from django.contrib.gis.db import models
+from django.core.cache import cache
+from django.db.models import signals
+from geonode.maps.models import Layer
 
 # Querying postgis database for features then saving as django model object is
 # significantly slower than doing everything via SQL on postgis database only.
@@ -7,6 +10,9 @@ from south.modelsinspector import add_introspection_rules
 
 add_introspection_rules([], ["^django\.contrib\.gis\.db\.models\.fields\.GeometryField"])
 
+# Cached HTML link to the source layer of a placename, see formatSourceLinks
+SOURCE_LINK_CACHE_KEY = 'gazetteer_sourcelink_%s'
+
 
 class GazetteerEntry(models.Model):
     layer_name = models.CharField(_('Layer Name'), max_length=255, blank=False, null=False)
@@ -28,3 +34,24 @@ class GazetteerEntry(models.Model):
     class Meta:
         unique_together = (("layer_name", "layer_attribute", "feature_fid"))
 
+
+
+class GazetteerSyncState(models.Model):
+    """
+    Progress of the incremental gazetteer synchronization of a layer
+    (see GAZETTEER_INCREMENTAL_SYNC)
+    """
+    layer_name = models.CharField(_('Layer Name'), max_length=255, unique=True)
+    signature = models.CharField(_('Gazetteer Settings Signature'), max_length=32)
+    watermark = models.BigIntegerField(_('Last Applied Change'), default=0)
+    """
+    Id of the oldest transaction whose feature changes are not applied yet
+    """
+    last_sync = models.DateTimeField(_('Last Synchronized'), auto_now=True)
+
+
+def invalidate_source_link(instance, sender, **kwargs):
+    cache.delete(SOURCE_LINK_CACHE_KEY % instance.name)
+
+signals.post_save.connect(invalidate_source_link, sender=Layer)
+signals.post_delete.connect(invalidate_source_link, sender=Layer)
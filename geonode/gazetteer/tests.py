@@ -1,8 +1,19 @@
 import json
+import threading
+import time
+from itertools import islice
 from lxml import etree
+from mock import patch
+from uuid import uuid4
 from django.conf import settings
-from django.test import TestCase, Client
-from geonode.gazetteer.utils import getGazetteerEntry
+from django.test import TestCase, TransactionTestCase, Client
+from geonode.gazetteer import utils
+from geonode.gazetteer.models import GazetteerEntry, GazetteerSyncState
+from geonode.gazetteer.utils import getGazetteerEntry, formatSourceLinks, getExternalServiceResults, CircuitBreaker, \
+    CopyStream
+from geonode.gazetteer.index import IndexedPlacename, PlacenameIndex, IntervalTree, LayerKeyTable, \
+    date_match
+from geonode.maps.models import Layer, LayerAttribute
 
 
 class GazetteerTest(TestCase):
@@ -18,6 +29,14 @@ class GazetteerTest(TestCase):
             self.assertEquals(5, entry["id"])
             self.assertEquals("Paradise5", entry["placename"])
 
+    def test_format_source_links(self):
+        if settings.USE_GAZETTEER:
+            links = formatSourceLinks(['CA1', 'CA2', 'CA1'])
+            self.assertEquals(2, len(links))
+            self.assertTrue("base:CA1" in links['CA1'])
+            self.assertTrue("base:CA2" in links['CA2'])
+            self.assertEquals({}, formatSourceLinks(['nosuchlayer']))
+
     def test_gazetteer_placename(self):
         if settings.USE_GAZETTEER:
             c = Client()
@@ -36,6 +55,47 @@ class GazetteerTest(TestCase):
             self.assertEquals(1, len(placenames))
             self.assertEquals("Paradise2", placenames[0].find("placename").text)
 
+    def test_gazetteer_paging(self):
+        if settings.USE_GAZETTEER:
+            c = Client()
+            response = c.get("/gazetteer/Paradise", {"limit": 3})
+            placenames = json.loads(response.content)
+            self.assertEquals(3, len(placenames))
+            self.assertTrue('rel="next"' in response['Link'])
+            next_url = response['Link'][1:response['Link'].index('>')]
+            response = c.get(next_url)
+            remaining = json.loads(response.content)
+            self.assertEquals(2, len(remaining))
+            self.assertFalse(response.has_header('Link'))
+            self.assertFalse(set(p["gazetteer_id"] for p in placenames) & set(p["gazetteer_id"] for p in remaining))
+
+    def test_gazetteer_bad_cursor(self):
+        if settings.USE_GAZETTEER:
+            c = Client()
+            response = c.get("/gazetteer/Paradise", {"next": "!!"})
+            self.assertEquals(400, response.status_code)
+            response = c.get("/gazetteer/Paradise", {"next": "$"})
+            self.assertEquals(400, response.status_code)
+
+    def test_gazetteer_bbox(self):
+        if settings.USE_GAZETTEER:
+            c = Client()
+            response = c.get("/gazetteer/Paradise", {"bbox": "-71,39,-69,41"})
+            self.assertEquals(5, len(json.loads(response.content)))
+            response = c.get("/gazetteer/Paradise", {"bbox": "10,39,20,41"})
+            self.assertEquals(0, len(json.loads(response.content)))
+            response = c.get("/gazetteer/Paradise", {"bbox": "10,39"})
+            self.assertEquals(400, response.status_code)
+
+    def test_gazetteer_clusters(self):
+        if settings.USE_GAZETTEER:
+            c = Client()
+            response = c.get("/gazetteer/Paradise", {"zoom": 2})
+            clusters = json.loads(response.content)
+            self.assertEquals(1, len(clusters))
+            self.assertEquals(5, clusters[0]["count"])
+            self.assertEquals([40, -70], clusters[0]["coordinates"])
+
     def test_gazetteer_layer(self):
         if settings.USE_GAZETTEER:
             c = Client()
@@ -109,3 +169,350 @@ class GazetteerTest(TestCase):
             print response.content
             self.assertEquals(1, len(placenames))
             self.assertContains(response, text="Paradise3", html=False, status_code=200)
+
+
+class PlacenameIndexTest(TestCase):
+
+    def setUp(self):
+        rows = [
+            IndexedPlacename(1, u'Paradise1', u'CA1', u'test', u'admin', 2455000, 2456000, 1.0, 2.0, None, None),
+            IndexedPlacename(2, u'Paradise2', u'CA1', u'test', u'admin', None, None, 1.0, 2.0, None, None),
+            IndexedPlacename(3, u'Springfield', u'CA1', None, u'admin', None, 2450000, 1.0, 2.0, None, None),
+            IndexedPlacename(4, u'paradise4', u'CA2', u'other', u'bob', 2457000, None, 1.0, 2.0, None, None),
+        ]
+        self.index = PlacenameIndex()
+        self.index.build(rows)
+
+    def test_prefix_is_case_insensitive(self):
+        names = sorted(r.place_name for r in self.index.search(u'PARA'))
+        self.assertEquals([u'Paradise1', u'Paradise2', u'paradise4'], names)
+
+    def test_layer_and_project_filters(self):
+        self.assertEquals(3, len(self.index.search(u'P', layers=[u'CA1', u'CA2'])))
+        self.assertEquals(2, len(self.index.search(u'P', layers=[u'CA1'])))
+        self.assertEquals([4], [r.id for r in self.index.search(u'P', project=u'other')])
+        self.assertEquals([4], [r.id for r in self.index.search(u'P', user=u'bob')])
+
+    def test_date_filters(self):
+        self.assertEquals([2], sorted(r.id for r in self.index.search(u'P', start_date=2456500)))
+        self.assertEquals([1, 2], sorted(r.id for r in self.index.search(u'P', end_date=2456500)))
+
+    def test_bbox_filter(self):
+        self.assertEquals(4, len(self.index.search(u'', bbox=(1.5, 0.5, 2.5, 1.5))))
+        self.assertEquals(0, len(self.index.search(u'', bbox=(3, 0.5, 4, 1.5))))
+        # Box crossing the antimeridian
+        self.assertEquals(4, len(self.index.search(u'', bbox=(170, 0.5, 2.5, 1.5))))
+
+    def test_paged_search_by_id(self):
+        self.assertEquals([1, 2], [r.id for r in self.index.search(u'P', limit=2)])
+        self.assertEquals([2, 4], [r.id for r in self.index.search(u'P', limit=2, after=1)])
+        self.assertEquals([4], [r.id for r in self.index.search(u'P', limit=2, after=2)])
+        self.assertEquals([2, 4], [r.id for r in self.index.search(u'P', limit=5, start_date=2456500)])
+
+    def test_set_and_remove_layer(self):
+        self.index.set_layer(u'CA2', [
+            IndexedPlacename(5, u'Paradise5', u'CA2', None, None, None, None, 1.0, 2.0, None, None)])
+        self.assertEquals([5], [r.id for r in self.index.search(u'Paradise', layers=[u'CA2'])])
+        self.index.remove_layer(u'CA1')
+        self.assertEquals(1, len(self.index))
+
+
+    def test_sync_detects_lost_changes(self):
+        from django.core.cache.backends.locmem import LocMemCache
+        from geonode.gazetteer import index
+        shared = LocMemCache('gazetteer-index-test', {})
+        shared.clear()
+        with patch.object(index, 'cache', shared):
+            shared.set(index.INDEX_SERIAL_KEY, 1)
+            self.index.serial = 1
+            # Two changes, the entry of the first one was overwritten
+            shared.set(index.INDEX_SERIAL_KEY, 3)
+            shared.set(index.INDEX_LOG_KEY, [(3, u'CA2')])
+            with patch.object(PlacenameIndex, 'load') as load:
+                with patch.object(PlacenameIndex, 'reload_layer') as reload_layer:
+                    self.index.sync()
+                    self.assertTrue(load.called)
+                    self.assertFalse(reload_layer.called)
+
+            shared.set(index.INDEX_LOG_KEY, [(2, u'CA1'), (3, u'CA2')])
+            with patch.object(PlacenameIndex, 'load') as load:
+                with patch.object(PlacenameIndex, 'reload_layer') as reload_layer:
+                    self.index.sync()
+                    self.assertFalse(load.called)
+                    self.assertEquals(set([u'CA1', u'CA2']), set(c[0][0] for c in reload_layer.call_args_list))
+            self.assertEquals(3, self.index.serial)
+
+
+class IntervalTreeTest(TestCase):
+
+    def test_overlapping(self):
+        tree = IntervalTree([(1, 5, 'a'), (3, 8, 'b'), (10, 12, 'c'), (6, 6, 'd')])
+        self.assertEquals(['a', 'b'], sorted(tree.overlapping(2, 4)))
+        self.assertEquals(['b', 'd'], sorted(tree.overlapping(6, 7)))
+        self.assertEquals(['c'], sorted(tree.overlapping(12, 20)))
+        self.assertEquals([], sorted(tree.overlapping(13, 20)))
+
+    def test_date_search_matches_scan(self):
+        rows = []
+        for i in range(2500):
+            start = None if i % 7 == 0 else 2450000 + (i * 37) % 5000
+            end = None if i % 5 == 0 else 2450000 + (i * 53) % 5000
+            rows.append(IndexedPlacename(i, u'Place%d' % i, u'CA1', None, None, start, end, 1.0, 2.0, None, None))
+        table = LayerKeyTable(rows)
+        for start_date, end_date in ((2451000, 2452000), (2453000, None), (None, 2451500)):
+            expected = sorted(r.id for r in rows if date_match(r.julian_start, r.julian_end, start_date, end_date))
+            self.assertEquals(expected, sorted(r.id for r in table.search(u'place', start_date, end_date)))
+
+
+    def test_date_search_narrow_prefix(self):
+        """A wide date range only searches the blocks of the prefix matches"""
+        from geonode.gazetteer.index import DATE_BLOCK_SIZE
+        rows = []
+        for i in range(20000):
+            name = u'Place%d' % i if i < 3000 else u'Other%d' % i
+            rows.append(IndexedPlacename(i, name, u'CA1', None, None, 2450000 + i % 3000, None,
+                                         1.0, 2.0, None, None))
+        table = LayerKeyTable(rows)
+        start_date, end_date = 2449000, 2460000
+        expected = [r.id for r in table.prefix(u'place')]
+        self.assertEquals(expected, [r.id for r in table.search(u'place', start_date, end_date)])
+        first, last = table.prefix_range(u'place')
+        for block in table._date_blocks:
+            self.assertTrue(first <= block * DATE_BLOCK_SIZE and (block + 1) * DATE_BLOCK_SIZE <= last)
+        self.assertTrue(table._date_blocks)
+
+
+    def test_by_id_reads_only_the_page(self):
+        """Paged searches merge the id ordered blocks of the prefix matches"""
+        rows = []
+        for i in range(40000):
+            name = u'Place%d' % i if i % 3 else u'Other%d' % i
+            rows.append(IndexedPlacename((i * 7919) % 40000, name, u'CA1', None, None, None, None,
+                                         1.0, 2.0, None, None))
+        table = LayerKeyTable(rows)
+        expected = sorted(r.id for r in rows if r.place_name.startswith(u'Place'))
+        self.assertEquals(expected, [r.id for r in table.by_id(u'place')])
+        self.assertEquals([i for i in expected if i > 20000][:10],
+                          [r.id for r in islice(table.by_id(u'place', 20000), 10)])
+
+
+class StandInGeocoder(object):
+    """
+    Local replacement for a geopy geocoder
+    """
+
+    def __init__(self, results=None, delay=0, error=None):
+        self.results = results or []
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    def geocode(self, query, exactly_one=True, timeout=None):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return self.results
+
+
+class ExternalServicesTest(TestCase):
+
+    def setUp(self):
+        self.google = StandInGeocoder([(u'Paradise, CA', (39.7, -121.6))])
+        self.nominatim = StandInGeocoder([(u'Paradise, NV', (36.1, -115.1)), (u'Paradise, MI', (46.6, -85.0))])
+        self.geonames = StandInGeocoder(error=Exception("service unavailable"))
+        self.geocoders = patch.dict(utils._geocoders, {
+            'google': self.google, 'nominatim': self.nominatim, 'geonames': self.geonames})
+        self.geocoders.start()
+        self.breakers = patch.dict(utils._breakers, dict(
+            (service, CircuitBreaker(2, 60)) for service in utils.EXTERNAL_SERVICES))
+        self.breakers.start()
+        self.pools = patch.dict(utils._service_pools, {}, clear=True)
+        self.pools.start()
+
+    def tearDown(self):
+        for pool in utils._service_pools.values():
+            pool.shutdown(5)
+        self.geocoders.stop()
+        self.breakers.stop()
+        self.pools.stop()
+
+    def test_results_in_service_order(self):
+        results = getExternalServiceResults(u'Paradise', 'nominatim,google,unknown')
+        self.assertEquals([u'Paradise, NV', u'Paradise, MI', u'Paradise, CA'], [r['placename'] for r in results])
+        self.assertEquals(['Nominatim', 'Nominatim', 'Google'], [r['source'] for r in results])
+
+    def test_failing_service_opens_breaker(self):
+        for i in range(3):
+            self.assertEquals(1, len(getExternalServiceResults(u'Paradise', 'google,geonames')))
+        self.assertEquals(2, self.geonames.calls)
+        self.assertFalse(utils._breakers['geonames'].allow())
+
+    def test_deadline(self):
+        self.nominatim.delay = 2
+        with self.settings(GAZETTEER_SERVICES_DEADLINE=0.2):
+            start = time.time()
+            results = getExternalServiceResults(u'Paradise', 'google,nominatim')
+            self.assertTrue(time.time() - start < 1)
+        self.assertEquals([u'Paradise, CA'], [r['placename'] for r in results])
+
+    def test_busy_service_is_skipped(self):
+        self.nominatim.delay = 0.5
+        with self.settings(GAZETTEER_SERVICES_DEADLINE=0.1, GAZETTEER_SERVICES_WORKERS=1,
+                           GAZETTEER_SERVICES_MAX_QUEUED=1):
+            threads = threading.active_count()
+            for i in range(5):
+                results = getExternalServiceResults(u'Paradise', 'google,nominatim')
+                self.assertEquals([u'Paradise, CA'], [r['placename'] for r in results])
+            self.assertTrue(threading.active_count() <= threads + 2)
+            utils._service_pools['nominatim'].shutdown(5)
+        # The query queued behind the slow one was past its deadline
+        self.assertEquals(1, self.nominatim.calls)
+
+
+class CopyStreamTest(TestCase):
+
+    def test_copy_format(self):
+        stream = CopyStream([(u'name', 1, None, 0.1), (u'tab\there', 2, u'back\\slash', 1.5)])
+        self.assertEquals('name\t1\t\\N\t0.1\ntab\\there\t2\tback\\\\slash\t1.5\n', stream.read())
+        self.assertEquals(2, stream.count)
+        self.assertEquals('', stream.read())
+
+    def test_read_in_chunks(self):
+        stream = CopyStream((u'row%d' % i,) for i in range(100))
+        data = ''
+        chunk = stream.read(7)
+        while chunk:
+            self.assertTrue(len(chunk) <= 7)
+            data += chunk
+            chunk = stream.read(7)
+        self.assertEquals(100, len(data.splitlines()))
+
+
+class IncrementalSyncTest(TransactionTestCase):
+    """
+    Incremental gazetteer updates of a layer table kept in the gazetteer
+    database (GAZETTEER_INCREMENTAL_SYNC).  The syncs use their own
+    connections, so the data has to be committed.
+    """
+    multi_db = True
+    fixtures = ['gazetteer_data.json'] if settings.USE_GAZETTEER else []
+
+    def setUp(self):
+        if settings.USE_GAZETTEER:
+            self.store = settings.DATABASES[settings.GAZETTEER_DB_ALIAS]['NAME']
+            self.execute("CREATE TABLE gazsync (fid serial PRIMARY KEY, name varchar(80), "
+                         "the_geom geometry(Point, 4326))",
+                         "INSERT INTO gazsync (name, the_geom) VALUES "
+                         "('Alpha', ST_SetSRID(ST_MakePoint(1, 2), 4326)), "
+                         "('Beta', ST_SetSRID(ST_MakePoint(3, 4), 4326)), "
+                         "('Gamma', ST_SetSRID(ST_MakePoint(5, 6), 4326))")
+            self.layer = Layer.objects.create(name='gazsync', typename='base:gazsync', store=self.store,
+                                              workspace='base', srs='EPSG:4326', uuid=str(uuid4()))
+            LayerAttribute.objects.create(layer=self.layer, attribute='name', in_gazetteer=True)
+
+    def tearDown(self):
+        if settings.USE_GAZETTEER:
+            conn = utils.getConnection(self.store)
+            try:
+                utils.remove_change_tracking(conn, 'gazsync')
+            finally:
+                conn.close()
+            self.execute("DROP TABLE IF EXISTS gazsync")
+
+    def execute(self, *statements):
+        conn = utils.getConnection(self.store)
+        try:
+            cur = conn.cursor()
+            for statement in statements:
+                cur.execute(statement)
+            conn.commit()
+            cur.close()
+        finally:
+            conn.close()
+
+    def sync(self, project='test'):
+        with self.settings(GAZETTEER_INCREMENTAL_SYNC=True):
+            utils.add_to_gazetteer('gazsync', ['name'], project=project, user='admin')
+
+    def entries(self):
+        """fid -> (entry id, placename) of the layer's gazetteer entries"""
+        return dict((fid, (pk, name)) for pk, fid, name in GazetteerEntry.objects.filter(
+            layer_name='gazsync').values_list('id', 'feature_fid', 'place_name'))
+
+    def fid(self, name):
+        return [fid for fid, (pk, place_name) in self.entries().items() if place_name == name][0]
+
+    def logged_changes(self):
+        conn = utils.getConnection(self.store)
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT count(*) FROM %s WHERE layer_name = 'gazsync'" % utils.FEATURE_CHANGES_TABLE)
+            return cur.fetchone()[0]
+        finally:
+            conn.close()
+
+    def test_only_changed_features_are_rewritten(self):
+        if settings.USE_GAZETTEER:
+            self.sync()
+            before = self.entries()
+            self.assertEquals([u'Alpha', u'Beta', u'Gamma'], sorted(name for pk, name in before.values()))
+            watermark = GazetteerSyncState.objects.get(layer_name='gazsync').watermark
+            alpha, beta, gamma = self.fid(u'Alpha'), self.fid(u'Beta'), self.fid(u'Gamma')
+
+            self.execute("UPDATE gazsync SET name = 'Alpha2' WHERE fid = %d" % alpha,
+                         "INSERT INTO gazsync (name, the_geom) VALUES ('Delta', ST_SetSRID(ST_MakePoint(7, 8), 4326))",
+                         "DELETE FROM gazsync WHERE fid = %d" % gamma)
+            self.assertEquals(3, self.logged_changes())
+            with patch.object(utils, 'install_change_tracking') as install:
+                self.sync()
+                self.assertFalse(install.called)
+            after = self.entries()
+            self.assertEquals([u'Alpha2', u'Beta', u'Delta'], sorted(name for pk, name in after.values()))
+            # Untouched features keep their entries
+            self.assertEquals(before[beta], after[beta])
+            self.assertNotEquals(before[alpha][0], after[alpha][0])
+            self.assertFalse(gamma in after)
+            self.assertTrue(GazetteerSyncState.objects.get(layer_name='gazsync').watermark > watermark)
+            self.assertEquals(0, self.logged_changes())
+
+            # Nothing changed since
+            with patch.object(utils, 'purge_feature_changes') as purge:
+                self.sync()
+                self.assertFalse(purge.called)
+            self.assertEquals(after, self.entries())
+
+    def test_changes_of_open_transactions_wait(self):
+        if settings.USE_GAZETTEER:
+            self.sync()
+            alpha, beta = self.fid(u'Alpha'), self.fid(u'Beta')
+            open_conn = utils.getConnection(self.store)
+            try:
+                cur = open_conn.cursor()
+                # Logged before the edit of Alpha, committed after it
+                cur.execute("UPDATE gazsync SET name = 'Beta2' WHERE fid = %d" % beta)
+                self.execute("UPDATE gazsync SET name = 'Alpha2' WHERE fid = %d" % alpha)
+                # Changes after the oldest open transaction wait for it
+                self.sync()
+                self.assertEquals(u'Alpha', self.entries()[alpha][1])
+                self.assertEquals(1, self.logged_changes())
+                open_conn.commit()
+                cur.close()
+            finally:
+                open_conn.close()
+            self.sync()
+            self.assertEquals(u'Alpha2', self.entries()[alpha][1])
+            self.assertEquals(u'Beta2', self.entries()[beta][1])
+            self.assertEquals(0, self.logged_changes())
+
+    def test_settings_change_syncs_everything(self):
+        if settings.USE_GAZETTEER:
+            self.sync()
+            self.execute("UPDATE gazsync SET name = 'Alpha2' WHERE name = 'Alpha'")
+            with patch.object(utils, 'get_feature_changes') as get_feature_changes:
+                self.sync(project='other')
+                self.assertFalse(get_feature_changes.called)
+            self.assertEquals([u'other'], list(GazetteerEntry.objects.filter(
+                layer_name='gazsync').values_list('project', flat=True).distinct()))
+            self.assertEquals([u'Alpha2', u'Beta', u'Gamma'], sorted(name for pk, name in self.entries().values()))
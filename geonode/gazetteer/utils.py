@@ -1,21 +1,32 @@
 from array import array
+from hashlib import md5
+import json
 import logging
+import math
+import os
+import threading
+import time
 from django.contrib.gis.geos.geometry import GEOSGeometry
 from django.core.urlresolvers import reverse
 from django.shortcuts import get_object_or_404
-from geonode.gazetteer.models import GazetteerEntry
+from geonode.gazetteer.models import GazetteerEntry, GazetteerSyncState, SOURCE_LINK_CACHE_KEY
 #from psycopg2 import extras
-from geonode.gazetteer.models import GazetteerEntry
 from geopy import geocoders
 from django.conf import settings
-import psycopg2
+from django.db import connections
+from geonode import dbpool
 from django.db.models import Q
 from geonode.maps.models import Layer, LayerAttribute, MapLayer, Map
 from django.core.cache import cache
+from django.utils.encoding import smart_str
 from geonode.flexidates import parse_julian_date
+from geonode.gazetteer.index import get_index, layer_changed, bbox_parts
+from geonode.queue.workers import LocalWorkerPool
 import re
 
 GAZETTEER_TABLE = 'gazetteer_gazetteerentry'
+# Created in each layer store when GAZETTEER_INCREMENTAL_SYNC is enabled
+FEATURE_CHANGES_TABLE = 'gazetteer_feature_changes'
 
 __author__ = 'mbertrand'
 
@@ -64,34 +75,56 @@ def getGazetteerEntry(input_id):
 
 
 def formatSourceLink(layer_name):
-    layer = cache.get("layerinfo_" + layer_name)
-    if layer is None:
-        layer = Layer.objects.get(name=layer_name)
-        cache.add("layerinfo_" + layer_name, layer)
-    return "<a href='{0}data/{1}' target='_blank'>{2}</a>".format(settings.SITEURL, layer.typename, layer.name)
+    links = formatSourceLinks([layer_name])
+    if layer_name not in links:
+        raise Layer.DoesNotExist("Layer %s does not exist" % layer_name)
+    return links[layer_name]
 
 
-def getGazetteerResults(place_name, map=None, layer=None, start_date=None, end_date=None, project=None, user=None):
+def formatSourceLinks(layer_names):
+    """
+    Return a dict of layer name -> source link for a set of layer names,
+    looking up any layers not already cached in a single query.
     """
-    Return placenames from gazetteer that match certain filters:
+    layer_names = set(layer_names)
+    cached = cache.get_many([SOURCE_LINK_CACHE_KEY % name for name in layer_names])
+    links = {}
+    for name in layer_names:
+        link = cached.get(SOURCE_LINK_CACHE_KEY % name)
+        if link is not None:
+            links[name] = link
+    missing = layer_names.difference(links)
+    if missing:
+        new_links = {}
+        for name, typename in Layer.objects.filter(name__in=missing).values_list('name', 'typename'):
+            links[name] = new_links[SOURCE_LINK_CACHE_KEY % name] = \
+                "<a href='{0}data/{1}' target='_blank'>{2}</a>".format(settings.SITEURL, typename, name)
+        cache.set_many(new_links)
+    return links
+
+
+def getGazetteerMatches(place_name, map=None, layer=None, start_date=None, end_date=None, project=None, user=None,
+                        bbox=None, after=None, limit=None):
+    """
+    Return the gazetteer entries (a GazetteerEntry queryset, or a list of
+    index rows if the prefix index is enabled) that match certain filters:
         place_name: text to do a LIKE search for
         map: search all layers that are present in this map (map id)
         layer: search only this layer (layer name)
         start_date: return only matches with a start date >= this value
         end_date: return only matches with an end date <= this value
         project: only return matches within the specified project
+        bbox: only return matches whose coordinates are within this
+            (min longitude, min latitude, max longitude, max latitude) box
+    With the prefix index, ``limit`` returns only the first ``limit``
+    matches with an id greater than ``after``, ordered by id.
     """
 
     layers = []
     if map:
         mapObject = get_object_or_404(Map, pk=map)
-        maplayers = MapLayer.objects.filter(map=mapObject.id)
-        for maplayer in maplayers:
-            try:
-                layer = Layer.objects.get(typename=maplayer.name)
-                layers.append(layer.name)
-            except:
-                logger.info("Could not find %s", maplayer.name)
+        typenames = MapLayer.objects.filter(map=mapObject.id).values_list('name', flat=True)
+        layers = list(Layer.objects.filter(typename__in=list(typenames)).values_list('name', flat=True))
 
     elif layer:
         layers = [layer]
@@ -110,7 +143,26 @@ def getGazetteerResults(place_name, map=None, layer=None, start_date=None, end_d
         end_date = parse_julian_date(end_date)
         print("END DATE: %s" % end_date)
 
-    if start_date and end_date:
+    # Extra SQL clauses for the temporal range index (GAZETTEER_TEMPORAL_INDEX)
+    where, params = [], []
+
+    if settings.GAZETTEER_TEMPORAL_INDEX and (start_date or end_date):
+        # Overlap test against the GiST index on gazetteer_julian_range(), then
+        # the exact NULL handling of the criteria below on the rows it finds
+        if start_date and end_date:
+            where.append("gazetteer_julian_range(julian_start, julian_end) && int4range(%s, %s, '[]')")
+            where.append("(julian_end IS NULL OR julian_end >= %s) AND (julian_start IS NULL OR julian_start <= %s)")
+            params.extend([start_date, end_date, start_date, end_date])
+        elif start_date:
+            where.append("gazetteer_julian_range(julian_start, julian_end) && int4range(%s, NULL, '[]')")
+            where.append("(julian_end >= %s OR (julian_end IS NULL AND (julian_start IS NULL OR julian_start <= %s)))")
+            params.extend([start_date, start_date, start_date])
+        else:
+            where.append("gazetteer_julian_range(julian_start, julian_end) && int4range(NULL, %s, '[]')")
+            where.append("(julian_start <= %s OR (julian_start IS NULL AND (julian_end IS NULL OR julian_end >= %s)))")
+            params.extend([end_date, end_date, end_date])
+
+    elif start_date and end_date:
         print ("BOTH DATES")
         #Return all placenames that ended after the start date or started before the end date
         criteria = criteria & (Q(julian_end__gte=start_date) &  Q(julian_start__lte=end_date) |\
@@ -143,23 +195,231 @@ def getGazetteerResults(place_name, map=None, layer=None, start_date=None, end_d
     if user:
         criteria = criteria & Q(username__exact=user)
 
-    matchingEntries=(GazetteerEntry.objects.extra(
-        where=['placename_tsv @@ to_tsquery(%s)'],
-        params=[re.sub("\s+"," & ",place_name.strip()) + ":*"]).filter(criteria))[:500] \
-        if settings.GAZETTEER_FULLTEXTSEARCH else GazetteerEntry.objects.filter(criteria)
+    if settings.GAZETTEER_PREFIX_INDEX and not settings.GAZETTEER_FULLTEXTSEARCH:
+        return get_index().search(place_name, layers=layers, start_date=start_date, end_date=end_date,
+                                  project=project, user=user, bbox=bbox, after=after, limit=limit)
+
+    if bbox:
+        # The envelope test goes through the GiST index on placename points
+        # (gazetteer migration 0005), the range test keeps box edges exact
+        boxes, bbox_criteria = [], []
+        for minx, miny, maxx, maxy in bbox_parts(bbox):
+            boxes.append("ST_SetSRID(ST_MakePoint(longitude, latitude), 4326) && ST_MakeEnvelope(%s, %s, %s, %s, 4326)")
+            params.extend([minx, miny, maxx, maxy])
+            bbox_criteria.append(Q(longitude__gte=minx, longitude__lte=maxx, latitude__gte=miny, latitude__lte=maxy))
+        where.append("(%s)" % " OR ".join(boxes))
+        criteria = criteria & reduce(lambda a, b: a | b, bbox_criteria)
+
+    entries = GazetteerEntry.objects.all()
+    if settings.GAZETTEER_FULLTEXTSEARCH:
+        entries = entries.extra(
+            where=['placename_tsv @@ to_tsquery(%s)'],
+            params=[re.sub("\s+"," & ",place_name.strip()) + ":*"])
+    if where:
+        entries = entries.extra(where=where, params=params)
+    return entries.filter(criteria)
+
+
+def formatGazetteerResults(entries):
+    """
+    Format a page of gazetteer entries for output, resolving all source
+    links in one batch.
+    """
+    entries = list(entries)
+    links = formatSourceLinks(entry.layer_name for entry in entries)
     posts = []
-    for entry in matchingEntries:
+    for entry in entries:
+        if entry.layer_name not in links:
+            logger.info("Could not find %s", entry.layer_name)
+            continue
         posts.append({'placename': entry.place_name, 'coordinates': (entry.latitude, entry.longitude),
-            'source': formatSourceLink(entry.layer_name), 'start_date': entry.start_date, 'end_date': entry.end_date,
+            'source': links[entry.layer_name], 'start_date': entry.start_date, 'end_date': entry.end_date,
             'gazetteer_id': entry.id})
     return posts
 
 
+def getGazetteerPage(place_name, map=None, layer=None, start_date=None, end_date=None, project=None, user=None,
+                     after=None, limit=None, bbox=None):
+    """
+    Return one page of gazetteer results ordered by id, as a tuple of:
+        an iterator over the formatted results, which reads the matching
+        entries in chunks of settings.GAZETTEER_CHUNK_SIZE rows
+        the id to pass as ``after`` for the next page, or None if this is
+        the last page
+    after: only return entries with an id greater than this value
+    limit: maximum number of results in the page (default settings.GAZETTEER_PAGE_SIZE)
+    """
+    limit = limit or settings.GAZETTEER_PAGE_SIZE
+    chunk_size = settings.GAZETTEER_CHUNK_SIZE
+    matches = getGazetteerMatches(place_name, map, layer, start_date, end_date, project, user, bbox,
+                                  after=after, limit=limit + 1)
+
+    if isinstance(matches, list):
+        page = matches[:limit]
+        next_id = page[-1].id if len(matches) > limit else None
+
+        def results():
+            for i in range(0, len(page), chunk_size):
+                for post in formatGazetteerResults(page[i:i + chunk_size]):
+                    yield post
+        return results(), next_id
+
+    if after is not None:
+        matches = matches.filter(id__gt=after)
+    matches = matches.order_by('id')
+    boundary = list(matches.values_list('id', flat=True)[limit - 1:limit + 1])
+    next_id = boundary[0] if len(boundary) == 2 else None
+
+    def results():
+        last_id, remaining = after, limit
+        while remaining > 0:
+            chunk = matches if last_id is None else matches.filter(id__gt=last_id)
+            chunk = list(chunk[:min(chunk_size, remaining)])
+            if not chunk:
+                break
+            for post in formatGazetteerResults(chunk):
+                yield post
+            last_id, remaining = chunk[-1].id, remaining - len(chunk)
+    return results(), next_id
+
+
+def cluster_cell_size(zoom):
+    """
+    Width in degrees of the clustering grid cells at a web map zoom level,
+    see settings.GAZETTEER_CLUSTER_CELL_PIXELS
+    """
+    return settings.GAZETTEER_CLUSTER_CELL_PIXELS * 360.0 / (256 * 2 ** zoom)
+
+
+def getGazetteerClusters(place_name, map=None, layer=None, start_date=None, end_date=None, project=None, user=None,
+                         bbox=None, cell_size=1.0):
+    """
+    Group the placenames that match the filters of getGazetteerMatches into
+    a grid of ``cell_size`` degree cells, and return the number of
+    placenames and their mean coordinates for each non-empty cell, largest
+    cells first.
+    """
+    matches = getGazetteerMatches(place_name, map, layer, start_date, end_date, project, user, bbox)
+
+    if isinstance(matches, list):
+        cells = {}
+        for entry in matches:
+            cell = (math.floor(entry.longitude / cell_size), math.floor(entry.latitude / cell_size))
+            count, latitude, longitude = cells.get(cell, (0, 0.0, 0.0))
+            cells[cell] = (count + 1, latitude + entry.latitude, longitude + entry.longitude)
+        clusters = [(count, latitude / count, longitude / count) for count, latitude, longitude in cells.values()]
+    else:
+        sql, params = matches.values_list('latitude', 'longitude').query.get_compiler(matches.db).as_sql()
+        cursor = connections[matches.db].cursor()
+        cursor.execute("SELECT count(*), avg(latitude), avg(longitude) FROM (%s) AS matches "
+                       "GROUP BY floor(longitude / %%s), floor(latitude / %%s)" % sql,
+                       tuple(params) + (cell_size, cell_size))
+        clusters = cursor.fetchall()
+
+    return [{'count': count, 'coordinates': (latitude, longitude)}
+            for count, latitude, longitude in sorted(clusters, reverse=True)]
+
+
+def getGazetteerResults(place_name, map=None, layer=None, start_date=None, end_date=None, project=None, user=None):
+    """
+    Return the first page of placenames from gazetteer that match certain
+    filters, see getGazetteerMatches
+    """
+    results, next_id = getGazetteerPage(place_name, map, layer, start_date, end_date, project, user)
+    return list(results)
+
+
+def has_gazetteer_entries(layer_name):
+    return GazetteerEntry.objects.filter(layer_name__exact=layer_name).exists()
+
+
 def delete_from_gazetteer(layer_name):
     """
     Delete all placenames for a layer
     """
     GazetteerEntry.objects.filter(layer_name__exact=layer_name).delete()
+    if settings.GAZETTEER_INCREMENTAL_SYNC:
+        GazetteerSyncState.objects.filter(layer_name__exact=layer_name).delete()
+        for layer in Layer.objects.filter(name=layer_name):
+            conn = getConnection(layer.store)
+            try:
+                remove_change_tracking(conn, layer_name)
+            except Exception, e:
+                logger.error("Error removing change tracking for PostGIS table %s:%s", layer_name, str(e))
+            finally:
+                conn.close()
+    if settings.GAZETTEER_PREFIX_INDEX:
+        layer_changed(layer_name)
+
+
+def get_date_format(date_attribute):
+    """
+    Return SQL expressions for the date string and julian day of a layer
+    attribute, for a layer table aliased as "l"
+    """
+    field_name = "l.\"" + date_attribute.attribute + "\""
+    date_format = []
+    if "xsd:date" not in date_attribute.attribute_type and date_attribute.date_format is not None:
+        # This could be in any of multiple formats, and postgresql needs a format pattern to convert it.
+        # User should supply this format when adding the layer attribute to the gazetteer
+        date_format.append(
+            "TO_CHAR(TO_DATE(CAST({name} AS TEXT), '{format}'), 'YYYY-MM-DD BC')".format(
+                name=field_name, format=date_attribute.date_format)
+        )
+        date_format.append(
+            "CAST(TO_CHAR(TO_DATE(CAST({name} AS TEXT), '{format}'), 'J') AS integer)".format(
+                name=field_name, format=date_attribute.date_format)
+            )
+    elif "xsd:date" in date_attribute.attribute_type:
+        # It's a date, convert to string
+        date_format.append("TO_CHAR({}, 'YYYY-MM-DD BC')".format(field_name))
+        date_format.append("CAST(TO_CHAR({}, 'J') AS integer)".format(field_name))
+    elif not "xsd:date" in date_attribute.attribute_type:
+        # It's not a date, it's not an int, and no format was specified if it's a string - so don't use it
+        date_format = [None, None]
+    return date_format
+
+
+def get_metadata_format(metadata_date):
+    """
+    Return SQL expressions for the date string and julian day of a
+    layer metadata date
+    """
+    date_format= []
+    date_format.append(
+        "TO_CHAR(TO_DATE(CAST('{}' AS TEXT), 'YYYY-MM-DD BC'), 'YYYY-MM-DD BC')".format(
+        metadata_date))
+    date_format.append(
+        "CAST(TO_CHAR(TO_DATE(CAST('{}' AS TEXT), 'YYYY-MM-DD BC'), 'J') AS integer)".format(
+            metadata_date))
+    return date_format
+
+
+def get_date_queries(layer, start_attribute=None, end_attribute=None):
+    """
+    Return SQL expressions for the start date, julian start, end date and
+    julian end of the placenames of a layer, from the given attributes or
+    else the layer's temporal extent metadata
+    """
+    start_format, julian_start = None, None
+    if start_attribute is not None:
+        start_attribute_obj = get_object_or_404(LayerAttribute, layer=layer, attribute=start_attribute)
+        start_dates = get_date_format(start_attribute_obj)
+        start_format = start_dates[0]
+        julian_start = start_dates[1]
+    elif layer.temporal_extent_start:
+        start_format, julian_start = get_metadata_format(layer.temporal_extent_start)
+
+    end_format, julian_end = None, None
+    if end_attribute is not None:
+        end_attribute_obj = get_object_or_404(LayerAttribute, layer=layer, attribute=end_attribute)
+        end_dates = get_date_format(end_attribute_obj)
+        end_format = end_dates[0]
+        julian_end = end_dates[1]
+    elif layer.temporal_extent_end:
+        end_format, julian_end = get_metadata_format(layer.temporal_extent_end)
+
+    return start_format, julian_start, end_format, julian_end
 
 
 def add_to_gazetteer(layer_name, name_attributes, start_attribute=None,
@@ -173,39 +433,6 @@ def add_to_gazetteer(layer_name, name_attributes, start_attribute=None,
     project: Name of project that layer will be associated with
     """
 
-    def get_date_format(date_attribute):
-        field_name = "l.\"" + date_attribute.attribute + "\""
-        date_format = []
-        if "xsd:date" not in date_attribute.attribute_type and date_attribute.date_format is not None:
-            # This could be in any of multiple formats, and postgresql needs a format pattern to convert it.
-            # User should supply this format when adding the layer attribute to the gazetteer
-            date_format.append(
-                "TO_CHAR(TO_DATE(CAST({name} AS TEXT), '{format}'), 'YYYY-MM-DD BC')".format(
-                    name=field_name, format=date_attribute.date_format)
-            )
-            date_format.append(
-                "CAST(TO_CHAR(TO_DATE(CAST({name} AS TEXT), '{format}'), 'J') AS integer)".format(
-                    name=field_name, format=date_attribute.date_format)
-                )
-        elif "xsd:date" in date_attribute.attribute_type:
-            # It's a date, convert to string
-            date_format.append("TO_CHAR({}, 'YYYY-MM-DD BC')".format(field_name))
-            date_format.append("CAST(TO_CHAR({}, 'J') AS integer)".format(field_name))
-        elif not "xsd:date" in start_attribute_obj.attribute_type:
-            # It's not a date, it's not an int, and no format was specified if it's a string - so don't use it
-            date_format = [None, None]
-        return date_format
-
-    def get_metadata_format(metadata_date):
-        date_format= []
-        date_format.append(
-            "TO_CHAR(TO_DATE(CAST('{}' AS TEXT), 'YYYY-MM-DD BC'), 'YYYY-MM-DD BC')".format(
-            metadata_date))
-        date_format.append(
-            "CAST(TO_CHAR(TO_DATE(CAST('{}' AS TEXT), 'YYYY-MM-DD BC'), 'J') AS integer)".format(
-                metadata_date))
-        return date_format
-
     layer = get_object_or_404(Layer, name=layer_name)
     layer_type, geocolumn, projection = get_geometry_type(layer)
 
@@ -216,12 +443,38 @@ def add_to_gazetteer(layer_name, name_attributes, start_attribute=None,
     """
 
     conn = getConnection(layer.store)
-    cur = conn.cursor()
-    cur.execute("SELECT string_agg(fid::text, ',') as fids_list from %s;" % layer.name)
-    fids = cur.fetchone()[0]
 
-    delete_query = "DELETE FROM " + GAZETTEER_TABLE + " WHERE layer_name = '" + str(
-        layer.name) + "' AND (feature_fid NOT IN (" + fids + ") OR layer_attribute NOT IN (" + namelist + "))"
+    """
+    In incremental mode, only rewrite the placenames of features changed since the last sync,
+    unless the gazetteer settings of the layer changed.
+    """
+    changed_fids = None
+    if settings.GAZETTEER_INCREMENTAL_SYNC:
+        signature = get_sync_signature(layer, name_attributes, start_attribute, end_attribute, project, user)
+        sync_state = GazetteerSyncState.objects.filter(layer_name=layer_name)
+        sync_state = sync_state[0] if sync_state else GazetteerSyncState(layer_name=layer_name)
+        if sync_state.signature == signature:
+            watermark, changed_fids = get_feature_changes(conn, layer_name, sync_state.watermark)
+            if not changed_fids:
+                conn.close()
+                return "Done"
+        else:
+            install_change_tracking(conn, layer_name)
+            watermark = get_change_watermark(conn)
+
+    if changed_fids is not None:
+        fid_list = ",".join(str(fid) for fid in changed_fids)
+        fid_filter = " where fid in (%s)" % fid_list
+        delete_query = "DELETE FROM " + GAZETTEER_TABLE + " WHERE layer_name = '" + str(
+            layer.name) + "' AND feature_fid IN (" + fid_list + ")"
+    else:
+        fid_filter = ""
+        cur = conn.cursor()
+        cur.execute("SELECT string_agg(fid::text, ',') as fids_list from %s;" % layer.name)
+        fids = cur.fetchone()[0]
+
+        delete_query = "DELETE FROM " + GAZETTEER_TABLE + " WHERE layer_name = '" + str(
+            layer.name) + "' AND (feature_fid NOT IN (" + fids + ") OR layer_attribute NOT IN (" + namelist + "))"
 
     updateQueries = []
     insertQueries = []
@@ -235,23 +488,7 @@ def add_to_gazetteer(layer_name, name_attributes, start_attribute=None,
     if "POINT" not in layer_type:
         coord_query = "ST_Centroid(" + geom_query + ")"
 
-    start_format, julian_start = None, None
-    if start_attribute is not None:
-        start_attribute_obj = get_object_or_404(LayerAttribute, layer=layer, attribute=start_attribute)
-        start_dates = get_date_format(start_attribute_obj)
-        start_format = start_dates[0]
-        julian_start = start_dates[1]
-    elif layer.temporal_extent_start:
-        start_format, julian_start = get_metadata_format(layer.temporal_extent_start)
-
-    end_format, julian_end = None, None
-    if end_attribute is not None:
-        end_attribute_obj = get_object_or_404(LayerAttribute, layer=layer, attribute=end_attribute)
-        end_dates = get_date_format(end_attribute_obj)
-        end_format = end_dates[0]
-        julian_end = end_dates[1]
-    elif layer.temporal_extent_end:
-        end_format, julian_end = get_metadata_format(layer.temporal_extent_end)
+    start_format, julian_start, end_format, julian_end = get_date_queries(layer, start_attribute, end_attribute)
 
     username = ("'%s'" % user) if user else 'NULL'
 
@@ -262,7 +499,7 @@ def add_to_gazetteer(layer_name, name_attributes, start_attribute=None,
     julian_start = {sjulian}, julian_end={ejulian}, project='{project}',
     longitude = ST_X({coord}), latitude = ST_Y({coord})
     FROM
-    (select * from dblink('dbname={store}', 'select fid, {geocolumn}, "{attribute}" from {layer};') as lt
+    (select * from dblink('dbname={store}', 'select fid, {geocolumn}, "{attribute}" from {layer}{fid_filter};') as lt
     (fid integer, {geocolumn} geometry, "{attribute}" {attribute_type})) as l
     WHERE layer_name = '{layer}' AND feature_fid = l.fid
     AND layer_attribute = '{attribute}' and l."{attribute}" is not NULL;
@@ -278,7 +515,7 @@ def add_to_gazetteer(layer_name, name_attributes, start_attribute=None,
     julian_start, {ejulian} as julian_end, '{project}' as project, {geom} as
     feature, ST_X({coord}), ST_Y({coord}), {username}
     FROM
-    (select * from dblink('dbname={store}', 'select fid, {geocolumn}, "{attribute}" from {layer};') as lt
+    (select * from dblink('dbname={store}', 'select fid, {geocolumn}, "{attribute}" from {layer}{fid_filter};') as lt
     (fid integer, {geocolumn} geometry, "{attribute}" {attribute_type})) as l
     WHERE l."{attribute}" IS NOT NULL AND fid NOT IN
     (SELECT feature_fid FROM {table} WHERE layer_name = '{layer}' AND
@@ -315,8 +552,11 @@ def add_to_gazetteer(layer_name, name_attributes, start_attribute=None,
             store=layer.store,
             geocolumn=geocolumn,
             attribute_type=attribute_type,
+            fid_filter=fid_filter,
             )
-        updateQueries.append(updateQuery)
+        if changed_fids is None:
+            # Changed features are deleted and re-inserted in incremental mode
+            updateQueries.append(updateQuery)
 
         """
         Insert any new placenames
@@ -336,9 +576,11 @@ def add_to_gazetteer(layer_name, name_attributes, start_attribute=None,
             layer=layer_name,
             store=layer.store,
             geocolumn=geocolumn,
-            attribute_type=attribute_type,)
+            attribute_type=attribute_type,
+            fid_filter=fid_filter,)
         insertQueries.append(insertQuery)
 
+    store_conn = conn
     conn = getConnection()
 
     try:
@@ -353,75 +595,494 @@ def add_to_gazetteer(layer_name, name_attributes, start_attribute=None,
             logger.info(insertQuery)
         conn.commit()
         cur.close()
+        if settings.GAZETTEER_INCREMENTAL_SYNC:
+            sync_state.signature = signature
+            sync_state.watermark = watermark
+            sync_state.save()
+            purge_feature_changes(store_conn, layer_name, watermark)
+        if settings.GAZETTEER_PREFIX_INDEX:
+            layer_changed(layer_name)
         return "Done"
     except Exception, e:
         logger.error("Error retrieving type for PostGIS table %s:%s", layer_name, str(e))
         raise
     finally:
         conn.close()
+        store_conn.close()
 
 
+class CopyStream(object):
+    """
+    File-like object that feeds rows from an iterator to COPY ... FROM STDIN
+    in PostgreSQL text format, a buffer at a time.
+    """
 
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = ''
+        self.count = 0
+
+    @staticmethod
+    def format_value(value):
+        if value is None:
+            return '\\N'
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        elif isinstance(value, float):
+            value = repr(value)
+        else:
+            value = str(value)
+        return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            try:
+                row = self.rows.next()
+            except StopIteration:
+                break
+            self.buffer += '\t'.join(self.format_value(value) for value in row) + '\n'
+            self.count += 1
+        if size < 0:
+            data, self.buffer = self.buffer, ''
+        else:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    readline = read
+
+
+def bulk_load_gazetteer(layer_name, name_attributes, start_attribute=None,
+                        end_attribute=None, project=None, user=None):
+    """
+    Load placenames from a WorldMap layer into the gazetteer in bulk, for
+    initial loads of large layers.  Takes the same arguments as add_to_gazetteer.
+
+    The layer table is read once through a server-side cursor, every
+    (feature, name attribute) pair is streamed into a temporary staging table
+    with COPY, and the staging table is merged into the gazetteer with a single
+    statement.  Returns a dict with the number of placenames loaded ('rows')
+    and the time taken in seconds ('seconds').
+    """
+    started = time.time()
+    layer = get_object_or_404(Layer, name=layer_name)
+    layer_type, geocolumn, projection = get_geometry_type(layer)
 
-def getExternalServiceResults(place_name, services):
-    results = []
-    for service in services.split(',', ):
-        if service == "google":
-            google = getGoogleResults(place_name)
-            results.extend(google)
-        elif service == "nominatim":
-            nominatim = getNominatimResults(place_name)
-            results.extend(nominatim)
-        elif service == "geonames":
-            geonames = getGeonamesResults(place_name)
-            results.extend(geonames)
-    return results
+    geom_query = "l." + geocolumn
+    if projection != "4326":
+        geom_query = "ST_Transform(" + geom_query + ",4326)"
+    coord_query = geom_query
+    if "POINT" not in layer_type:
+        coord_query = "ST_Centroid(" + geom_query + ")"
 
+    start_format, julian_start, end_format, julian_end = get_date_queries(layer, start_attribute, end_attribute)
+
+    source_query = """
+    SELECT fid, encode(ST_AsEWKB({geom}), 'hex'), ST_X({coord}), ST_Y({coord}),
+    {sdate}, {edate}, {sjulian}, {ejulian}, {names}
+    FROM "{layer}" l
+    """.format(
+        geom=geom_query,
+        coord=coord_query,
+        sdate=start_format or "NULL",
+        edate=end_format or "NULL",
+        sjulian=julian_start or "NULL",
+        ejulian=julian_end or "NULL",
+        names=", ".join('CAST(l."%s" AS TEXT)' % name for name in name_attributes),
+        layer=layer_name)
+
+    def staging_rows(cursor):
+        for row in cursor:
+            fid, feature, longitude, latitude, sdate, edate, sjulian, ejulian = row[:8]
+            for attribute, place_name in zip(name_attributes, row[8:]):
+                if place_name is not None:
+                    yield (attribute, layer_type, fid, place_name, sdate, edate, sjulian, ejulian,
+                           feature, longitude, latitude)
+
+    merge_query = """
+    WITH deleted AS (
+        DELETE FROM {table} g WHERE g.layer_name = %(layer)s AND NOT EXISTS
+        (SELECT 1 FROM gazetteer_staging s WHERE s.feature_fid = g.feature_fid
+        AND s.layer_attribute = g.layer_attribute)
+    ), updated AS (
+        UPDATE {table} g SET feature_type = s.feature_type, place_name = s.place_name,
+        start_date = s.start_date, end_date = s.end_date, julian_start = s.julian_start,
+        julian_end = s.julian_end, feature = s.feature, longitude = s.longitude,
+        latitude = s.latitude, project = %(project)s, username = %(username)s
+        FROM gazetteer_staging s WHERE g.layer_name = %(layer)s
+        AND g.feature_fid = s.feature_fid AND g.layer_attribute = s.layer_attribute
+        RETURNING g.feature_fid, g.layer_attribute
+    )
+    INSERT INTO {table} (layer_name, layer_attribute, feature_type, feature_fid,
+    place_name, start_date, end_date, julian_start, julian_end, project,
+    feature, longitude, latitude, username)
+    SELECT %(layer)s, s.layer_attribute, s.feature_type, s.feature_fid, s.place_name,
+    s.start_date, s.end_date, s.julian_start, s.julian_end, %(project)s, s.feature,
+    s.longitude, s.latitude, %(username)s
+    FROM gazetteer_staging s WHERE NOT EXISTS
+    (SELECT 1 FROM updated u WHERE u.feature_fid = s.feature_fid AND u.layer_attribute = s.layer_attribute)
+    """.format(table=GAZETTEER_TABLE)
+
+    store_conn = getConnection(layer.store)
+    conn = getConnection()
+    try:
+        if settings.GAZETTEER_INCREMENTAL_SYNC:
+            install_change_tracking(store_conn, layer_name)
+            watermark = get_change_watermark(store_conn)
 
-def getGoogleResults(place_name):
-    g = geocoders.GoogleV3(client_id=settings.GOOGLE_API_KEY,
-        secret_key=settings.GOOGLE_SECRET_KEY) if settings.GOOGLE_SECRET_KEY is not None else geocoders.GoogleV3()
+        source = store_conn.cursor('gazetteer_bulk_load')
+        source.itersize = settings.GAZETTEER_BULK_LOAD_BATCH_SIZE
+        source.execute(source_query)
+
+        cur = conn.cursor()
+        cur.execute("""
+        CREATE TEMPORARY TABLE gazetteer_staging (layer_attribute varchar(255), feature_type varchar(255),
+        feature_fid bigint, place_name text, start_date text, end_date text, julian_start integer,
+        julian_end integer, feature geometry, longitude double precision, latitude double precision)
+        ON COMMIT DROP
+        """)
+        stream = CopyStream(staging_rows(source))
+        cur.copy_from(stream, 'gazetteer_staging', size=65536,
+                      columns=('layer_attribute', 'feature_type', 'feature_fid', 'place_name', 'start_date',
+                               'end_date', 'julian_start', 'julian_end', 'feature', 'longitude', 'latitude'))
+        source.close()
+        cur.execute("ANALYZE gazetteer_staging")
+        cur.execute(merge_query, {'layer': layer_name, 'project': project, 'username': user})
+        conn.commit()
+        cur.close()
+
+        if settings.GAZETTEER_INCREMENTAL_SYNC:
+            sync_state = GazetteerSyncState.objects.filter(layer_name=layer_name)
+            sync_state = sync_state[0] if sync_state else GazetteerSyncState(layer_name=layer_name)
+            sync_state.signature = get_sync_signature(layer, name_attributes, start_attribute,
+                                                      end_attribute, project, user)
+            sync_state.watermark = watermark
+            sync_state.save()
+        if settings.GAZETTEER_PREFIX_INDEX:
+            layer_changed(layer_name)
+
+        stats = {'rows': stream.count, 'seconds': time.time() - started}
+        logger.info("Bulk loaded %d placenames for %s in %.1f s", stats['rows'], layer_name, stats['seconds'])
+        return stats
+    except Exception, e:
+        logger.error("Error bulk loading PostGIS table %s into gazetteer:%s", layer_name, str(e))
+        raise
+    finally:
+        conn.close()
+        store_conn.close()
+
+
+def get_sync_signature(layer, name_attributes, start_attribute, end_attribute, project, user):
+    """
+    Fingerprint of the gazetteer settings of a layer; placenames are only
+    synchronized incrementally while it stays the same.
+    """
+    settings_list = [sorted(name_attributes), start_attribute, end_attribute, project, user,
+                     layer.temporal_extent_start, layer.temporal_extent_end]
+    return md5(smart_str(json.dumps(settings_list))).hexdigest()
+
+
+def install_change_tracking(conn, layer_name):
+    """
+    Log the fid of every inserted, updated or deleted feature of a layer
+    table into the feature change table of its store, with the id of the
+    transaction that changed it.
+    """
+    cur = conn.cursor()
     try:
-        results = g.geocode(place_name, exactly_one=False)
-        formatted_results = []
-        for result in results:
-            formatted_results.append(formatExternalGeocode('Google', result))
-        return formatted_results
-    except Exception:
-        return []
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS {changes} (id bigserial PRIMARY KEY,
+        layer_name varchar(255) NOT NULL, fid bigint NOT NULL,
+        txid bigint NOT NULL DEFAULT txid_current());
+        """.format(changes=FEATURE_CHANGES_TABLE))
+        cur.execute("SELECT 1 FROM information_schema.columns WHERE table_name = %s AND column_name = 'txid'",
+                    (FEATURE_CHANGES_TABLE,))
+        if cur.fetchone() is None:
+            cur.execute("ALTER TABLE {changes} ADD COLUMN txid bigint NOT NULL DEFAULT txid_current();".format(
+                changes=FEATURE_CHANGES_TABLE))
+        cur.execute("SELECT 1 FROM pg_indexes WHERE indexname = %s", (FEATURE_CHANGES_TABLE + '_txid_idx',))
+        if cur.fetchone() is None:
+            cur.execute("DROP INDEX IF EXISTS {changes}_layer_idx;".format(changes=FEATURE_CHANGES_TABLE))
+            cur.execute("CREATE INDEX {changes}_txid_idx ON {changes} (layer_name, txid);".format(
+                changes=FEATURE_CHANGES_TABLE))
+        cur.execute("""
+        CREATE OR REPLACE FUNCTION {changes}_log() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND OLD.fid <> NEW.fid) THEN
+                INSERT INTO {changes} (layer_name, fid) VALUES (TG_TABLE_NAME, OLD.fid);
+            END IF;
+            IF TG_OP = 'DELETE' THEN
+                RETURN OLD;
+            END IF;
+            INSERT INTO {changes} (layer_name, fid) VALUES (TG_TABLE_NAME, NEW.fid);
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+        """.format(changes=FEATURE_CHANGES_TABLE))
+        cur.execute("""
+        DROP TRIGGER IF EXISTS {changes} ON "{layer}";
+        CREATE TRIGGER {changes} AFTER INSERT OR UPDATE OR DELETE ON "{layer}"
+        FOR EACH ROW EXECUTE PROCEDURE {changes}_log();
+        """.format(changes=FEATURE_CHANGES_TABLE, layer=layer_name))
+        conn.commit()
+    finally:
+        cur.close()
 
 
-def getNominatimResults(place_name):
-    g = geocoders.Nominatim()
+def remove_change_tracking(conn, layer_name):
+    """
+    Stop logging feature changes of a layer table and discard its log.
+    """
+    cur = conn.cursor()
     try:
-        results = g.geocode(place_name, False,timeout=5)
-        formatted_results = []
-        for result in results:
-            formatted_results.append(formatExternalGeocode('Nominatim', result))
-        return formatted_results
-    except:
-        return []
+        cur.execute("SELECT 1 FROM pg_tables WHERE tablename = %s", (FEATURE_CHANGES_TABLE,))
+        if cur.fetchone() is not None:
+            cur.execute('DROP TRIGGER IF EXISTS {changes} ON "{layer}";'.format(
+                changes=FEATURE_CHANGES_TABLE, layer=layer_name))
+            cur.execute("DELETE FROM {changes} WHERE layer_name = %s".format(
+                changes=FEATURE_CHANGES_TABLE), (layer_name,))
+        conn.commit()
+    finally:
+        cur.close()
+
+
+def get_change_watermark(conn):
+    """
+    Return the id of the oldest transaction still in progress.  Every
+    transaction before it has committed or rolled back, so the changes it
+    logged are all visible from here on.
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT txid_snapshot_xmin(txid_current_snapshot())")
+        return cur.fetchone()[0]
+    finally:
+        cur.close()
+
+
+def get_feature_changes(conn, layer_name, watermark):
+    """
+    Return the new watermark of a layer table, and the fids of the features
+    changed by the transactions between ``watermark`` and it.  Changes of
+    transactions still in progress are left for the next sync, even when
+    later transactions have committed already.
+    """
+    latest = get_change_watermark(conn)
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT array_agg(DISTINCT fid) FROM {changes} WHERE layer_name = %s "
+                    "AND txid >= %s AND txid < %s".format(changes=FEATURE_CHANGES_TABLE),
+                    (layer_name, watermark, latest))
+        fids = cur.fetchone()[0]
+        return latest, (fids or [])
+    finally:
+        cur.close()
+
+
+def purge_feature_changes(conn, layer_name, watermark):
+    """
+    Discard the logged changes of a layer table made by the transactions
+    before ``watermark``, once they have been applied to the gazetteer.
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute("DELETE FROM {changes} WHERE layer_name = %s AND txid < %s".format(
+            changes=FEATURE_CHANGES_TABLE), (layer_name, watermark))
+        conn.commit()
+    finally:
+        cur.close()
+
+
+
 
 def getConnection(layer_store=None):
+    """
+    Return a pooled connection to the gazetteer database, or to a layer
+    store on the same server; close() returns it to the pool.
+    """
     dbname = settings.DATABASES[settings.GAZETTEER_DB_ALIAS]['NAME']
     if layer_store:
         dbname = layer_store
-    return psycopg2.connect(
+    return dbpool.connect(
         "dbname='" + dbname + "' user='" + \
         settings.DATABASES[settings.GAZETTEER_DB_ALIAS]['USER'] + "'  password='" + \
         settings.DATABASES[settings.GAZETTEER_DB_ALIAS]['PASSWORD'] + "' port=" + \
         settings.DATABASES[settings.GAZETTEER_DB_ALIAS]['PORT'] + " host='" + \
         settings.DATABASES[settings.GAZETTEER_DB_ALIAS]['HOST'] + "'")
 
+class CircuitBreaker(object):
+    """
+    Stop calling an external service after ``threshold`` consecutive
+    failures, and let a single trial call through every ``reset_timeout``
+    seconds until it succeeds again.
+    """
+
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.time() - self.opened_at >= self.reset_timeout:
+                # half-open: allow one trial call
+                self.opened_at = time.time()
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.time()
+
+
+def _google_geocoder():
+    return geocoders.GoogleV3(client_id=settings.GOOGLE_API_KEY,
+        secret_key=settings.GOOGLE_SECRET_KEY) if settings.GOOGLE_SECRET_KEY is not None else geocoders.GoogleV3()
+
+
+def _nominatim_geocoder():
+    return geocoders.Nominatim()
+
+
+def _geonames_geocoder():
+    return geocoders.GeoNames(username=settings.GEONAMES_USER)
+
+
+# service name -> (source label, geocoder factory)
+EXTERNAL_SERVICES = {
+    'google': ('Google', _google_geocoder),
+    'nominatim': ('Nominatim', _nominatim_geocoder),
+    'geonames': ('Geonames', _geonames_geocoder),
+}
+
+# Shared geocoder clients and circuit breakers, one per service
+_geocoders = {}
+_breakers = dict((service, CircuitBreaker(settings.GAZETTEER_SERVICES_FAILURE_THRESHOLD,
+                                          settings.GAZETTEER_SERVICES_RETRY_INTERVAL))
+                 for service in EXTERNAL_SERVICES)
+# Worker threads of this process, one pool per service
+_service_pools = {}
+_service_pools_pid = None
+_service_pools_lock = threading.Lock()
+
+
+def getGeocoder(service):
+    if service not in _geocoders:
+        _geocoders[service] = EXTERNAL_SERVICES[service][1]()
+    return _geocoders[service]
+
+
+def _external_cache_key(service, place_name):
+    return 'gazetteer_geocode_%s_%s' % (service, md5(smart_str(place_name.strip().lower())).hexdigest())
+
+
+def getServiceResults(service, place_name):
+    """
+    Geocode a placename with one external service, returning formatted
+    results.  Results are cached for settings.GAZETTEER_SERVICES_CACHE_TIMEOUT
+    seconds; failures raise and are not cached.
+    """
+    cache_key = _external_cache_key(service, place_name)
+    formatted_results = cache.get(cache_key)
+    if formatted_results is None:
+        results = getGeocoder(service).geocode(place_name, exactly_one=False,
+                                               timeout=settings.GAZETTEER_SERVICES_DEADLINE)
+        formatted_results = [formatExternalGeocode(EXTERNAL_SERVICES[service][0], result)
+                             for result in (results or [])]
+        cache.set(cache_key, formatted_results, settings.GAZETTEER_SERVICES_CACHE_TIMEOUT)
+    return formatted_results
+
+
+def getServicePool(service):
+    """
+    Return the worker pool of this process that queries an external
+    service: settings.GAZETTEER_SERVICES_WORKERS threads, with at most
+    settings.GAZETTEER_SERVICES_MAX_QUEUED queries waiting for them.
+    """
+    global _service_pools_pid
+    with _service_pools_lock:
+        if _service_pools_pid != os.getpid():
+            _service_pools.clear()
+            _service_pools_pid = os.getpid()
+        if service not in _service_pools:
+            _service_pools[service] = LocalWorkerPool(settings.GAZETTEER_SERVICES_WORKERS,
+                                                      settings.GAZETTEER_SERVICES_MAX_QUEUED,
+                                                      name="geocode-%s" % service)
+        return _service_pools[service]
+
+
+def getExternalServiceResults(place_name, services):
+    """
+    Query the comma-separated external geocoding ``services`` in parallel.
+    Services that have not answered within settings.GAZETTEER_SERVICES_DEADLINE
+    seconds, whose circuit breaker is open, or whose worker pool is busy
+    (see getServicePool) contribute no results.
+    """
+    services = [service for service in services.split(',') if service in EXTERNAL_SERVICES]
+    results = {}
+    deadline = time.time() + settings.GAZETTEER_SERVICES_DEADLINE
+
+    def fetch(service, done):
+        breaker = _breakers[service]
+        try:
+            if time.time() >= deadline:
+                # Waited for a worker past the deadline, nobody wants the results
+                return
+            results[service] = getServiceResults(service, place_name)
+            breaker.success()
+        except Exception, e:
+            logger.warn("Error geocoding %s with %s: %s", place_name, service, str(e))
+            breaker.failure()
+        finally:
+            done.set()
+
+    pending = []
+    for service in services:
+        cached = cache.get(_external_cache_key(service, place_name))
+        if cached is not None:
+            results[service] = cached
+        elif _breakers[service].allow():
+            done = threading.Event()
+            if getServicePool(service).submit(fetch, service, done):
+                pending.append(done)
+
+    for done in pending:
+        done.wait(max(0, deadline - time.time()))
+
+    combined = []
+    for service in services:
+        combined.extend(results.get(service, []))
+    return combined
+
+
+def getGoogleResults(place_name):
+    try:
+        return getServiceResults('google', place_name)
+    except Exception:
+        return []
+
+
+def getNominatimResults(place_name):
+    try:
+        return getServiceResults('nominatim', place_name)
+    except Exception:
+        return []
+
+
 def getGeonamesResults(place_name):
-    g = geocoders.GeoNames(username=settings.GEONAMES_USER)
     try:
-        results = g.geocode(place_name, False)
-        formatted_results = []
-        for result in results:
-            formatted_results.append(formatExternalGeocode('Geonames', result))
-        return formatted_results
-    except:
+        return getServiceResults('geonames', place_name)
+    except Exception:
         return []
 
 
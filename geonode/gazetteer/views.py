@@ -1,12 +1,54 @@
 import json
+from itertools import chain
 from dicttoxml import dicttoxml
+from django.conf import settings
 from django.http import HttpResponse
-from geonode.gazetteer.utils import getGazetteerResults, getGazetteerEntry, getExternalServiceResults
+from django.utils.http import urlquote
+from geonode.gazetteer.utils import getGazetteerPage, getGazetteerEntry, getExternalServiceResults, \
+    getGazetteerClusters, cluster_cell_size
+from geonode.maps.encode import num_encode, num_decode
+
+
+def _json_stream(posts, indent=None):
+    """
+    Serialize results as a JSON array, one result at a time.
+    """
+    separators = None if indent else (',', ':')
+    yield '['
+    for i, post in enumerate(posts):
+        if i:
+            yield ','
+        yield json.dumps(post, sort_keys=True, indent=indent, separators=separators)
+    yield ']'
+
+
+def _xml_stream(posts):
+    """
+    Serialize results in the same layout as
+    dicttoxml([{'resource': post}, ...], custom_root='response'), one result
+    at a time.
+    """
+    yield '<?xml version="1.0" encoding="UTF-8" ?><response>'
+    for post in posts:
+        yield '<item>%s</item>' % dicttoxml({'resource': post}, root=False, attr_type=False)
+    yield '</response>'
 
 
 def search(request, place_name, map=None, layer=None, start_date=None, end_date=None, project=None, services=None, user=None, format='json'):
     """
     Search the Gazetteer and return results in JSON or XML format.
+
+    Results are returned in pages of at most settings.GAZETTEER_PAGE_SIZE
+    placenames (or the smaller ``limit`` query parameter).  If there are
+    more, the response carries a Link header with rel="next" pointing to the
+    next page, whose ``next`` query parameter is an opaque cursor.  Output is
+    compact unless the ``pretty`` query parameter is set.
+
+    The ``bbox`` query parameter (min longitude,min latitude,max
+    longitude,max latitude) limits results to an area.  If the ``zoom``
+    query parameter is at most settings.GAZETTEER_CLUSTER_MAX_ZOOM, the
+    response lists the number of matching placenames per grid cell
+    ({"count": ..., "coordinates": [latitude, longitude]}) instead.
     """
     if not format:
         out_format = 'json'
@@ -15,15 +57,51 @@ def search(request, place_name, map=None, layer=None, start_date=None, end_date=
     if out_format not in ('xml', 'json'):
         out_format = 'json'
 
+    try:
+        after = num_decode(request.GET['next']) if request.GET.get('next') else None
+        limit = min(int(request.GET.get('limit', settings.GAZETTEER_PAGE_SIZE)), settings.GAZETTEER_PAGE_SIZE)
+    except (KeyError, ValueError, IndexError):
+        return HttpResponse("Invalid next or limit parameter", status=400, content_type="text/plain")
+    if limit < 1:
+        return HttpResponse("Invalid next or limit parameter", status=400, content_type="text/plain")
+
+    try:
+        bbox = [float(c) for c in request.GET['bbox'].split(',')] if request.GET.get('bbox') else None
+        zoom = int(request.GET['zoom']) if request.GET.get('zoom') else None
+    except ValueError:
+        return HttpResponse("Invalid bbox or zoom parameter", status=400, content_type="text/plain")
+    if bbox is not None and (len(bbox) != 4 or bbox[1] > bbox[3]):
+        return HttpResponse("Invalid bbox or zoom parameter", status=400, content_type="text/plain")
+    if zoom is not None and zoom < 0:
+        return HttpResponse("Invalid bbox or zoom parameter", status=400, content_type="text/plain")
+
+    next_id = None
     if place_name.isdigit():
         posts = getGazetteerEntry(place_name)
+    elif zoom is not None and zoom <= settings.GAZETTEER_CLUSTER_MAX_ZOOM:
+        # Clusters are not paged, and external results are not clustered
+        posts = getGazetteerClusters(place_name, map, layer, start_date, end_date, project, user,
+                                     bbox=bbox, cell_size=cluster_cell_size(zoom))
+        services = None
     else:
-        posts = getGazetteerResults(place_name, map, layer, start_date, end_date, project, user)
-    if services is not None:
-        posts.extend(getExternalServiceResults(place_name, services))
+        posts, next_id = getGazetteerPage(place_name, map, layer, start_date, end_date, project, user,
+                                          after=after, limit=limit, bbox=bbox)
+    if services is not None and after is None:
+        # External services are not paged, only add them to the first page
+        def external_posts():
+            for post in getExternalServiceResults(place_name, services):
+                yield post
+        posts = chain(posts, external_posts())
+
     if out_format == 'json':
-        return HttpResponse(json.dumps(posts, sort_keys=True, indent=4),
-                            content_type="application/json")
-    elif out_format == 'xml':
-        return HttpResponse(dicttoxml([{'resource': post} for post in posts], attr_type=False, custom_root='response'),
-                            content_type="application/xml")
+        response = HttpResponse(_json_stream(posts, indent=4 if request.GET.get('pretty') else None),
+                                content_type="application/json")
+    else:
+        response = HttpResponse(_xml_stream(posts), content_type="application/xml")
+
+    if next_id is not None:
+        params = request.GET.copy()
+        params['next'] = num_encode(next_id)
+        params['limit'] = limit
+        response['Link'] = '<%s?%s>; rel="next"' % (urlquote(request.path), params.urlencode())
+    return response
@@ -9,7 +9,7 @@ from django.shortcuts import render_to_response, get_object_or_404
 from django.conf import settings
 from django.template import RequestContext
 import logging
-import psycopg2
+from geonode import dbpool
 from geonode.maps.models import Map
 from django.utils import simplejson as json
 from django.core.cache import cache
@@ -23,7 +23,7 @@ def get_hood_center(resource_name, block_ids):
     Do a PostGIS query to calculate the center coordinates of the selected census blocks
     """
     layer = settings.HOODS_TEMPLATE_LAYER
-    conn=psycopg2.connect("dbname='" + settings.DB_DATASTORE_DATABASE + "' user='" + settings.DB_DATASTORE_USER + "'  password='" + settings.DB_DATASTORE_PASSWORD + "' port=" + settings.DB_DATASTORE_PORT + " host='" + settings.DB_DATASTORE_HOST + "'")
+    conn = dbpool.connect(dbpool.datastore_dsn())
     try:
         cur = conn.cursor()
         query = "select ST_AsGeoJSON(ST_Centroid(EXTENT(ST_Transform(the_geom,900913)))) as center from \"" + layer + "\" where \"" + settings.HOODS_TEMPLATE_ATTRIBUTE + "\" IN (" + block_ids + ")"
@@ -0,0 +1,147 @@
+"""
+Pre-rendered viewer configurations of official maps.
+
+The viewer configuration of a map with an official site (Map.officialurl)
+is published to settings.MAP_BUNDLE_ROOT as a gzip compressed JSON
+document, the same for every user, which official_site and
+official_site_config serve without compiling the map.  Only the layers the
+user may not view are disabled at request time, see
+Map.disable_hidden_layers.
+
+Bundles are named after the config version of the map they were compiled
+for (Map.config_version), so a bundle written from data read before a
+change is never served after it.  They are deleted when the map, its
+layers or the layer categories change (see config_changed in
+geonode.maps.models) and published again by the next request, or ahead of
+time by the publishmapbundles command.
+"""
+
+import errno
+import glob
+import gzip
+import hashlib
+import logging
+import os
+import tempfile
+from cStringIO import StringIO
+from django.conf import settings
+from django.utils import simplejson as json
+from geonode.maps.models import Map, Layer, LayerCategory
+
+logger = logging.getLogger("geonode.maps.bundles")
+
+
+def bundle_path(map_id, version):
+    return os.path.join(settings.MAP_BUNDLE_ROOT, 'map-%s-%s.json.gz' % (map_id, version))
+
+
+def remove_bundles(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+
+
+def publish(map):
+    """
+    Write the bundle of ``map`` and return its compressed body.
+    """
+    # The version of the data read from here on, or an older one
+    version = map.config_version()
+    compiled, fresh = map.compiled_config()
+    config = dict(compiled['config'],
+                  topic_categories=[[topic.name, topic.title] for topic in LayerCategory.objects.all()])
+    buf = StringIO()
+    body = gzip.GzipFile(fileobj=buf, mode='wb')
+    try:
+        body.write(json.dumps(config))
+    finally:
+        body.close()
+    data = buf.getvalue()
+
+    if not os.path.isdir(settings.MAP_BUNDLE_ROOT):
+        try:
+            os.makedirs(settings.MAP_BUNDLE_ROOT)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+    # Readers see either the previous bundle or the new one
+    fd, tmp_path = tempfile.mkstemp(dir=settings.MAP_BUNDLE_ROOT, suffix='.tmp')
+    path = bundle_path(map.id, version)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    remove_bundles([other for other in glob.glob(bundle_path(map.id, '*')) if other != path])
+    logger.debug("Published bundle of map %s, %d bytes", map.id, len(data))
+    return data
+
+
+def get_bundle(map):
+    """
+    Return (compressed body, ETag) of the bundle of the current config
+    version of ``map``, publishing it if needed.
+    """
+    try:
+        with open(bundle_path(map.id, map.config_version()), 'rb') as f:
+            data = f.read()
+    except IOError, e:
+        if e.errno != errno.ENOENT:
+            raise
+        data = publish(map)
+    return data, '"%s"' % hashlib.sha1(data).hexdigest()
+
+
+def decode(data):
+    """
+    The configuration of a compressed bundle body.
+    """
+    body = gzip.GzipFile(fileobj=StringIO(data))
+    try:
+        return json.loads(body.read())
+    finally:
+        body.close()
+
+
+def apply_overlay(map, config, user):
+    """
+    Start the HGL layers of a bundle's configuration and disable the layers
+    the user may not view.  Returns the names of the disabled layers.
+    """
+    sources = config['sources']
+    map.load_hgl_layers([cfg['name'] for cfg in config['map']['layers']
+                         if sources.get(cfg.get('source'), {}).get('ptype') == 'gxp_hglsource'])
+    if user.is_active and user.is_superuser:
+        return []
+    names = [cfg['name'] for cfg in config['map']['layers'] if cfg.get('local')]
+    layer_ids = dict(Layer.objects.filter(typename__in=names).values_list('typename', 'id'))
+    return map.disable_hidden_layers(config, layer_ids, user)
+
+
+def unpublish(map_ids):
+    """
+    Delete the bundles of the given maps.
+    """
+    for map_id in map_ids:
+        remove_bundles(glob.glob(bundle_path(map_id, '*')))
+
+
+def unpublish_all():
+    remove_bundles(glob.glob(os.path.join(settings.MAP_BUNDLE_ROOT, 'map-*.json.gz')))
+
+
+def publish_all(verbosity=1):
+    """
+    Publish the bundles of every official map.
+    """
+    maps = Map.objects.exclude(officialurl='').exclude(officialurl__isnull=True)
+    for map in maps:
+        data = publish(map)
+        if verbosity > 0:
+            print "Published %s (%d bytes)" % (map.officialurl, len(data))
+    return len(maps)
@@ -180,8 +180,8 @@ def delete_from_postgis(resource_name, store_name):
     Delete a table from PostGIS (because Geoserver won't do it yet);
     to be used after deleting a layer from the system.
     """
-    import psycopg2
-    conn=psycopg2.connect("dbname='" + store_name + "' user='" + settings.DB_DATASTORE_USER + "'  password='" + settings.DB_DATASTORE_PASSWORD + "' port=" + settings.DB_DATASTORE_PORT + " host='" + settings.DB_DATASTORE_HOST + "'")
+    from geonode import dbpool
+    conn = dbpool.connect(dbpool.datastore_dsn(store_name))
     try:
         cur = conn.cursor()
         cur.execute("SELECT DropGeometryTable ('%s')" %  resource_name)
@@ -197,8 +197,8 @@ def get_postgis_bbox(resource_name, store_name):
     Update the native and latlong bounding box for a layer via PostGIS.
     Doing it via Geoserver is too resource-intensive
     """
-    import psycopg2
-    conn=psycopg2.connect("dbname='" + store_name + "' user='" + settings.DB_DATASTORE_USER + "'  password='" + settings.DB_DATASTORE_PASSWORD + "' port=" + settings.DB_DATASTORE_PORT + " host='" + settings.DB_DATASTORE_HOST + "'")
+    from geonode import dbpool
+    conn = dbpool.connect(dbpool.datastore_dsn(store_name))
     try:
         cur = conn.cursor()
         cur.execute("select ST_EXTENT(the_geom) as bbox, ST_EXTENT(ST_Transform(the_geom,4326)) as llbbox from \"%s\"" %  resource_name)
@@ -208,3 +208,31 @@ def get_postgis_bbox(resource_name, store_name):
         logger.info("Error retrieving bbox for PostGIS table %s:%s", resource_name, str(e))
     finally:
         conn.close()
+
+
+def get_postgis_bboxes(resource_names, store_name):
+    """
+    Return a dict of table name -> (bbox, llbbox) extents for several
+    tables of a PostGIS store, computed in a single query.  Tables that do
+    not exist or have no the_geom column are left out, extents of empty
+    tables are None.
+    """
+    from geonode import dbpool
+    conn = dbpool.connect(dbpool.datastore_dsn(store_name))
+    try:
+        cur = conn.cursor()
+        cur.execute("select table_name from information_schema.columns "
+                    "where column_name = 'the_geom' and table_name = ANY(%s)", (list(resource_names),))
+        tables = [row[0] for row in cur.fetchall()]
+        if not tables:
+            return {}
+        query = " UNION ALL ".join(
+            "select %%s, ST_EXTENT(the_geom)::text, ST_EXTENT(ST_Transform(the_geom,4326))::text from \"%s\"" %
+            table.replace('"', '""') for table in tables)
+        cur.execute(query, tables)
+        return dict((row[0], (row[1], row[2])) for row in cur.fetchall())
+    except Exception, e:
+        logger.error("Error retrieving bboxes for PostGIS tables in %s:%s", store_name, str(e))
+        raise
+    finally:
+        conn.close()
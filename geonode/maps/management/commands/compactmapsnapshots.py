@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from optparse import make_option
+from geonode.maps.models import MapSnapshot
+
+class Command(BaseCommand):
+    help = 'Move map snapshot configurations saved before snapshots were compressed and deduplicated to the snapshot store'
+    args = '[none]'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=500,
+            help='Number of snapshots converted per transaction'),
+    )
+
+    def handle(self, *args, **keywordargs):
+        verbosity = int(keywordargs.get('verbosity', 1))
+        count = MapSnapshot.objects.compact(batch_size=keywordargs['batch_size'], verbosity=verbosity)
+        if verbosity > 0:
+            print "%d snapshots compacted" % count
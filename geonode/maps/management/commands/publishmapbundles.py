@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from geonode.maps.bundles import publish_all
+
+class Command(BaseCommand):
+    help = 'Write the pre-rendered viewer configurations of the official maps to MAP_BUNDLE_ROOT'
+    args = '[none]'
+
+    def handle(self, *args, **keywordargs):
+        verbosity = int(keywordargs.get('verbosity', 1))
+        count = publish_all(verbosity=verbosity)
+        if verbosity > 0:
+            print "%d map bundles published" % count
@@ -1,10 +1,18 @@
 # -*- coding: UTF-8 -*-
+import base64
+import hashlib
+import itertools
 import threading
+import zlib
 from django.conf import settings
-from django.db import models
+from django.contrib.contenttypes.models import ContentType
+from django.db import models, transaction, connections
+from django.db.models import Q, Count, Max
 from geonode.maps.owslib_csw import CatalogueServiceWeb
 from geoserver.catalog import Catalog
-from geonode.core.models import PermissionLevelMixin
+from geonode.core.auth import perms_for_objects
+from geonode.core.models import PermissionLevelMixin, ObjectRole, UserObjectRoleMapping, GenericObjectRoleMapping, \
+     permission_levels_changed
 from geonode.core.models import AUTHENTICATED_USERS, ANONYMOUS_USERS, CUSTOM_GROUP_USERS
 from geonode.geonetwork import Catalog as GeoNetwork
 from django.db.models import signals
@@ -22,7 +30,7 @@ from django.utils.translation import ugettext_lazy as _
 from django.core.exceptions import ValidationError
 from django.core.urlresolvers import reverse
 from lxml import etree
-from geonode.maps.gs_helpers import cascading_delete, get_postgis_bbox
+from geonode.maps.gs_helpers import cascading_delete, get_postgis_bbox, get_postgis_bboxes
 import logging
 from geonode.maps.encode import num_encode
 from django.core.cache import cache
@@ -659,6 +667,13 @@ def _get_viewer_projection_info(srid):
     #TODO: Look up projection details in EPSG database
     return _viewer_projection_lookup.get(srid, {})
 
+def source_key(source):
+    """
+    Canonical hashable key of a GXP layer source configuration, equal for
+    equal configurations.
+    """
+    return json.dumps(source, sort_keys=True)
+
 _wms = None
 _csw = None
 _user, _password = settings.GEOSERVER_CREDENTIALS
@@ -860,6 +875,56 @@ class LayerManager(models.Manager):
                 layer._populate_from_gs()
                 layer.save()
 
+    def update_bounds_batch(self, layers):
+        """
+        Refresh the bounds of several layers from PostGIS, computing the
+        extents of up to settings.BOUNDS_BATCH_SIZE tables of a store in one
+        query, and only pushing changed bounds to GeoServer and GeoNetwork.
+        Returns a dict of layer id -> True if the bounds changed, False if
+        not (or the table has no extent), or the exception raised.
+        """
+        by_store = {}
+        for layer in layers:
+            by_store.setdefault(layer.store, []).append(layer)
+        results = {}
+        batch_size = settings.BOUNDS_BATCH_SIZE
+        for store, store_layers in by_store.items():
+            for i in range(0, len(store_layers), batch_size):
+                batch = store_layers[i:i + batch_size]
+                try:
+                    extents = get_postgis_bboxes([layer.name for layer in batch], store)
+                except Exception, e:
+                    for layer in batch:
+                        results[layer.id] = e
+                    continue
+                for layer in batch:
+                    extent, llextent = extents.get(layer.name, (None, None))
+                    if extent is None or llextent is None:
+                        results[layer.id] = False
+                        continue
+                    try:
+                        results[layer.id] = layer.apply_bounds(extent, llextent)
+                    except Exception, e:
+                        logger.error("Error updating bounds of %s: %s", layer.name, e)
+                        results[layer.id] = e
+        return results
+
+    def for_map_layers(self, maplayers):
+        """
+        Return a dict of typename -> Layer for the GeoNode layers of
+        ``maplayers``, with their visible attributes loaded, in two queries
+        whatever the number of layers.  See MapLayer.layer_config.
+        """
+        names = set(l.name for l in maplayers if l.name and l.source_params.find("gxp_gnsource") > -1)
+        if not names:
+            return {}
+        layers = dict((layer.id, layer) for layer in self.filter(typename__in=names))
+        for layer in layers.values():
+            layer._visible_attributes = []
+        for attribute in LayerAttribute.objects.visible().filter(layer__in=layers.keys()):
+            layers[attribute.layer_id]._visible_attributes.append(attribute)
+        return dict((layer.typename, layer) for layer in layers.values())
+
     def update_stores(self):
         cat = self.gs_catalog
         for layer in Layer.objects.all():
@@ -1150,12 +1215,21 @@ class Layer(models.Model, PermissionLevelMixin):
         return self.attribute_set.exclude(attribute='the_geom')
 
 
+    def visible_attributes(self):
+        """
+        The visible attributes in display order, preloaded by
+        LayerManager.for_map_layers if the layer was fetched with it.
+        """
+        if getattr(self, '_visible_attributes', None) is None:
+            self._visible_attributes = list(self.attribute_set.visible())
+        return self._visible_attributes
+
     def layer_attributes(self):
         attribute_fields = cache.get('layer_searchfields_' + self.typename)
         if attribute_fields is None:
             logger.debug("Create searchfields for %s", self.typename)
             attribute_fields = []
-            attributes = self.attribute_set.filter(visible=True).order_by('display_order')
+            attributes = self.visible_attributes()
             for la in attributes:
                 attribute_fields.append( {"id": la.attribute, "header": la.attribute_label, "searchable" : la.searchable})
             cache.add('layer_searchfields_' + self.typename, attribute_fields)
@@ -1166,8 +1240,8 @@ class Layer(models.Model, PermissionLevelMixin):
     def attribute_config(self):
         #Get custom attribute sort order and labels if any
             cfg = {}
-            visible_attributes =  self.attribute_set.visible()
-            if (visible_attributes.count() > 0):
+            visible_attributes =  self.visible_attributes()
+            if (len(visible_attributes) > 0):
                 cfg["getFeatureInfo"] = {
                     "fields":  [l.attribute for l in visible_attributes],
                     "propertyNames":   dict([(l.attribute,l.attribute_label) for l in visible_attributes])
@@ -1505,10 +1579,7 @@ class Layer(models.Model, PermissionLevelMixin):
         self.set_gen_level(CUSTOM_GROUP_USERS, self.LEVEL_READ)
 
         # remove specific user permissions
-        current_perms =  self.get_all_level_info()
-        for username in current_perms['users'].keys():
-            user = User.objects.get(username=username)
-            self.set_user_level(user, self.LEVEL_NONE)
+        self.get_user_levels().delete()
 
         # assign owner admin privs
         if self.owner:
@@ -1544,14 +1615,19 @@ class Layer(models.Model, PermissionLevelMixin):
         cfg['styles'] = ''
         return cfg
 
-    def queue_gazetteer_update(self):
+    def queue_gazetteer_update(self, priority=0):
         from geonode.queue.models import GazetteerUpdateJob
-        if GazetteerUpdateJob.objects.filter(layer=self.id).exists() == 0:
-            newJob = GazetteerUpdateJob(layer=self)
-            newJob.save()
+        from geonode.queue.tasks import process_now
+        GazetteerUpdateJob.objects.enqueue(self, priority)
+        process_now(GazetteerUpdateJob)
 
     def update_gazetteer(self):
-        from geonode.gazetteer.utils import add_to_gazetteer, delete_from_gazetteer
+        """
+        Update the gazetteer entries of this layer.  Returns the statistics
+        of the bulk loader if it was used, otherwise None.
+        """
+        from geonode.gazetteer.utils import add_to_gazetteer, bulk_load_gazetteer, delete_from_gazetteer, \
+            has_gazetteer_entries
         if not self.in_gazetteer:
             delete_from_gazetteer(self.name)
         else:
@@ -1563,6 +1639,15 @@ class Layer(models.Model, PermissionLevelMixin):
             startAttribute = self.attribute_set.filter(is_gaz_start_date=True)[0].attribute if self.attribute_set.filter(is_gaz_start_date=True).exists() > 0 else None
             endAttribute = self.attribute_set.filter(is_gaz_end_date=True)[0].attribute if self.attribute_set.filter(is_gaz_end_date=True).exists() > 0 else None
 
+            if settings.GAZETTEER_BULK_LOAD and not has_gazetteer_entries(self.name):
+                # Initial load, use the COPY based loader
+                return bulk_load_gazetteer(self.name,
+                                           includedAttributes,
+                                           start_attribute=startAttribute,
+                                           end_attribute=endAttribute,
+                                           project=self.gazetteer_project,
+                                           user=self.owner.username)
+
             add_to_gazetteer(self.name,
                              includedAttributes,
                              start_attribute=startAttribute,
@@ -1570,11 +1655,11 @@ class Layer(models.Model, PermissionLevelMixin):
                              project=self.gazetteer_project,
                              user=self.owner.username)
 
-    def queue_bounds_update(self):
+    def queue_bounds_update(self, priority=0):
         from geonode.queue.models import LayerBoundsUpdateJob
-        if LayerBoundsUpdateJob.objects.filter(layer=self.id).exists() == 0:
-            newJob = LayerBoundsUpdateJob(layer=self)
-            newJob.save()
+        from geonode.queue.tasks import process_now
+        LayerBoundsUpdateJob.objects.enqueue(self, priority)
+        process_now(LayerBoundsUpdateJob)
 
     def update_bounds(self):
         #Get extent for layer from PostGIS
@@ -1583,13 +1668,25 @@ class Layer(models.Model, PermissionLevelMixin):
             return
         if bboxes[0][0] is None or bboxes[0][1] is None:
             return
+        self.apply_bounds(bboxes[0][0], bboxes[0][1])
 
-        bbox = re.findall(r"[+-]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?", bboxes[0][0])
-        llbbox = re.findall(r"[+-]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?", bboxes[0][1])
+    def apply_bounds(self, extent, llextent):
+        """
+        Save PostGIS extents (BOX(...) strings, native and EPSG:4326) as the
+        bounds of this layer, and push them to GeoServer and GeoNetwork.
+        Returns False without saving anything if the bounds did not change.
+        """
+        bbox = re.findall(r"[+-]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?", extent)
+        llbbox = re.findall(r"[+-]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?", llextent)
+
+        new_bbox = str([float(l) for l in bbox])
+        new_llbbox = str([float(l) for l in llbbox])
+        if new_bbox == self.bbox and new_llbbox == self.llbbox:
+            return False
 
         #Assign new bbox to Layer
-        self.bbox = str([float(l) for l in bbox])
-        self.llbbox = str([float(l) for l in llbbox])
+        self.bbox = new_bbox
+        self.llbbox = new_llbbox
         self.set_bbox(bbox, srs=self.srs)
 
         #Update Geoserver bounding boxes
@@ -1610,6 +1707,7 @@ class Layer(models.Model, PermissionLevelMixin):
         #Update geonetwork record with latest extent
         logger.info("Save new bounds to geonetwork")
         self.save_to_geonetwork()
+        return True
 
 
 class LayerAttributeManager(models.Manager):
@@ -1749,7 +1847,8 @@ class Map(models.Model, PermissionLevelMixin):
 
     @property
     def snapshots(self):
-        snapshots = MapSnapshot.objects.exclude(user=None).filter(map=self.id)
+        # Listing the history does not need the configurations
+        snapshots = MapSnapshot.objects.exclude(user=None).filter(map=self.id).defer('config').select_related('user')
         return [snapshot for snapshot in snapshots]
 
     @property
@@ -1795,6 +1894,25 @@ class Map(models.Model, PermissionLevelMixin):
 
         return json.dumps(map_config)
 
+    def config_version(self):
+        """
+        Version of the map's viewer configuration, changed by
+        config_changed.  A random token, so that a version lost by the cache
+        is never reused.
+        """
+        key = 'map_config_version_' + str(self.id)
+        version = cache.get(key)
+        if version is None:
+            cache.add(key, uuid.uuid4().hex, settings.MAP_CONFIG_CACHE_TIMEOUT)
+            version = cache.get(key) or 'uncached'
+        return version
+
+    def config_changed(self):
+        """
+        Drop the cached viewer configuration of the map, see viewer_json.
+        """
+        config_changed([self.id])
+
     def viewer_json(self, user=None, *added_layers):
         """
         Convert this map to a nested dictionary structure matching the JSON
@@ -1804,59 +1922,125 @@ class Map(models.Model, PermissionLevelMixin):
         instances to append to the Map's layer list when generating the
         configuration. These are not persisted; if you want to add layers you
         should use ``.layer_set.create()``.
+
+        Without added layers, the configuration is compiled once per config
+        version and cached; only the layers the user may not view are
+        disabled for each request.
         """
-        layers = list(self.maplayers) + list(added_layers) #implicitly sorted by stack_order
+        if added_layers or self.id is None:
+            return self._viewer_json(user, *added_layers)
+
+        compiled, fresh = self.compiled_config()
+        if not fresh:
+            # layer_config only asks HGL to load its layers when compiling
+            self.load_hgl_layers(compiled['hgl_layers'])
+        config = compiled['config']
+        if user is not None:
+            self.disable_hidden_layers(config, compiled['layer_ids'], user)
+        return config
 
-        sejumps = self.jump_set.all()
-        server_lookup = {}
-        sources = {'local': settings.DEFAULT_LAYER_SOURCE }
+    def config_validator(self, user):
+        """
+        Return (state, last modification time) of the viewer configuration
+        of the map as seen by ``user``, from the modification times of the
+        map, its map layers and their GeoNode layers and the layers the user
+        may not view, without compiling it.  The state changes whenever the
+        configuration does.  See geonode.maps.views.conditional_response.
+        """
+        maplayers = MapLayer.objects.filter(map=self)
+        maplayer_state = maplayers.aggregate(count=Count('id'), modified=Max('last_modified'))
+        layer_state, layers_modified = layer_config_validator(maplayers.values('name'), user)
+        state = (self.id, self.last_modified, maplayer_state['count'], maplayer_state['modified'],
+                 list(self.jump_set.values_list('id', 'url', 'title')), layer_state)
+        return state, max(self.last_modified, maplayer_state['modified'], layers_modified)
+
+    def compiled_config(self):
+        """
+        Return the viewer configuration of the map for any user, with the ids
+        of its GeoNode layers by typename and the names of its HGL layers, as
+        a dict cached per config version, and whether it was compiled by this
+        call.
+        """
+        cache_key = 'map_viewer_config_%s_%s' % (self.id, self.config_version())
+        compiled = cache.get(cache_key)
+        if compiled is not None:
+            return compiled, False
+        config = self._viewer_json(None)
+        names = [cfg['name'] for cfg in config['map']['layers'] if cfg.get('local')]
+        compiled = {
+            'config': config,
+            'layer_ids': dict(Layer.objects.filter(typename__in=names).values_list('typename', 'id')),
+            'hgl_layers': [l.name for l in self.maplayers if l.source_params.find("gxp_hglsource") > -1],
+        }
+        cache.set(cache_key, compiled, settings.MAP_CONFIG_CACHE_TIMEOUT)
+        return compiled, True
 
-        def uniqify(seq):
-            """
-            get a list of unique items from the input sequence.
+    def load_hgl_layers(self, names):
+        """
+        Ask the HGL service asynchronously to load the named layers into the
+        HGL GeoServer.
+        """
+        from geonode.queue.tasks import loadHGL
+        from geonode.queue.workers import run_async
+        for name in names:
+            run_async(loadHGL, name)
 
-            This relies only on equality tests, so you can use it on most
-            things.  If you have a sequence of hashables, list(set(seq)) is
-            better.
-            """
-            results = []
-            for x in seq:
-                if x not in results: results.append(x)
-            return results
+    def disable_hidden_layers(self, config, layer_ids, user):
+        """
+        Disable the GeoNode layers of a compiled configuration that the user
+        may not view.  Returns the names of the disabled layers.
+        """
+        if user.is_active and user.is_superuser:
+            return []
+        perms = perms_for_objects(user, layer_ids.values(), Layer)
+        disabled = []
+        for cfg in config['map']['layers']:
+            layer_id = layer_ids.get(cfg.get('name')) if cfg.get('local') else None
+            if layer_id is not None:
+                cfg['disabled'] = 'maps.view_layer' not in perms.get(layer_id, ())
+                cfg['visibility'] = cfg['visibility'] and not cfg['disabled']
+                if cfg['disabled']:
+                    disabled.append(cfg['name'])
+        return disabled
+
+    def _viewer_json(self, user=None, *added_layers):
+        layers = list(self.maplayers) + list(added_layers) #implicitly sorted by stack_order
+        gn_layers = Layer.objects.for_map_layers(layers)
+        if user is not None:
+            # resolve the permissions on all the GeoNode layers at once for layer_config
+            perms_for_objects(user, gn_layers.values())
 
+        sejumps = self.jump_set.all()
+        sources = {'local': settings.DEFAULT_LAYER_SOURCE }
 
         def uniqifydict(seq, item):
             """
             get a list of unique dictionary elements based on a certain  item (ie 'group').
             """
             results = []
-            items = []
+            items = set()
             for x in seq:
                 if x[item] not in items:
-                    items.append(x[item])
+                    items.add(x[item])
                     results.append(x)
             return results
 
         configs = [l.source_config() for l in layers]
-        configs.append({"ptype":"gxp_gnsource", "url": settings.GEOSERVER_BASE_URL + "wms", "restUrl":"/gs/rest"})
 
+        # Number each distinct source once, keyed by its canonical JSON
+        source_keys = {}
         i = 0
-        for source in uniqify(configs):
-            while str(i) in sources: i = i + 1
-            sources[str(i)] = source
-            server_lookup[json.dumps(source)] = str(i)
-
-        def source_lookup(source):
-            for k, v in sources.iteritems():
-                if v == source: return k
-            return None
-
-        def layer_config(l, user):
+        for source in configs + [{"ptype":"gxp_gnsource", "url": settings.GEOSERVER_BASE_URL + "wms", "restUrl":"/gs/rest"}]:
+            key = source_key(source)
+            if key not in source_keys:
+                while str(i) in sources: i = i + 1
+                sources[str(i)] = source
+                source_keys[key] = str(i)
+
+        def layer_config(l, src_cfg, user):
             logger.debug("_________CALLING viewer_json.layer_config for %s", l)
-            cfg = l.layer_config(user)
-            src_cfg = l.source_config()
-            source = source_lookup(src_cfg)
-            if source: cfg["source"] = source
+            cfg = l.layer_config(user, gn_layers)
+            cfg["source"] = source_keys[source_key(src_cfg)]
             if src_cfg.get("ptype", "gxp_wmscsource") == "gxp_wmscsource"  or src_cfg.get("ptype", "gxp_gnsource") == "gxp_gnsource" : cfg["buffer"] = 0
             return cfg
 
@@ -1872,7 +2056,7 @@ class Map(models.Model, PermissionLevelMixin):
             'defaultSourceType': "gxp_gnsource",
             'sources': sources,
             'map': {
-                'layers': [layer_config(l, user) for l in layers],
+                'layers': [layer_config(l, src_cfg, user) for l, src_cfg in zip(layers, configs)],
                 'center': [self.center_x, self.center_y],
                 'projection': self.projection,
                 'zoom': self.zoom,
@@ -1935,18 +2119,14 @@ class Map(models.Model, PermissionLevelMixin):
 
         layers = [l for l in conf["map"]["layers"]]
 
-        for layer in self.layer_set.all():
-            layer.delete()
-
-        self.keywords.add(*conf['map'].get('keywords', []))
-
-        for ordering, layer in enumerate(layers):
-            self.layer_set.add(
-                self.layer_set.from_viewer_config(
-                    self, layer, source_for(layer), ordering
-                ))
+        # Saving the map bumps its config version
         self.save()
-        cache.delete('maplayerset_' + str(self.id))
+        self.keywords.add(*conf['map'].get('keywords', []))
+        layers_changed = MapLayer.objects.sync(self, [
+            MapLayer.objects.from_viewer_config(self, layer, source_for(layer), ordering)
+            for ordering, layer in enumerate(layers)])
+        if layers_changed:
+            config_changed([self.id])
 
     def keyword_list(self):
         keywords_qs = self.keywords.all()
@@ -1976,25 +2156,109 @@ class Map(models.Model, PermissionLevelMixin):
         self.set_gen_level(CUSTOM_GROUP_USERS, self.LEVEL_READ)
 
         # remove specific user permissions
-        current_perms =  self.get_all_level_info()
-        for username in current_perms['users'].keys():
-            user = User.objects.get(username=username)
-            self.set_user_level(user, self.LEVEL_NONE)
+        self.get_user_levels().delete()
 
         # assign owner admin privs
         if self.owner:
             self.set_user_level(self.owner, self.LEVEL_ADMIN)
 
 
+class SnapshotConfigManager(models.Manager):
+
+    def store(self, config):
+        """
+        Return the SnapshotConfig holding the JSON configuration ``config``,
+        creating it if no snapshot has the same normalized configuration.
+        """
+        normalized = json.dumps(json.loads(config), sort_keys=True, separators=(',', ':'))
+        digest = hashlib.sha1(normalized).hexdigest()
+        content, created = self.get_or_create(hash=digest, defaults={
+            'data': base64.b64encode(zlib.compress(normalized, 9))})
+        return content
+
+
+class SnapshotConfig(models.Model):
+    """
+    A map configuration shared by the snapshots that have it, stored
+    compressed and identified by the SHA-1 of its normalized JSON.
+    """
+    objects = SnapshotConfigManager()
+
+    hash = models.CharField(max_length=40, unique=True)
+
+    data = models.TextField()
+    """
+    Base64 encoded, zlib compressed JSON configuration
+    """
+
+    created_dttm = models.DateTimeField(auto_now_add=True)
+
+    def decode(self):
+        return zlib.decompress(base64.b64decode(self.data))
+
+
+class MapSnapshotManager(models.Manager):
+
+    def create_snapshot(self, map, config, user=None):
+        """
+        Record a snapshot of ``map`` with the JSON configuration ``config``.
+        Returns the latest snapshot of the map instead if it was made by the
+        same user with the same configuration.
+        """
+        content = SnapshotConfig.objects.store(config)
+        latest = self.filter(map=map).defer('config').order_by('-id')[:1]
+        if latest and latest[0].content_id == content.id and latest[0].user_id == (user and user.id):
+            return latest[0]
+        return self.create(map=map, content=content, user=user)
+
+    def compact(self, batch_size=500, verbosity=1, console=sys.stdout):
+        """
+        Move the configurations of the snapshots stored before
+        SnapshotConfig into it.  Snapshots whose configuration is not valid
+        JSON are logged and left as they are.
+
+        Configurations no snapshot uses anymore are kept: a snapshot being
+        saved concurrently may be about to use one of them.
+        """
+        count = 0
+        last_id = 0
+        while True:
+            batch = list(self.filter(content__isnull=True, id__gt=last_id)
+                         .order_by('id').only('id', 'config')[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            with transaction.commit_on_success(using=self.db):
+                for snapshot in batch:
+                    try:
+                        content = SnapshotConfig.objects.store(snapshot.config)
+                    except ValueError, e:
+                        logger.warning("Skipped snapshot %s with an invalid configuration: %s", snapshot.id, e)
+                        continue
+                    self.filter(id=snapshot.id).update(content=content, config='')
+                    count += 1
+            if verbosity > 0:
+                print >> console, "Compacted %d snapshots" % count
+        return count
+
+
 class MapSnapshot(models.Model):
+    objects = MapSnapshotManager()
+
     map = models.ForeignKey(Map, related_name="snapshot_set")
     """
     The ID of the map this snapshot was generated from.
     """
 
-    config = models.TextField(_('JSON Configuration'))
+    config = models.TextField(_('JSON Configuration'), blank=True)
+    """
+    Map configuration in JSON format, of snapshots made before content was
+    added.  See config_json.
+    """
+
+    content = models.ForeignKey(SnapshotConfig, blank=True, null=True)
     """
-    Map configuration in JSON format
+    The compressed map configuration, shared by identical snapshots
     """
 
     created_dttm = models.DateTimeField(auto_now_add=True)
@@ -2010,9 +2274,17 @@ class MapSnapshot(models.Model):
     def url(self):
         return num_encode(self.id)
 
+    def config_json(self):
+        """
+        Map configuration in JSON format, loaded and decompressed on first use
+        """
+        if self.content_id is not None:
+            return self.content.decode()
+        return self.config
+
     def json(self):
         return {
-            "map": self.map.id,
+            "map": self.map_id,
             "created": self.created_dttm.isoformat(),
             "user": self.user.username if self.user else None,
             "url": self.url()
@@ -2069,6 +2341,54 @@ class MapLayerManager(models.Manager):
             source_params = json.dumps(source_cfg)
         )
 
+    def sync(self, map_model, layers):
+        """
+        Make the layers of ``map_model`` match the list of unsaved MapLayer
+        instances ``layers`` (see from_viewer_config), writing only what
+        changed: layers are matched to the existing rows with the same name
+        and URL, preferably at the same position, matched rows have their
+        changed fields updated, and the other rows are inserted or deleted
+        in bulk.  Returns True if any row changed.
+
+        Signals are not sent, callers should call config_changed.
+        """
+        existing = {}
+        for row in self.filter(map=map_model).order_by('stack_order'):
+            existing.setdefault((row.name, row.ows_url), []).append(row)
+
+        added = []
+        updates = []
+        for layer in layers:
+            pre_save_maplayer(layer, MapLayer)
+            candidates = existing.get((layer.name, layer.ows_url))
+            if not candidates:
+                added.append(layer)
+                continue
+            row = ([c for c in candidates if c.stack_order == layer.stack_order] or candidates)[0]
+            candidates.remove(row)
+            changed = dict((field, getattr(layer, field)) for field in MAPLAYER_CONFIG_FIELDS
+                           if getattr(layer, field) != getattr(row, field))
+            if changed:
+                changed['last_modified'] = datetime.now()
+                updates.append((row.id, changed))
+        removed = [row.id for rows in existing.values() for row in rows]
+
+        with transaction.commit_on_success(using=self.db):
+            if removed:
+                # A single statement, QuerySet.delete() loads every row to send signals
+                connection = connections[self.db]
+                connection.cursor().execute("DELETE FROM %s WHERE id = ANY(%%s)" %
+                                            connection.ops.quote_name(MapLayer._meta.db_table), [removed])
+            for row_id, changed in updates:
+                self.filter(id=row_id).update(**changed)
+            if added:
+                self.bulk_create(added)
+        return bool(removed or updates or added)
+
+# MapLayer fields set from a viewer configuration, see MapLayerManager.sync
+MAPLAYER_CONFIG_FIELDS = ('stack_order', 'format', 'name', 'opacity', 'styles', 'transparent',
+                          'fixed', 'group', 'visibility', 'ows_url', 'layer_params', 'source_params')
+
 class MapLayer(models.Model):
     """
     The MapLayer model represents a layer included in a map.  This doesn't just
@@ -2182,7 +2502,7 @@ class MapLayer(models.Model):
             cfg["restUrl"] = "/gs/rest"
         return cfg
 
-    def layer_config(self, user):
+    def layer_config(self, user, layers=None):
         """
         Generate a dict that can be serialized to a GXP layer configuration
         suitable for loading this layer.
@@ -2191,14 +2511,10 @@ class MapLayer(models.Model):
         name assigned to its source plugin.  See
         :method:`geonode.maps.models.Map.viewer_json` for an example of
         generating a full map configuration.
-        """
-        #       Caching of  maplayer config, per user (due to permissions)
-        if self.id is not None:
-            cfg = cache.get("maplayer_config_" + str(self.id) + "_" + str(0 if user is None else user.id))
-            if cfg is not None:
-                logger.debug("Cached cfg: %s", str(cfg))
-                return cfg
 
+        ``layers`` is an optional dict of typename -> Layer, as returned by
+        LayerManager.for_map_layers, to look up the GeoNode layer in.
+        """
         try:
             cfg = json.loads(self.layer_params)
         except Exception:
@@ -2221,7 +2537,12 @@ class MapLayer(models.Model):
         if self.name is not None and self.source_params.find( "gxp_gnsource") > -1:
             #Get parameters from GeoNode instead of WMS GetCapabilities
             try:
-                gnLayer = Layer.objects.get(typename=self.name)
+                if layers is None:
+                    gnLayer = Layer.objects.get(typename=self.name)
+                elif self.name in layers:
+                    gnLayer = layers[self.name]
+                else:
+                    raise Layer.DoesNotExist("Layer matching query does not exist.")
                 if gnLayer.srs: cfg['srs'] = gnLayer.srs
                 if gnLayer.bbox: cfg['bbox'] = json.loads(gnLayer.bbox)
                 if gnLayer.llbbox: cfg['llbbox'] = json.loads(gnLayer.llbbox)
@@ -2250,12 +2571,9 @@ class MapLayer(models.Model):
         elif self.source_params.find( "gxp_hglsource") > -1:
             # call HGL ServiceStarter asynchronously to load the layer into HGL geoserver
             from geonode.queue.tasks import loadHGL
-            loadHGL.delay(self.name)
-
+            from geonode.queue.workers import run_async
+            run_async(loadHGL, self.name)
 
-        #Create cache of maplayer config that will last for 60 seconds (in case permissions or maplayer properties are changed)
-        if self.id is not None:
-            cache.set("maplayer_config_" + str(self.id) + "_" + str(0 if user is None else user.id), cfg, 60)
         return cfg
 
 
@@ -2277,7 +2595,8 @@ class MapLayer(models.Model):
 
 def pre_save_maplayer(instance, sender, **kwargs):
 
-    if instance.local():
+    # Only https URLs are rewritten, skip the local() lookup otherwise
+    if 'https://' in instance.layer_params and instance.local():
         print 'Fixing layer_params url for layer %s' % instance.name
         instance.layer_params = instance.layer_params.replace('https://', 'http://')
 
@@ -2368,6 +2687,70 @@ signals.post_save.connect(post_save_layer, sender=Layer)
 signals.post_save.connect(post_save_map, sender=Map)
 
 
+def layer_config_validator(typenames, user):
+    """
+    Return (state, last modification time) of the configurations of the
+    GeoNode layers with the given typenames as seen by ``user``: their
+    number, the modification times of the layers and their attributes, and
+    the layers the user may not view.
+    """
+    layers = Layer.objects.filter(typename__in=typenames)
+    layer_ids = dict(layers.values_list('typename', 'id'))
+    layer_state = layers.aggregate(modified=Max('last_modified'), attributes=Count('attribute_set'),
+                                   attributes_modified=Max('attribute_set__last_modified'))
+    hidden = []
+    if layer_ids and not (user.is_active and user.is_superuser):
+        perms = perms_for_objects(user, layer_ids.values(), Layer)
+        hidden = sorted(layer_id for layer_id in layer_ids.values()
+                        if 'maps.view_layer' not in perms.get(layer_id, ()))
+    state = (sorted(layer_ids.items()), layer_state['modified'], layer_state['attributes'],
+             layer_state['attributes_modified'], hidden)
+    return state, max(layer_state['modified'], layer_state['attributes_modified'])
+
+def config_changed(map_ids, layers=True):
+    """
+    Drop the cached viewer configurations of maps, see Map.viewer_json, and
+    their cached layer lists unless ``layers`` is False.
+    """
+    keys = []
+    for map_id in map_ids:
+        keys.append('map_config_version_' + str(map_id))
+        if layers:
+            keys.append('maplayerset_' + str(map_id))
+    cache.delete_many(keys)
+    from geonode.maps.bundles import unpublish
+    unpublish(map_ids)
+
+def map_config_changed(instance, sender, **kwargs):
+    # Saving a map does not change its layers
+    config_changed([instance.id], layers=kwargs.get('signal') is signals.post_delete)
+
+def map_object_config_changed(instance, sender, **kwargs):
+    config_changed([instance.map_id])
+
+def layer_config_changed(instance, sender, **kwargs):
+    if sender is LayerAttribute:
+        # The layer is gone when its attributes are deleted with it
+        typenames = list(Layer.objects.filter(id=instance.layer_id).values_list('typename', flat=True))
+    else:
+        typenames = [instance.typename]
+    config_changed(set(MapLayer.objects.filter(name__in=typenames).values_list('map', flat=True)))
+
+def categories_changed(instance, sender, **kwargs):
+    # Bundles include the list of categories
+    from geonode.maps.bundles import unpublish_all
+    unpublish_all()
+
+signals.post_save.connect(categories_changed, sender=LayerCategory)
+signals.post_delete.connect(categories_changed, sender=LayerCategory)
+
+for sender, handler in ((Map, map_config_changed), (MapLayer, map_object_config_changed),
+                        (SocialExplorerLocation, map_object_config_changed),
+                        (Layer, layer_config_changed), (LayerAttribute, layer_config_changed)):
+    signals.post_save.connect(handler, sender=sender)
+    signals.post_delete.connect(handler, sender=sender)
+
+
 
 #===================#
 #    NEW WORLDMAP MODELS      #
@@ -2399,3 +2782,111 @@ class Endpoint(models.Model):
     description = models.TextField(_('Describe Map Service'))
     url = models.URLField(_('Map service URL'))
     owner = models.ForeignKey(User, blank=True, null=True)
+
+
+class LayerACLManager(models.Manager):
+
+    def refresh(self, layer_ids, user=None, subject=None):
+        """
+        Recompute the ACL rows of the given layers from their role mappings,
+        only the rows of ``user`` or of the generic role ``subject`` if one
+        is given.
+        """
+        ct = ContentType.objects.get_for_model(Layer)
+        # Role mappings are left behind when layers are deleted
+        layer_ids = list(Layer.objects.filter(id__in=list(layer_ids)).values_list('id', flat=True))
+        if not layer_ids:
+            return
+        rows = self.filter(layer__in=layer_ids)
+        user_mappings = UserObjectRoleMapping.objects.filter(object_ct=ct, object_id__in=layer_ids)
+        generic_mappings = GenericObjectRoleMapping.objects.filter(object_ct=ct, object_id__in=layer_ids)
+        if user is not None:
+            rows = rows.filter(user=user)
+            user_mappings = user_mappings.filter(user=user)
+            generic_mappings = generic_mappings.none()
+        elif subject is not None:
+            rows = rows.filter(user__isnull=True, subject=subject)
+            user_mappings = user_mappings.none()
+            generic_mappings = generic_mappings.filter(subject=subject)
+
+        # (layer id, user id, generic role) -> [readable, writable]
+        acls = {}
+        user_rows = (
+            ((layer_id, user_id, ''), codename) for layer_id, user_id, codename in
+            user_mappings.values_list('object_id', 'user', 'role__permissions__codename'))
+        generic_rows = (
+            ((layer_id, None, role), codename) for layer_id, role, codename in
+            generic_mappings.values_list('object_id', 'subject', 'role__permissions__codename'))
+        for key, codename in itertools.chain(user_rows, generic_rows):
+            acl = acls.setdefault(key, [False, False])
+            if codename == 'view_layer':
+                acl[0] = True
+            elif codename == 'change_layer':
+                acl[1] = True
+
+        with transaction.commit_on_success(using=self.db):
+            # Serialize concurrent refreshes of the same layers
+            list(Layer.objects.select_for_update().filter(id__in=layer_ids).values_list('id', flat=True))
+            rows.delete()
+            self.bulk_create([LayerACL(layer_id=layer_id, user_id=user_id, subject=role,
+                                       readable=readable, writable=writable)
+                              for (layer_id, user_id, role), (readable, writable) in acls.iteritems()
+                              if readable or writable])
+
+    def for_user(self, user, generic_roles):
+        """
+        Return (read-write typenames, read-only typenames) of the layers the
+        user can access, in a single query.
+        """
+        grantees = Q(user__isnull=True, subject__in=generic_roles)
+        if not user.is_anonymous():
+            grantees |= Q(user=user)
+        readable, writable = set(), set()
+        for typename, can_read, can_write in self.filter(grantees).values_list('layer__typename', 'readable', 'writable'):
+            if can_read:
+                readable.add(typename)
+            if can_write:
+                writable.add(typename)
+        return sorted(readable & writable), sorted(readable - writable)
+
+
+class LayerACL(models.Model):
+    """
+    Access to a layer granted to a user or to a generic role (anonymous,
+    authenticated, customgroup users), materialized from the role mappings
+    for GeoServer's layer_acls callback.
+    """
+    layer = models.ForeignKey(Layer)
+    user = models.ForeignKey(User, blank=True, null=True)
+    subject = models.CharField(max_length=100, blank=True, db_index=True)
+    readable = models.BooleanField(default=False)
+    writable = models.BooleanField(default=False)
+
+    objects = LayerACLManager()
+
+    class Meta:
+        unique_together = (('layer', 'user', 'subject'),)
+
+
+def refresh_layer_acl(instance, sender, **kwargs):
+    # Fixtures are loaded in any order, see the maps 0016 migration or
+    # LayerACL.objects.refresh for existing mappings
+    if kwargs.get('raw') or instance.object_ct_id != ContentType.objects.get_for_model(Layer).id:
+        return
+    if sender is UserObjectRoleMapping:
+        LayerACL.objects.refresh([instance.object_id], user=instance.user_id)
+    else:
+        LayerACL.objects.refresh([instance.object_id], subject=instance.subject)
+
+def refresh_all_layer_acls(instance, sender, **kwargs):
+    if kwargs['action'] in ('post_add', 'post_remove', 'post_clear'):
+        LayerACL.objects.refresh(Layer.objects.values_list('id', flat=True))
+
+def refresh_changed_layer_acls(sender, object_ids, **kwargs):
+    LayerACL.objects.refresh(object_ids)
+
+permission_levels_changed.connect(refresh_changed_layer_acls, sender=Layer)
+for mapping_model in (UserObjectRoleMapping, GenericObjectRoleMapping):
+    signals.post_save.connect(refresh_layer_acl, sender=mapping_model)
+    signals.post_delete.connect(refresh_layer_acl, sender=mapping_model)
+signals.m2m_changed.connect(refresh_all_layer_acls, sender=ObjectRole.permissions.through)
@@ -258,11 +258,125 @@ community."
         self.assertEquals(map.abstract, "Abstract2")
         self.assertEquals(map.layer_set.all().count(), 1)
 
-    #    def test_map_viewer_json(self):
-    #        pass
-
-    #    def test_map_update_from_viewer(self):
-    #        pass
+    def test_viewer_json_query_count(self):
+        """Verify that the number of queries of a map configuration does not
+        grow with the number of layers
+        """
+        from django.db import connection
+        from geonode.maps.models import MapLayer
+
+        def make_map(title, layer_count):
+            map = Map.objects.create(owner=User.objects.get(username='admin'), title=title, zoom=0,
+                center_x=0, center_y=0, projection='EPSG:900913')
+            Layer.objects.bulk_create([Layer(workspace='base', store='base', storeType='dataStore',
+                name='%s_%d' % (title, i), typename='base:%s_%d' % (title, i), uuid='%s-%d' % (title, i),
+                title=title, abstract='', geographic_bounding_box='', srs='EPSG:900913',
+                bbox='[0, 0, 1, 1]', llbbox='[0, 0, 1, 1]') for i in range(layer_count)])
+            layers = Layer.objects.filter(typename__startswith='base:%s_' % title)
+            LayerAttribute.objects.bulk_create([LayerAttribute(layer=layer, attribute=name,
+                attribute_label=name.upper(), display_order=order)
+                for layer in layers for order, name in enumerate(['name', 'population'])])
+            MapLayer.objects.bulk_create([MapLayer(map=map, stack_order=i, name=layer.typename,
+                ows_url=settings.GEOSERVER_BASE_URL + 'wms', layer_params='{}',
+                source_params='{"ptype": "gxp_gnsource"}') for i, layer in enumerate(layers)])
+            return map
+
+        def count_queries(func):
+            connection.use_debug_cursor = True
+            try:
+                start = len(connection.queries)
+                func()
+                return len(connection.queries) - start
+            finally:
+                connection.use_debug_cursor = None
+
+        small = make_map('small', 2)
+        large = make_map('large', 60)
+        small_count = count_queries(lambda: small._viewer_json(AnonymousUser()))
+        config = []
+        large_count = count_queries(lambda: config.append(large._viewer_json(AnonymousUser())))
+        self.assertEquals(small_count, large_count)
+        cfg = config[0]['map']['layers'][0]
+        self.assertEquals([{'id': 'name', 'header': 'NAME', 'searchable': False},
+            {'id': 'population', 'header': 'POPULATION', 'searchable': False}], cfg['attributes'])
+        self.assertEquals(['name', 'population'], cfg['getFeatureInfo']['fields'])
+
+    def test_viewer_json_large_map(self):
+        """Verify that sources and groups of a large map are deduplicated
+        """
+        from geonode.maps.models import MapLayer
+        map = Map.objects.get(id=1)
+        map.group_params = json.dumps([{'group': 'group %d' % (i % 50)} for i in range(1000)])
+        added = [MapLayer(map=map, stack_order=100 + i, name='layer%d' % i, layer_params='{}',
+            ows_url='http://wms%d.example.com/wms' % (i % 40), source_params='{}') for i in range(1000)]
+        config = map._viewer_json(None, *added)
+
+        # the fixture's sources, the 40 servers and the local GeoServer
+        added_sources = [k for k, v in config['sources'].items() if 'example.com' in v.get('url', '')]
+        self.assertEquals(40, len(added_sources))
+        for cfg in config['map']['layers'][-1000:]:
+            self.assertEquals(cfg['url'], config['sources'][cfg['source']]['url'])
+        self.assertEquals(50, len(config['map']['groups']))
+
+    def test_map_viewer_json_cache(self):
+        """Verify that viewer configurations are cached until the map changes
+        """
+        from django.core.cache.backends.locmem import LocMemCache
+        from geonode.maps.models import MapLayer
+        config_cache = LocMemCache('map-config-test', {})
+        config_cache.clear()
+        with patch.object(geonode.maps.models, 'cache', config_cache):
+            maplayer = MapLayer.objects.get(pk=1)
+            maplayer.source_params = '{"ptype": "gxp_gnsource"}'
+            maplayer.save()
+            map = Map.objects.get(id=1)
+            self.assertEquals(MapTest.default_title, map.viewer_json()['about']['title'])
+
+            # Not seen until the map is saved
+            Map.objects.filter(id=1).update(title="Updated title")
+            self.assertEquals(MapTest.default_title, map.viewer_json()['about']['title'])
+            map = Map.objects.get(id=1)
+            map.save()
+            self.assertEquals("Updated title", map.viewer_json()['about']['title'])
+
+            # Layers are disabled for each user
+            layer = Layer.objects.get(typename='base:CA')
+            layer.set_gen_level(geonode.core.models.ANONYMOUS_USERS, layer.LEVEL_NONE)
+            cfg = [l for l in map.viewer_json(AnonymousUser())['map']['layers'] if l['name'] == 'base:CA'][0]
+            self.assertTrue(cfg['disabled'])
+            self.assertFalse(cfg['visibility'])
+            admin = User.objects.get(username='admin')
+            cfg = [l for l in map.viewer_json(admin)['map']['layers'] if l['name'] == 'base:CA'][0]
+            self.assertFalse(cfg['disabled'])
+
+    def test_map_update_from_viewer(self):
+        """Verify that saving a map only writes the layers that changed
+        """
+        from geonode.maps.models import MapLayer
+        map = Map.objects.get(id=1)
+        # Converge on the configuration as the viewer saves it
+        for i in range(2):
+            map.update_from_viewer(json.dumps(map.viewer_json()))
+        rows = list(map.layer_set.values_list('id', 'name', 'last_modified'))
+
+        conf = map.viewer_json()
+        conf['map']['center'] = [10, 20]
+        map.update_from_viewer(json.dumps(conf))
+        self.assertEquals(rows, list(map.layer_set.values_list('id', 'name', 'last_modified')))
+        self.assertEquals([10, 20], map.viewer_json()['map']['center'])
+
+        # Move the last layer to the bottom, drop the second one, add one
+        layers = conf['map']['layers']
+        added = dict(layers[0], name='added_layer')
+        conf['map']['layers'] = [layers[-1], layers[0]] + layers[2:-1] + [added]
+        map.update_from_viewer(json.dumps(conf))
+        ids = [row[0] for row in rows]
+        new_rows = list(map.layer_set.values_list('id', 'name', 'stack_order'))
+        self.assertEquals(len(layers), len(new_rows))
+        self.assertEquals([ids[-1], ids[0]] + ids[2:-1], [row[0] for row in new_rows[:-1]])
+        self.assertFalse(new_rows[-1][0] in ids)
+        self.assertEquals('added_layer', new_rows[-1][1])
+        self.assertEquals(range(len(layers)), [row[2] for row in new_rows])
 
     #    def test_map_get_absolute_url(self):
     #        pass
@@ -389,6 +503,41 @@ community."
         self.assertEquals(cfg["about"]["title"], self.default_title)
         self.assertEquals(len(cfg["map"]["layers"]), 5)
 
+    def test_map_snapshots(self):
+        """Verify that identical snapshot configurations are stored once
+        """
+        from geonode.maps.models import MapSnapshot, SnapshotConfig
+        map = Map.objects.get(id=1)
+        admin = User.objects.get(username='admin')
+        config = json.dumps(map.viewer_json())
+
+        snapshot = MapSnapshot.objects.create_snapshot(map, config, admin)
+        self.assertEquals(json.loads(config), json.loads(snapshot.config_json()))
+        # Saving the same configuration again does not add to the history
+        same = MapSnapshot.objects.create_snapshot(map, json.dumps(json.loads(config), indent=2), admin)
+        self.assertEquals(snapshot.id, same.id)
+        permalink = MapSnapshot.objects.create_snapshot(map, config)
+        self.assertNotEquals(snapshot.id, permalink.id)
+        self.assertEquals(snapshot.content_id, permalink.content_id)
+        self.assertEquals(1, SnapshotConfig.objects.count())
+        self.assertEquals([snapshot.json()], [s.json() for s in map.snapshots])
+
+        # Snapshots saved before the snapshot store are moved to it
+        legacy = MapSnapshot.objects.create(map=map, config=config, user=admin)
+        self.assertEquals(config, legacy.config_json())
+        self.assertEquals(1, MapSnapshot.objects.compact(verbosity=0))
+        legacy = MapSnapshot.objects.get(id=legacy.id)
+        self.assertEquals(snapshot.content_id, legacy.content_id)
+        self.assertEquals('', legacy.config)
+        self.assertEquals(json.loads(config), json.loads(legacy.config_json()))
+
+        # Snapshots with a configuration that is not JSON are skipped
+        broken = MapSnapshot.objects.create(map=map, config='', user=admin)
+        legacy = MapSnapshot.objects.create(map=map, config=config, user=admin)
+        self.assertEquals(1, MapSnapshot.objects.compact(verbosity=0))
+        self.assertEquals(None, MapSnapshot.objects.get(id=broken.id).content_id)
+        self.assertEquals(snapshot.content_id, MapSnapshot.objects.get(id=legacy.id).content_id)
+
     def test_map_to_json(self):
         """ Make some assertions about the data structure produced for serialization
             to a JSON map configuration"""
@@ -500,6 +649,66 @@ community."
             print user.username
             self.assertEqual(layer.get_user_level(user), level)
 
+    def test_perms_for_objects(self):
+        """Verify that GranularBackend.perms_for_objects matches has_perm and
+        warms its cache
+        """
+        from geonode.core.auth import GranularBackend
+        backend = GranularBackend()
+        layer = Layer.objects.all()[0]
+        layer.set_gen_level(geonode.core.models.ANONYMOUS_USERS, layer.LEVEL_NONE)
+        expected = sorted(backend.get_all_permissions(AnonymousUser(), layer))
+
+        user = AnonymousUser()
+        # the ids, then the generic role mappings (anonymous users have no
+        # user mappings)
+        with self.assertNumQueries(2):
+            perms = backend.perms_for_objects(user, Layer.objects.all())
+        self.assertEqual({layer.id: expected}, dict((k, sorted(v)) for k, v in perms.items()))
+        with self.assertNumQueries(0):
+            self.assertFalse(backend.has_perm(user, 'maps.view_layer', layer))
+
+        layer.set_gen_level(geonode.core.models.ANONYMOUS_USERS, layer.LEVEL_READ)
+        user = AnonymousUser()
+        perms = backend.perms_for_objects(user, [layer.id], Layer)
+        self.assertTrue('maps.view_layer' in perms[layer.id])
+        with self.assertNumQueries(0):
+            self.assertTrue(backend.has_perm(user, 'maps.view_layer', layer))
+
+    def test_role_registry(self):
+        """Verify that roles are looked up without queries once loaded
+        """
+        from django.contrib.contenttypes.models import ContentType
+        from geonode.core.models import ObjectRole
+        layer = Layer.objects.all()[0]
+        ct = ContentType.objects.get_for_model(layer)
+        levels = layer.permission_levels
+        self.assertEqual(layer.LEVEL_NONE, levels[0])
+        self.assertTrue(layer.LEVEL_READ in levels)
+        with self.assertNumQueries(0):
+            self.assertEqual(levels, layer.permission_levels)
+            self.assertEqual(layer.LEVEL_READ, ObjectRole.objects.get_role(ct, layer.LEVEL_READ).codename)
+        self.assertRaises(ObjectRole.DoesNotExist, ObjectRole.objects.get_role, ct, 'no_such_role')
+
+        # Changed roles are reloaded
+        role = ObjectRole.objects.get_role(ct, layer.LEVEL_READ)
+        role.list_order = 1000
+        role.save()
+        self.assertEqual(layer.LEVEL_READ, layer.permission_levels[-1])
+
+        # Including when another process changed them
+        from django.core.cache.backends.locmem import LocMemCache
+        shared = LocMemCache('role-registry-test', {})
+        shared.clear()
+        with patch.object(geonode.core.models, 'cache', shared):
+            ObjectRole.objects.get_role(ct, layer.LEVEL_READ)
+            with self.assertNumQueries(0):
+                ObjectRole.objects.get_role(ct, layer.LEVEL_READ)
+            ObjectRole.objects.filter(id=role.id).update(list_order=-1)
+            shared.incr(geonode.core.models.ROLE_REGISTRY_SERIAL_KEY)
+            self.assertEqual(-1, ObjectRole.objects.get_role(ct, layer.LEVEL_READ).list_order)
+            self.assertEqual(layer.LEVEL_READ, layer.permission_levels[1])
+
     def test_view_layer_permissions(self):
         """Verify that the view_layer_permissions view is behaving as expected
         """
@@ -559,6 +768,88 @@ community."
         # Should we do this here, or assume the tests in
         # test_set_layer_permissions will handle for that?
 
+    def test_official_site_config(self):
+        """Verify that official map configurations are served from their
+        bundle until the map changes
+        """
+        import shutil
+        import tempfile
+        from geonode.maps import bundles
+        bundle_root = tempfile.mkdtemp()
+        try:
+            with self.settings(MAP_BUNDLE_ROOT=bundle_root):
+                Map.objects.filter(id=1).update(officialurl='official')
+                c = Client()
+                c.login(username='admin', password='admin')
+                response = c.get('/official/config', HTTP_ACCEPT_ENCODING='gzip')
+                self.assertEquals(200, response.status_code)
+                self.assertEquals('gzip', response['Content-Encoding'])
+                config = bundles.decode(response.content)
+                self.assertEquals(MapTest.default_title, config['about']['title'])
+                self.assertTrue('topic_categories' in config)
+                self.assertTrue(os.path.exists(bundles.bundle_path(1, Map.objects.get(id=1).config_version())))
+
+                response = c.get('/official/config', HTTP_ACCEPT_ENCODING='gzip',
+                                 HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEquals(304, response.status_code)
+                response = c.get('/official/config')
+                self.assertFalse(response.has_header('Content-Encoding'))
+                self.assertEquals(config, json.loads(response.content))
+
+                # Changes are published with the next request
+                map = Map.objects.get(id=1)
+                map.title = 'Updated title'
+                map.save()
+                self.assertFalse(os.listdir(bundle_root))
+                response = c.get('/official/config')
+                self.assertEquals('Updated title', json.loads(response.content)['about']['title'])
+
+                # A bundle of an older config version is not served
+                from django.core.cache.backends.locmem import LocMemCache
+                config_cache = LocMemCache('map-bundle-test', {})
+                config_cache.clear()
+                with patch.object(geonode.maps.models, 'cache', config_cache):
+                    bundles.publish(map)
+                    # Changed after a request read the map, without unpublishing
+                    Map.objects.filter(id=1).update(title='Newer title')
+                    config_cache.delete('map_config_version_1')
+                    bundle, etag = bundles.get_bundle(Map.objects.get(id=1))
+                    self.assertEquals('Newer title', bundles.decode(bundle)['about']['title'])
+                    self.assertEquals(1, len(os.listdir(bundle_root)))
+        finally:
+            shutil.rmtree(bundle_root)
+
+    def test_map_json_conditional_get(self):
+        """Verify that map configurations are only built again when they
+        changed
+        """
+        c = Client()
+        c.login(username='admin', password='admin')
+        response = c.get('/maps/1/data', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEquals(200, response.status_code)
+        self.assertEquals('gzip', response['Content-Encoding'])
+        self.assertTrue(response.has_header('Last-Modified'))
+        # The ETag of the compressed response, as browsers send it back
+        etag = response['ETag']
+        self.assertTrue(etag.endswith(';gzip"'))
+
+        with patch.object(Map, 'viewer_json') as viewer_json:
+            response = c.get('/maps/1/data', HTTP_IF_NONE_MATCH=etag)
+            self.assertEquals(304, response.status_code)
+            self.assertFalse(viewer_json.called)
+
+        # A change to one of the map's layers changes the ETag
+        layer = Layer.objects.get(typename='base:CA')
+        LayerAttribute.objects.create(layer=layer, attribute='new_attribute', attribute_label='New')
+        response = c.get('/maps/1/data', HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(200, response.status_code)
+        self.assertNotEquals(etag, response['ETag'])
+
+        response = c.get('/maps/history/1')
+        self.assertEquals(200, response.status_code)
+        response = c.get('/maps/history/1', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEquals(304, response.status_code)
+
     def test_layer_acls(self):
         """ Verify that the layer_acls view is behaving as expected
         """
@@ -593,6 +884,24 @@ community."
         response = c.get("/data/acls")
         response_json = json.loads(response.content)
 
+        layer = Layer.objects.all()[0]
+        layer.set_gen_level(geonode.core.models.ANONYMOUS_USERS, layer.LEVEL_READ)
+        layer.set_gen_level(geonode.core.models.AUTHENTICATED_USERS, layer.LEVEL_WRITE)
+        response = c.get("/data/acls")
+        self.assertEquals([layer.typename], json.loads(response.content)['rw'])
+
+        # Unchanged ACLs are revalidated with the ETag
+        response = c.get("/data/acls", HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEquals(304, response.status_code)
+
+        layer.set_gen_level(geonode.core.models.AUTHENTICATED_USERS, layer.LEVEL_NONE)
+        response = c.get("/data/acls", HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEquals(200, response.status_code)
+        response_json = json.loads(response.content)
+        self.assertEquals([], response_json['rw'])
+        self.assertEquals([layer.typename], response_json['ro'])
+        self.assertEquals([layer.typename], json.loads(Client().get("/data/acls").content)['ro'])
+
         # TODO Lots more to do here once jj0hns0n understands the ACL system better
 
     #    def test_view_perms_context(self):
@@ -647,8 +956,49 @@ community."
     #    def test_ajax_map_permissions(self):
     #        pass
 
-    #    def test_batch_permissions(self):
-    #        pass
+    def test_batch_permissions(self):
+        """Verify that batch_permissions applies the spec to every object
+        """
+        from geonode.maps.models import LayerACL
+        c = Client()
+        c.login(username='admin', password='admin')
+        bobby = User.objects.get(username='bobby')
+        spec = {'layers': [1], 'maps': [1], 'permissions': {
+            'anonymous': 'layer_readonly', 'authenticated': 'layer_readwrite', 'users': [['bobby', 'layer_readwrite']]}}
+        response = c.post('/data/api/batch_permissions', json.dumps(spec), content_type='application/json')
+        self.assertEqual(200, response.status_code)
+        summary = json.loads(response.content)
+        self.assertTrue(summary['success'])
+        self.assertEqual(['1'], summary['layers'].keys())
+        self.assertEqual(['1'], summary['maps'].keys())
+
+        layer = Layer.objects.get(pk=1)
+        self.assertEqual('layer_readonly', layer.get_gen_level(geonode.core.models.ANONYMOUS_USERS))
+        self.assertEqual('layer_readwrite', layer.get_gen_level(geonode.core.models.AUTHENTICATED_USERS))
+        self.assertEqual(layer.LEVEL_NONE, layer.get_gen_level(geonode.core.models.CUSTOM_GROUP_USERS))
+        self.assertEqual('layer_readwrite', layer.get_user_level(bobby))
+        self.assertTrue(LayerACL.objects.filter(layer=layer, user=bobby, writable=True).exists())
+        map = Map.objects.get(pk=1)
+        self.assertEqual('map_readonly', map.get_gen_level(geonode.core.models.ANONYMOUS_USERS))
+        # bobby owns the map
+        self.assertEqual(map.LEVEL_ADMIN, map.get_user_level(bobby))
+
+        spec['permissions']['users'] = []
+        response = c.post('/data/api/batch_permissions', json.dumps(spec), content_type='application/json')
+        summary = json.loads(response.content)
+        self.assertEqual({'added': 0, 'removed': 1}, summary['layers']['1'])
+        self.assertEqual({'added': 0, 'removed': 0}, summary['maps']['1'])
+        self.assertEqual(layer.LEVEL_NONE, layer.get_user_level(bobby))
+        self.assertFalse(LayerACL.objects.filter(layer=layer, user=bobby).exists())
+        self.assertEqual(map.LEVEL_ADMIN, map.get_user_level(bobby))
+
+        # Unknown users are reported, the rest of the spec is applied
+        spec['permissions']['users'] = [['nobody', 'layer_readonly'], ['bobby', 'layer_readonly']]
+        response = c.post('/data/api/batch_permissions', json.dumps(spec), content_type='application/json')
+        summary = json.loads(response.content)
+        self.assertFalse(summary['success'])
+        self.assertEqual(['nobody'], summary['unknown_users'])
+        self.assertEqual('layer_readonly', layer.get_user_level(bobby))
 
     # Data Tests
 
@@ -1247,6 +1597,20 @@ class UtilsTest(TestCase):
             mock_catalog.delete.side_effect = blowup
             cleanup("FOO", "1234")
 
+    def test_update_bounds_batch(self):
+        layer = Layer.objects.get(pk=1)
+        Layer.objects.filter(pk=1).update(bbox=str([1.0, 2.0, 3.0, 4.0]), llbbox=str([1.0, 2.0, 3.0, 4.0]))
+        layer = Layer.objects.get(pk=1)
+        extents = {layer.name: ('BOX(1 2,3 4)', 'BOX(1 2,3 4)')}
+        with patch('geonode.maps.models.get_postgis_bboxes', return_value=extents) as mock_bboxes:
+            # Unchanged bounds are not pushed to GeoServer
+            self.assertEquals({1: False}, Layer.objects.update_bounds_batch([layer]))
+            mock_bboxes.assert_called_once_with([layer.name], layer.store)
+
+        error = Exception("no such store")
+        with patch('geonode.maps.models.get_postgis_bboxes', side_effect=error):
+            self.assertEquals({1: error}, Layer.objects.update_bounds_batch([layer]))
+
     def test_check_geonode_is_up(self):
         from contextlib import nested
         from geonode.maps.utils import check_geonode_is_up
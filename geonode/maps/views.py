@@ -1,20 +1,26 @@
-from geonode.core.models import AUTHENTICATED_USERS, ANONYMOUS_USERS, CUSTOM_GROUP_USERS
+from geonode.core.auth import generic_roles, perms_for_objects
+from geonode.core.models import AUTHENTICATED_USERS, ANONYMOUS_USERS, CUSTOM_GROUP_USERS, set_permission_levels
 from geonode.maps.models import Map, Layer, MapLayer, Contact, ContactRole, \
-     get_csw, LayerCategory, LayerAttribute, MapSnapshot, MapStats, LayerStats, CHARSETS
+     get_csw, LayerCategory, LayerAttribute, LayerACL, MapSnapshot, MapStats, LayerStats, CHARSETS, \
+     layer_config_validator
 from geonode.profile.forms import ContactProfileForm
 from geoserver.resource import FeatureType, Coverage
 import base64
+import hashlib
+import time
 from django import forms
-from django.contrib.auth import authenticate, get_backends as get_auth_backends
+from django.contrib.auth import authenticate
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.urlresolvers import reverse
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseNotModified, HttpResponseRedirect
 from django.shortcuts import render_to_response, get_object_or_404
 from django.conf import settings
 from django.template import RequestContext, loader
+from django.utils.http import http_date
 from django.utils.translation import ugettext as _
+from django.views.decorators.gzip import gzip_page
 from django.utils import simplejson as json
 from django.views.generic.simple import direct_to_template
 from django.template.defaultfilters import slugify
@@ -27,10 +33,11 @@ import re
 from urllib import urlencode
 from urlparse import urlparse
 import unicodedata
-from django.db.models import Q
+from django.db.models import Q, Count, Max
 import logging
 from geonode.flexidates import FlexiDateFormField
 import taggit
+from geonode.maps import bundles
 from geonode.maps.utils import forward_mercator
 from geonode.maps.utils import get_db_store_name
 from geonode.maps.owslib_csw import CswRecord
@@ -90,6 +97,44 @@ def default_map_config():
 
 
 
+def categories_validator():
+    """
+    (state, last modification time) of the layer categories, see
+    conditional_response.
+    """
+    state = LayerCategory.objects.aggregate(count=Count('id'), modified=Max('last_modified'))
+    return (state['count'], state['modified']), state['modified']
+
+def combine_validators(*validators):
+    return tuple(state for state, modified in validators), max(modified for state, modified in validators)
+
+def conditional_response(request, validator, build, mimetype=None):
+    """
+    Answer 304 Not Modified if the request's If-None-Match has the ETag
+    derived from ``validator``, a (state, last modification time) pair as
+    returned by Map.config_validator, without calling ``build``.  Otherwise
+    respond with the content or response returned by ``build``.
+
+    The ETags are weak since they identify versions rather than bytes, the
+    views compress their responses for the clients that accept gzip.
+    """
+    state, last_modified = validator
+    etag = 'W/"%s"' % hashlib.md5(repr(state)).hexdigest()
+    # GZipMiddleware appends ;gzip to the ETags of the responses it compresses
+    tags = [re.sub(';gzip"$', '"', tag.strip()) for tag in request.META.get('HTTP_IF_NONE_MATCH', '').split(',')]
+    if etag in tags:
+        response = HttpResponseNotModified()
+    else:
+        response = build()
+        if not isinstance(response, HttpResponse):
+            response = HttpResponse(response, mimetype=mimetype)
+        if response.status_code != 200:
+            return response
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(time.mktime(last_modified.timetuple()))
+    return response
+
 def bbox_to_wkt(x0, x1, y0, y1, srid="4326"):
     return 'SRID='+srid+';POLYGON(('+x0+' '+y0+','+x0+' '+y1+','+x1+' '+y1+','+x1+' '+y0+','+x0+' '+y0+'))'
 
@@ -213,7 +258,7 @@ def maps(request): # , mapid=None):
             map_obj.set_default_permissions()
             try:
                 map_obj.update_from_viewer(request.raw_post_data)
-                MapSnapshot.objects.create(config=clean_config(request.raw_post_data),map=map_obj,user=request.user)
+                MapSnapshot.objects.create_snapshot(map_obj, clean_config(request.raw_post_data), request.user)
 
                 # audit action
                 username = request.user.get_profile().username()
@@ -233,13 +278,15 @@ def maps(request): # , mapid=None):
                 return response
 
 
+@gzip_page
 def mapJSON(request, mapid):
     if request.method == 'GET':
         map_obj = get_object_or_404(Map,pk=mapid)
         if not request.user.has_perm('maps.view_map', obj=map_obj):
             return HttpResponse(loader.render_to_string('401.html',
                 RequestContext(request, {})), status=401)
-    	return HttpResponse(json.dumps(map_obj.viewer_json(request.user)))
+        return conditional_response(request, map_obj.config_validator(request.user),
+                                    lambda: json.dumps(map_obj.viewer_json(request.user)))
     elif request.method == 'PUT':
         if not request.user.is_authenticated():
             return HttpResponse(
@@ -252,7 +299,7 @@ def mapJSON(request, mapid):
             return HttpResponse(_("You are not allowed to modify this map."), status=403)
         try:
             map_obj.update_from_viewer(request.raw_post_data)
-            MapSnapshot.objects.create(config=clean_config(request.raw_post_data),map=Map.objects.get(id=map_obj.id),user=request.user)
+            MapSnapshot.objects.create_snapshot(map_obj, clean_config(request.raw_post_data), request.user)
             return HttpResponse(
                 _("Map successfully updated."),
                 mimetype="text/plain",
@@ -356,12 +403,24 @@ def newmap(request):
         'DB_DATASTORE' : settings.DB_DATASTORE
     }))
 
+@gzip_page
 def newmapJSON(request):
-    config = newmap_config(request)
-    if isinstance(config, HttpResponse):
-        return config
+    if request.method != 'GET':
+        return HttpResponse(newmap_config(request))
+    if 'copy' in request.GET:
+        map_obj = get_object_or_404(Map,pk=request.GET['copy'])
+        if not request.user.has_perm('maps.view_map', obj=map_obj):
+            return newmap_config(request)
+        validator = map_obj.config_validator(request.user)
+    elif 'layer' in request.GET:
+        validator = layer_config_validator(request.GET.getlist('layer'), request.user)
     else:
-        return HttpResponse(config)
+        validator = (None, None)
+    # The default map is translated and new maps are owned by the user
+    validator = combine_validators(validator, categories_validator(),
+        ((request.GET.getlist('copy'), request.GET.getlist('layer'), request.user.id,
+          getattr(request, 'LANGUAGE_CODE', None)), None))
+    return conditional_response(request, validator, lambda: newmap_config(request))
 
 h = httplib2.Http()
 h.add_credentials(_user, _password)
@@ -392,6 +451,11 @@ def map_download(request, mapid):
         return HttpResponse(_('Not Permitted'), status=401)
 
     map_status = dict()
+    map_layers = [lyr for lyr in mapObject.layer_set.all() if lyr.group != "background"]
+    ownable_layers = dict((layer.typename, layer) for layer in
+                          Layer.objects.filter(typename__in=[lyr.name for lyr in map_layers]))
+    perms_for_objects(request.user, ownable_layers.values())
+
     if request.method == 'POST':
         url = "%srest/process/batchDownload/launch/" % settings.GEOSERVER_BASE_URL
 
@@ -412,16 +476,15 @@ def map_download(request, mapid):
     remote_layers = []
     downloadable_layers = []
 
-    for lyr in mapObject.layer_set.all():
-        if lyr.group != "background":
-            if not lyr.local():
-                remote_layers.append(lyr)
+    for lyr in map_layers:
+        if not lyr.local():
+            remote_layers.append(lyr)
+        else:
+            ownable_layer = ownable_layers.get(lyr.name)
+            if ownable_layer is None or not request.user.has_perm('maps.view_layer', obj=ownable_layer):
+                locked_layers.append(lyr)
             else:
-                ownable_layer = Layer.objects.get(typename=lyr.name)
-                if not request.user.has_perm('maps.view_layer', obj=ownable_layer):
-                    locked_layers.append(lyr)
-                else:
-                    downloadable_layers.append(lyr)
+                downloadable_layers.append(lyr)
 
     return render_to_response('maps/download.html', RequestContext(request, {
          "map_status" : map_status,
@@ -809,6 +872,11 @@ def view(request, mapid, snapshot=None):
         for group in groups:
             if group not in json.dumps(config['map']['groups']):
                 config['map']['groups'].append({"expanded":"true", "group":group})
+    elif snapshot is None and map_obj.officialurl:
+        # Official maps are served from their pre-rendered bundle
+        bundle, etag = bundles.get_bundle(map_obj)
+        config = bundles.decode(bundle)
+        bundles.apply_overlay(map_obj, config, request.user)
     elif snapshot is None:
         config = map_obj.viewer_json(request.user)
     else:
@@ -840,7 +908,8 @@ def view(request, mapid, snapshot=None):
     config['first_visit'] = first_visit
     config['uid'] = request.user.id
     config['edit_map'] = request.user.has_perm('maps.change_map', obj=map_obj)
-    config['topic_categories'] = category_list()
+    if 'topic_categories' not in config:
+        config['topic_categories'] = category_list()
 
     template_page = 'maps/view.html'
     if map_obj.template_page:
@@ -910,26 +979,35 @@ def tweetview(request):
         'max_date': timerange["results"][0]["max"]*1000 if timerange is not None else 0
         }))
 
+@gzip_page
 def embed(request, mapid=None, snapshot=None):
+    def render(config):
+        return render_to_response('maps/embed.html', RequestContext(request, {
+            'config': json.dumps(config)
+        }))
+
     if mapid is None:
-        config = json.loads(newmap_config(request))
+        return render(json.loads(newmap_config(request)))
+
+    if mapid.isdigit():
+        map_obj = get_object_or_404(Map,pk=mapid)
     else:
-        if mapid.isdigit():
-            map_obj = get_object_or_404(Map,pk=mapid)
-        else:
-            map_obj = get_object_or_404(Map,urlsuffix=mapid)
+        map_obj = get_object_or_404(Map,urlsuffix=mapid)
 
-        if not request.user.has_perm('maps.view_map', obj=map_obj):
-            return HttpResponse(_("Not Permitted"), status=401, mimetype="text/plain")
+    if not request.user.has_perm('maps.view_map', obj=map_obj):
+        return HttpResponse(_("Not Permitted"), status=401, mimetype="text/plain")
+
+    def build():
         if snapshot is None:
             config = map_obj.viewer_json(request.user)
         else:
             config = snapshot_config(snapshot, map_obj, request.user)
         config['first_visit'] = False
-
-    return render_to_response('maps/embed.html', RequestContext(request, {
-        'config': json.dumps(config)
-    }))
+        return render(config)
+    # The page shows the user and is translated
+    validator = combine_validators(map_obj.config_validator(request.user),
+        ((snapshot, request.user.id, getattr(request, 'LANGUAGE_CODE', None)), None))
+    return conditional_response(request, validator, build)
 
 
 def printmap(request, mapid=None, snapshot=None):
@@ -1587,21 +1665,7 @@ def layer_acls(request):
             return HttpResponse(_("Bad HTTP Authorization Credentials."),
                 status=401,
                 mimetype="text/plain")
-    all_readable = set()
-    all_writable = set()
-    for bck in get_auth_backends():
-        if hasattr(bck, 'objects_with_perm'):
-            all_readable.update(bck.objects_with_perm(acl_user,
-                'maps.view_layer',
-                Layer))
-            all_writable.update(bck.objects_with_perm(acl_user,
-                                                      'maps.change_layer',
-                                                      Layer))
-    read_only = [x for x in all_readable if x not in all_writable]
-    read_write = [x for x in all_writable if x in all_readable]
-
-    read_only = [x[0] for x in Layer.objects.filter(id__in=read_only).values_list('typename').all()]
-    read_write = [x[0] for x in Layer.objects.filter(id__in=read_write).values_list('typename').all()]
+    read_write, read_only = LayerACL.objects.for_user(acl_user, generic_roles(acl_user))
 
     result = {
         'rw': read_write,
@@ -1611,7 +1675,15 @@ def layer_acls(request):
         'is_anonymous': acl_user.is_anonymous()
     }
 
-    return HttpResponse(json.dumps(result), mimetype="application/json")
+    # GeoServer revalidates its copy with If-None-Match
+    content = json.dumps(result)
+    etag = '"%s"' % hashlib.md5(content).hexdigest()
+    if etag in [tag.strip() for tag in request.META.get('HTTP_IF_NONE_MATCH', '').split(',')]:
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(content, mimetype="application/json")
+    response['ETag'] = etag
+    return response
 
 
 
@@ -1727,10 +1799,16 @@ def metadata_search(request):
 
     result = _metadata_search(query, start, limit, sortby, sortorder, **advanced)
 
-    # slowdown here to dig out result permissions and other info from GeoNode
+    # dig out result permissions and other info from GeoNode, for all the
+    # rows at once
+    layers = dict((layer.uuid, layer) for layer in Layer.objects.filter(
+        uuid__in=[doc['uuid'] for doc in result['rows']]).select_related('topic_category', 'owner'))
+    perms_for_objects(request.user, layers.values())
     for doc in result['rows']:
         try:
-            layer = Layer.objects.get(uuid=doc['uuid'])
+            layer = layers.get(doc['uuid'])
+            if layer is None:
+                raise Layer.DoesNotExist()
             doc['_local'] = True
             doc['_permissions'] = {
                 'view': request.user.has_perm('maps.view_layer', obj=layer),
@@ -2171,13 +2249,15 @@ def batch_permissions(request, use_email=False):
     spec = json.loads(request.raw_post_data)
 
     if "layers" in spec:
-        lyrs = Layer.objects.filter(pk__in = spec['layers'])
+        lyrs = list(Layer.objects.filter(pk__in = spec['layers']))
+        perms_for_objects(request.user, lyrs)
         for lyr in lyrs:
             if not request.user.has_perm("maps.change_layer_permissions", obj=lyr):
                 return HttpResponse("User not authorized to change layer permissions", status=403)
 
     if "maps" in spec:
-        maps = Map.objects.filter(pk__in = spec['maps'])
+        maps = list(Map.objects.filter(pk__in = spec['maps']))
+        perms_for_objects(request.user, maps)
         for map in maps:
             if not request.user.has_perm("maps.change_map_permissions", obj=map):
                 return HttpResponse("User not authorized to change map permissions", status=403)
@@ -2191,102 +2271,60 @@ def batch_permissions(request, use_email=False):
     users = spec['permissions'].get('users', [])
     user_names = [x for (x, y) in users]
 
-    if "layers" in spec:
-        lyrs = Layer.objects.filter(pk__in = spec['layers'])
-        valid_perms = ['layer_readwrite', 'layer_readonly', 'layer_admin']
-        if anon_level not in valid_perms:
-            anon_level = "_none"
-        if auth_level not in valid_perms:
-            auth_level = "_none"
-        if custom_level not in valid_perms:
-            custom_level = "_none"
-
-        logger.debug("anon:[%s],auth:[%s],custom:[%s]", anon_level, auth_level, custom_level)
-        for lyr in lyrs:
-            logger.info("Layer [%s]", lyr)
-            if use_email:
-                lyr.get_user_levels().exclude(user__email__in = user_names + [lyr.owner.email]).delete()
-            else:
-                lyr.get_user_levels().exclude(user__username__in = user_names + [lyr.owner.username]).delete()
-
-            lyr.set_gen_level(ANONYMOUS_USERS, anon_level)
-            lyr.set_gen_level(AUTHENTICATED_USERS, auth_level)
-            lyr.set_gen_level(CUSTOM_GROUP_USERS, custom_level)
-            for user, user_level in users:
-                logger.info("User [%s]", user)
-
-                if use_email:
-                    user_obj = None
-                    try:
-                        user_obj = User.objects.get(email=user)
-                    except User.DoesNotExist:
-                        try:
-                            user_obj = _create_new_user(user, lyr.title, reverse('geonode.maps.views.layer_detail', args=(lyr.typename,)), lyr.owner_id)
-                        except:
-                            logger.info("Could not create new user with email of %s" % user)
-                    if user_level not in valid_perms:
-                        user_level = "_none"
-                    if user_obj:
-                        lyr.set_user_level(user_obj, user_level)
-                else:
-                    if user_level not in valid_perms:
-                        user_level = "_none"
-                        user = User.objects.get(username=user)
-                    lyr.set_user_level(user, user_level)
+    valid_perms = ['layer_readwrite', 'layer_readonly', 'layer_admin']
+    if anon_level not in valid_perms:
+        anon_level = "_none"
+    if auth_level not in valid_perms:
+        auth_level = "_none"
+    if custom_level not in valid_perms:
+        custom_level = "_none"
+    logger.debug("anon:[%s],auth:[%s],custom:[%s]", anon_level, auth_level, custom_level)
 
+    # Look up (or invite) every user once for all the layers and maps
+    if use_email:
+        found = dict((u.email, u) for u in User.objects.filter(email__in=user_names))
+    else:
+        found = dict((u.username, u) for u in User.objects.filter(username__in=user_names))
+    user_levels = {}
+    unknown_users = []
+    for user, user_level in users:
+        logger.info("User [%s]", user)
+        user_obj = found.get(user)
+        if user_obj is None and use_email:
+            # The invitation mentions the first layer or map
+            try:
+                if "layers" in spec and lyrs:
+                    user_obj = _create_new_user(user, lyrs[0].title, reverse('geonode.maps.views.layer_detail', args=(lyrs[0].typename,)), lyrs[0].owner_id)
+                elif "maps" in spec and maps:
+                    user_obj = _create_new_user(user, maps[0].title, reverse('geonode.maps.views.view', args=[maps[0].id]), maps[0].owner_id)
+            except:
+                logger.info("Could not create new user with email of %s" % user)
+        if user_obj:
+            user_levels[user_obj] = user_level if user_level in valid_perms else "_none"
+        else:
+            unknown_users.append(user)
 
-    if "maps" in spec:
-        maps = Map.objects.filter(pk__in = spec['maps'])
-        valid_perms = ['layer_readwrite', 'layer_readonly', 'layer_admin']
-        if anon_level not in valid_perms:
-            anon_level = "_none"
-        if auth_level not in valid_perms:
-            auth_level = "_none"
-        if custom_level not in valid_perms:
-            custom_level = "_none"
-        anon_level = anon_level.replace("layer", "map")
-        auth_level = auth_level.replace("layer", "map")
-        custom_level = custom_level.replace("layer", "map")
-
-        for m in maps:
-            if use_email:
-                m.get_user_levels().exclude(user__email__in = user_names + [m.owner.email]).delete()
-            else:
-                m.get_user_levels().exclude(user__username__in = user_names + [m.owner.username]).delete()
-            m.set_gen_level(ANONYMOUS_USERS, anon_level)
-            m.set_gen_level(AUTHENTICATED_USERS, auth_level)
-            m.set_gen_level(CUSTOM_GROUP_USERS, custom_level)
-            for user, user_level in spec['permissions'].get("users", []):
-                user_level = user_level.replace("layer", "map")
-                if user_level not in valid_perms:
-                    user_level = "_none"
-
-                if use_email:
-                    m.get_user_levels().exclude(user__email__in = user_names + [m.owner.email]).delete()
-                else:
-                    m.get_user_levels().exclude(user__username__in = user_names + [m.owner.username]).delete()
-                m.set_gen_level(ANONYMOUS_USERS, anon_level)
-                m.set_gen_level(AUTHENTICATED_USERS, auth_level)
-                m.set_gen_level(CUSTOM_GROUP_USERS, custom_level)
-                for user, user_level in spec['permissions'].get("users", []):
-                    user_level = user_level.replace("layer", "map")
-                    if user_level not in valid_perms:
-                        user_level = "_none"
-                    if use_email:
-                        user_obj = None
-                        try:
-                            user_obj = User.objects.get(email=user)
-                        except User.DoesNotExist:
-                            try:
-                                user_obj = _create_new_user(user, m.title, reverse('geonode.maps.views.view', args=[m.id]), m.owner_id)
-                            except:
-                                logger.info("Could not create new user with email of %s" % user)
-                        if user_obj:
-                            m.set_user_level(userObject, user_level)
-                    else:
-                        m.set_user_level(user, user_level)
+    def map_level(level):
+        return level.replace("layer", "map")
+
+    summary = {}
+    if "layers" in spec:
+        summary['layers'] = set_permission_levels(
+            lyrs, {ANONYMOUS_USERS: anon_level, AUTHENTICATED_USERS: auth_level, CUSTOM_GROUP_USERS: custom_level},
+            user_levels)
 
-    return HttpResponse("Map/layer permissions updated")
+    if "maps" in spec:
+        summary['maps'] = set_permission_levels(
+            maps, {ANONYMOUS_USERS: map_level(anon_level), AUTHENTICATED_USERS: map_level(auth_level),
+                   CUSTOM_GROUP_USERS: map_level(custom_level)},
+            dict((user_obj, map_level(level)) for user_obj, level in user_levels.iteritems()))
+
+    # The levels of the users that were found are applied all the same
+    summary['success'] = not unknown_users
+    if unknown_users:
+        summary['unknown_users'] = unknown_users
+        summary['errors'] = ["Unknown user: %s" % user for user in unknown_users]
+    return HttpResponse(json.dumps(summary), mimetype="application/json")
 
 def batch_delete(request):
     if not request.user.is_authenticated:
@@ -2298,13 +2336,15 @@ def batch_delete(request):
     spec = json.loads(request.raw_post_data)
 
     if "layers" in spec:
-        lyrs = Layer.objects.filter(pk__in = spec['layers'])
+        lyrs = list(Layer.objects.filter(pk__in = spec['layers']))
+        perms_for_objects(request.user, lyrs)
         for lyr in lyrs:
             if not request.user.has_perm("maps.delete_layer", obj=lyr):
                 return HttpResponse("User not authorized to delete layer", status=403)
 
     if "maps" in spec:
-        map_query = Map.objects.filter(pk__in = spec['maps'])
+        map_query = list(Map.objects.filter(pk__in = spec['maps']))
+        perms_for_objects(request.user, map_query)
         for m in map_query:
             if not request.user.has_perm("maps.delete_map", obj=m):
                 return HttpResponse("User not authorized to delete map", status=403)
@@ -2432,6 +2472,7 @@ def addlayers(request):
         "site" : settings.SITEURL
     }))
 
+@gzip_page
 def addLayerJSON(request):
     logger.debug("Enter addLayerJSON")
     layername = request.GET.get('layername', False)
@@ -2442,9 +2483,10 @@ def addLayerJSON(request):
             layer = Layer.objects.get(typename=layername)
             if not request.user.has_perm("maps.view_layer", obj=layer):
                 return HttpResponse(status=401)
-            sfJSON = {'layer': layer.layer_config(request.user)}
-            logger.debug('sfJSON is [%s]', str(sfJSON))
-            return HttpResponse(json.dumps(sfJSON))
+            validator = combine_validators(layer_config_validator([layername], request.user),
+                                           categories_validator())
+            return conditional_response(request, validator,
+                                        lambda: json.dumps({'layer': layer.layer_config(request.user)}))
         except Exception, e:
             logger.debug("Could not find matching layer: [%s]", str(e))
             return HttpResponse(str(e), status=500)
@@ -2535,8 +2577,8 @@ def snapshot_config(snapshot, map, user):
             return None
 
     #Set up the proper layer configuration
-    def snaplayer_config(layer, sources, user):
-        cfg = layer.layer_config(user)
+    def snaplayer_config(layer, sources, user, gn_layers):
+        cfg = layer.layer_config(user, gn_layers)
         src_cfg = layer.source_config()
         source = snapsource_lookup(src_cfg, sources)
         if source: cfg["source"] = source
@@ -2546,8 +2588,8 @@ def snapshot_config(snapshot, map, user):
 
     decodedid = num_decode(snapshot)
     snapshot = get_object_or_404(MapSnapshot, pk=decodedid)
-    if snapshot.map == map:
-        config = json.loads(clean_config(snapshot.config))
+    if snapshot.map_id == map.id:
+        config = json.loads(clean_config(snapshot.config_json()))
         layers = [l for l in config["map"]["layers"]]
         sources = config["sources"]
         maplayers = []
@@ -2555,7 +2597,10 @@ def snapshot_config(snapshot, map, user):
             maplayers.append(
             map.layer_set.from_viewer_config(
                 map, layer, config["sources"][layer["source"]], ordering))
-        config['map']['layers'] = [snaplayer_config(l,sources,user) for l in maplayers]
+        gn_layers = Layer.objects.for_map_layers(maplayers)
+        if user is not None:
+            perms_for_objects(user, gn_layers.values())
+        config['map']['layers'] = [snaplayer_config(l,sources,user,gn_layers) for l in maplayers]
     else:
         config = map.viewer_json(user)
     return config
@@ -2656,6 +2701,38 @@ def official_site(request, site):
     map_obj = get_object_or_404(Map,officialurl=site)
     return view(request, str(map_obj.id))
 
+def official_site_config(request, site):
+    """
+    The viewer configuration of the map with the given official site url,
+    served from its pre-rendered bundle.
+    """
+    map_obj = get_object_or_404(Map,officialurl=site)
+    if not request.user.has_perm('maps.view_map', obj=map_obj):
+        return HttpResponse(loader.render_to_string('401.html',
+            RequestContext(request, {'error_message':
+                _("You are not allowed to view this map.")})), status=401)
+
+    bundle, etag = bundles.get_bundle(map_obj)
+    config = bundles.decode(bundle)
+    disabled = bundles.apply_overlay(map_obj, config, request.user)
+    gzipped = not disabled and 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+    if disabled:
+        # Users who may not view some layers get their own variant
+        etag = '"%s-%s"' % (etag.strip('"'), hashlib.md5(','.join(sorted(disabled))).hexdigest())
+    elif not gzipped:
+        etag = '"%s-identity"' % etag.strip('"')
+
+    if etag in [tag.strip() for tag in request.META.get('HTTP_IF_NONE_MATCH', '').split(',')]:
+        response = HttpResponseNotModified()
+    elif gzipped:
+        response = HttpResponse(bundle, mimetype="application/json")
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(json.dumps(config), mimetype="application/json")
+    response['ETag'] = etag
+    response['Vary'] = 'Accept-Encoding, Cookie'
+    return response
+
 def official_site_mobile(request, site):
     """
     The view that returns the map composer opened to
@@ -2681,7 +2758,7 @@ def snapshot_create(request):
 
     if isinstance(conf, basestring):
         config = json.loads(conf)
-        snapshot = MapSnapshot.objects.create(config=clean_config(conf),map=Map.objects.get(id=config['id']))
+        snapshot = MapSnapshot.objects.create_snapshot(Map.objects.get(id=config['id']), clean_config(conf))
         return HttpResponse(num_encode(snapshot.id), mimetype="text/plain")
     else:
         return HttpResponse("Invalid JSON", mimetype="text/plain", status=500)
@@ -2699,10 +2776,16 @@ def clean_config(conf):
     else:
         return conf
 
+@gzip_page
 def ajax_snapshot_history(request, mapid):
     map_obj = Map.objects.get(pk=mapid)
-    history = [snapshot.json() for snapshot in map_obj.snapshots]
-    return HttpResponse(json.dumps(history), mimetype="text/plain")
+    # Snapshots are never changed, only added and deleted
+    state = MapSnapshot.objects.exclude(user=None).filter(map=map_obj).aggregate(
+        count=Count('id'), last=Max('id'), modified=Max('created_dttm'))
+    validator = ((map_obj.id, state['count'], state['last']), state['modified'])
+    return conditional_response(request, validator,
+                                lambda: json.dumps([snapshot.json() for snapshot in map_obj.snapshots]),
+                                mimetype="text/plain")
 
 
 
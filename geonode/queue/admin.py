@@ -0,0 +1,19 @@
+from django.contrib import admin
+from geonode.queue.models import GazetteerUpdateJob, LayerBoundsUpdateJob
+
+
+def retry_jobs(modeladmin, request, queryset):
+    for job in queryset:
+        job.retry()
+retry_jobs.short_description = "Retry the selected jobs now"
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'layer', 'status', 'priority', 'attempts', 'available_at', 'leased_until')
+    list_filter = ('status',)
+    search_fields = ('layer__name',)
+    readonly_fields = ('lease_token', 'leased_until', 'version', 'last_error')
+    actions = [retry_jobs]
+
+admin.site.register(GazetteerUpdateJob, JobAdmin)
+admin.site.register(LayerBoundsUpdateJob, JobAdmin)
@@ -1,16 +1,172 @@
-from django.db import models
+from datetime import datetime, timedelta
+from uuid import uuid4
+from django.conf import settings
+from django.db import connections, models, router, transaction, IntegrityError
+from django.db.models import F, Q
+from django.utils.encoding import force_unicode
 from geonode.maps.models import Layer
 
 
+# Jobs are 'pending' until a worker leases them ('running').  Jobs that
+# failed settings.QUEUE_MAX_ATTEMPTS times are kept as 'failed' (dead letters)
+# until they are queued again or retried from the admin.
 STATUS_VALUES = [
     'pending',
+    'running',
     'failed'
 ]
 
-class GazetteerUpdateJob(models.Model):
-    layer = models.ForeignKey(Layer, blank=False, null=False, unique=True)
-    status = models.CharField(choices= [(x, x) for x in STATUS_VALUES], max_length=10, blank=False, null=False, default='pending')
 
-class LayerBoundsUpdateJob(models.Model):
+class JobManager(models.Manager):
+
+    def enqueue(self, layer, priority=0):
+        """
+        Queue a job for a layer.  If the layer already has a job, it is
+        revived if it failed, its priority raised if needed, and it is run
+        again if a worker is processing it right now.
+        """
+        if not self._requeue(layer, priority):
+            sid = transaction.savepoint(using=self.db)
+            try:
+                self.create(layer=layer, priority=priority)
+                transaction.savepoint_commit(sid, using=self.db)
+            except IntegrityError:
+                # Queued concurrently by another request
+                transaction.savepoint_rollback(sid, using=self.db)
+                self._requeue(layer, priority)
+
+    def _requeue(self, layer, priority):
+        jobs = self.filter(layer=layer)
+        if not jobs.update(version=F('version') + 1):
+            return False
+        jobs.filter(priority__lt=priority).update(priority=priority)
+        jobs.filter(status='failed').update(status='pending', attempts=0, available_at=datetime.now())
+        return True
+
+    def available(self, now=None):
+        """
+        Jobs that may be leased: pending jobs whose retry delay has passed,
+        and running jobs whose lease expired (the worker died or hung).
+        """
+        now = now or datetime.now()
+        return self.filter(Q(status='pending', available_at__lte=now) |
+                           Q(status='running', leased_until__lt=now))
+
+    def lease(self, timeout=None):
+        """
+        Lease the next available job, highest priority first, or return
+        None if there is none.  The lease is a conditional UPDATE, so
+        concurrent workers never get the same job; it expires after
+        ``timeout`` seconds (default settings.QUEUE_VISIBILITY_TIMEOUT).
+        """
+        timeout = timeout or settings.QUEUE_VISIBILITY_TIMEOUT
+        while True:
+            now = datetime.now()
+            candidates = list(self.available(now).order_by('-priority', 'available_at', 'id')[:10])
+            if not candidates:
+                return None
+            for job in candidates:
+                token = uuid4().hex
+                leased = self.available(now).filter(pk=job.pk).update(
+                    status='running', lease_token=token, leased_until=now + timedelta(seconds=timeout),
+                    attempts=F('attempts') + 1)
+                if leased:
+                    job.status, job.lease_token = 'running', token
+                    job.leased_until = now + timedelta(seconds=timeout)
+                    job.attempts += 1
+                    return job
+
+
+    def lease_batch(self, count, timeout=None):
+        """
+        Lease up to ``count`` jobs, see lease.
+        """
+        jobs = []
+        while len(jobs) < count:
+            job = self.lease(timeout)
+            if job is None:
+                break
+            jobs.append(job)
+        return jobs
+
+
+class QueuedJob(models.Model):
+    """
+    A job of the layer update queue, see JobManager.lease
+    """
     layer = models.ForeignKey(Layer, blank=False, null=False, unique=True)
     status = models.CharField(choices= [(x, x) for x in STATUS_VALUES], max_length=10, blank=False, null=False, default='pending')
+    priority = models.IntegerField(default=0, db_index=True)
+    attempts = models.IntegerField(default=0)
+    available_at = models.DateTimeField(default=datetime.now, db_index=True)
+    leased_until = models.DateTimeField(blank=True, null=True)
+    lease_token = models.CharField(max_length=32, blank=True)
+    # Incremented when the job is queued again, so that an update requested
+    # while the job runs is not lost when it completes
+    version = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    objects = JobManager()
+
+    class Meta:
+        abstract = True
+
+    def _leased(self):
+        return type(self).objects.filter(pk=self.pk, lease_token=self.lease_token)
+
+    def renew(self, timeout=None):
+        """
+        Extend the lease of a running job by ``timeout`` seconds (default
+        settings.QUEUE_VISIBILITY_TIMEOUT).  Returns False if the lease
+        expired and another worker took the job over.
+        """
+        timeout = timeout or settings.QUEUE_VISIBILITY_TIMEOUT
+        leased_until = datetime.now() + timedelta(seconds=timeout)
+        if not self._leased().update(leased_until=leased_until):
+            return False
+        self.leased_until = leased_until
+        return True
+
+    def complete(self):
+        """
+        Remove the job after it ran, or put it back in the queue if it was
+        queued again in the meantime.
+        """
+        # A single conditional DELETE, QuerySet.delete() selects the rows first
+        db = router.db_for_write(type(self))
+        connection = connections[db]
+        cursor = connection.cursor()
+        cursor.execute("DELETE FROM %s WHERE id = %%s AND lease_token = %%s AND version = %%s" %
+                       connection.ops.quote_name(self._meta.db_table), [self.pk, self.lease_token, self.version])
+        deleted = cursor.rowcount
+        transaction.commit_unless_managed(using=db)
+        if not deleted:
+            self._leased().update(status='pending', lease_token='', leased_until=None, attempts=0,
+                                  available_at=datetime.now())
+
+    def fail(self, error):
+        """
+        Schedule a retry with exponential backoff, or keep the job as a dead
+        letter once it failed settings.QUEUE_MAX_ATTEMPTS times.
+        """
+        if self.attempts >= settings.QUEUE_MAX_ATTEMPTS:
+            self._leased().update(status='failed', lease_token='', leased_until=None, last_error=force_unicode(error, errors='replace'))
+        else:
+            delay = min(settings.QUEUE_RETRY_DELAY * 2 ** (self.attempts - 1), settings.QUEUE_MAX_RETRY_DELAY)
+            self._leased().update(status='pending', lease_token='', leased_until=None, last_error=force_unicode(error, errors='replace'),
+                                  available_at=datetime.now() + timedelta(seconds=delay))
+
+    def retry(self):
+        type(self).objects.filter(pk=self.pk).update(status='pending', attempts=0, lease_token='',
+                                                     leased_until=None, available_at=datetime.now())
+
+    def __unicode__(self):
+        return u"%s (%s)" % (self.layer.name, self.status)
+
+
+class GazetteerUpdateJob(QueuedJob):
+    pass
+
+
+class LayerBoundsUpdateJob(QueuedJob):
+    pass
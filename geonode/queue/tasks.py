@@ -1,41 +1,108 @@
 #from huey.djhuey.decorators import queue_command, periodic_command, crontab
+import time
 from celery.schedules import crontab
 from celery.task import periodic_task, task
 from geonode import settings
+from geonode.maps.models import Layer
 from geonode.queue.models import GazetteerUpdateJob, LayerBoundsUpdateJob
+from geonode.queue.workers import LeaseHeartbeat
 
 __author__ = 'mbertrand'
 
-@periodic_task(run_every=crontab(minute=settings.QUEUE_INTERVAL))
-def updateGazetteer():
-    print "start updateGazetteer"
-    gazetteerJobs = GazetteerUpdateJob.objects.all()
-    for job in gazetteerJobs:
+
+def run_jobs(job_class, run):
+    """
+    Lease and run jobs of a queue until it is empty.  Any number of
+    workers can drain the same queue at once; the lease of a job is renewed
+    for as long as it runs.
+    """
+    while True:
+        job = job_class.objects.lease()
+        if job is None:
+            return
         try:
-            print "update gazetteer for " + job.layer.name
-            job.layer.update_gazetteer()
-            job.delete()
+            with LeaseHeartbeat([job]):
+                run(job.layer)
+            job.complete()
         except Exception, e:
             print e
-            job.status = 'failed'
-            job.save()
-    #print "end updateGazetteer"
+            job.fail(e)
+
+
+def update_layer_gazetteer(layer):
+    print "update gazetteer for " + layer.name
+    started = time.time()
+    stats = layer.update_gazetteer()
+    if stats:
+        print "loaded %d placenames for %s in %.1f s (%.0f placenames/s)" % (
+            stats['rows'], layer.name, stats['seconds'], stats['rows'] / max(stats['seconds'], 0.001))
+    else:
+        print "updated gazetteer for %s in %.1f s" % (layer.name, time.time() - started)
+
+
+@task
+def processGazetteerJobs():
+    run_jobs(GazetteerUpdateJob, update_layer_gazetteer)
+
+
+@task
+def processBoundsJobs():
+    """
+    Refresh layer bounds a batch of jobs at a time, see
+    LayerManager.update_bounds_batch
+    """
+    while True:
+        jobs = LayerBoundsUpdateJob.objects.lease_batch(settings.BOUNDS_BATCH_SIZE)
+        if not jobs:
+            return
+        layers = Layer.objects.in_bulk([job.layer_id for job in jobs])
+        with LeaseHeartbeat(jobs):
+            results = Layer.objects.update_bounds_batch(layers.values())
+        print "updated bounds of %d layers, %d changed" % (len(layers), results.values().count(True))
+        for job in jobs:
+            result = results.get(job.layer_id, False)
+            if isinstance(result, Exception):
+                print result
+                job.fail(result)
+            else:
+                job.complete()
+
+
+def dispatch_jobs():
+    """
+    Start QUEUE_CONCURRENCY workers for each job queue that has jobs ready.
+    """
+    from geonode.queue.workers import run_async
+    for job_class, process in ((GazetteerUpdateJob, processGazetteerJobs), (LayerBoundsUpdateJob, processBoundsJobs)):
+        if job_class.objects.available().exists():
+            for i in range(settings.QUEUE_CONCURRENCY):
+                run_async(process)
+
+
+def process_now(job_class):
+    """
+    With the local backend, start draining a job queue right away instead
+    of at the next poll.  Celery workers are started by the periodic tasks.
+    """
+    from geonode.queue.workers import run_async
+    if settings.QUEUE_BACKEND == 'local':
+        run_async(processGazetteerJobs if job_class is GazetteerUpdateJob else processBoundsJobs)
+
+
+@periodic_task(run_every=crontab(minute=settings.QUEUE_INTERVAL))
+def updateGazetteer():
+    print "start updateGazetteer"
+    if GazetteerUpdateJob.objects.available().exists():
+        for i in range(settings.QUEUE_CONCURRENCY):
+            processGazetteerJobs.delay()
 
 @periodic_task(run_every=crontab(minute=settings.QUEUE_INTERVAL))
 def updateBounds():
-    boundsJobs = LayerBoundsUpdateJob.objects.all()
-    for job in boundsJobs:
-        try:
-            job.layer.update_bounds()
-            job.delete()
-        except Exception, e:
-            print e
-            job.status = 'failed'
-            job.save()
+    if LayerBoundsUpdateJob.objects.available().exists():
+        for i in range(settings.QUEUE_CONCURRENCY):
+            processBoundsJobs.delay()
 
 @task
 def loadHGL(layername):
     from geonode.proxy.views import hglServiceStarter
     hglServiceStarter(None,layername)
-
-
@@ -0,0 +1,110 @@
+from datetime import datetime, timedelta
+import time
+from django.test import TestCase, TransactionTestCase
+from geonode.maps.models import Layer
+from geonode.queue.models import GazetteerUpdateJob
+from geonode.queue.workers import LocalWorkerPool
+from geonode.queue.tasks import run_jobs
+
+
+class JobQueueTest(TestCase):
+
+    fixtures = ['map_data.json']
+
+    def setUp(self):
+        self.layer = Layer.objects.get(pk=1)
+
+    def test_lease_is_exclusive(self):
+        GazetteerUpdateJob.objects.enqueue(self.layer)
+        job = GazetteerUpdateJob.objects.lease()
+        self.assertEquals('running', job.status)
+        self.assertEquals(1, job.attempts)
+        self.assertEquals(None, GazetteerUpdateJob.objects.lease())
+        job.complete()
+        self.assertFalse(GazetteerUpdateJob.objects.exists())
+
+    def test_expired_lease_is_taken_over(self):
+        GazetteerUpdateJob.objects.enqueue(self.layer)
+        stale = GazetteerUpdateJob.objects.lease()
+        GazetteerUpdateJob.objects.update(leased_until=datetime.now() - timedelta(seconds=1))
+        job = GazetteerUpdateJob.objects.lease()
+        self.assertNotEquals(stale.lease_token, job.lease_token)
+        # The first worker no longer owns the job
+        stale.complete()
+        self.assertTrue(GazetteerUpdateJob.objects.exists())
+        job.complete()
+        self.assertFalse(GazetteerUpdateJob.objects.exists())
+
+    def test_requeue_while_running(self):
+        GazetteerUpdateJob.objects.enqueue(self.layer)
+        job = GazetteerUpdateJob.objects.lease()
+        GazetteerUpdateJob.objects.enqueue(self.layer, priority=5)
+        job.complete()
+        job = GazetteerUpdateJob.objects.get()
+        self.assertEquals('pending', job.status)
+        self.assertEquals(5, job.priority)
+
+    def test_retries_and_dead_letters(self):
+        GazetteerUpdateJob.objects.enqueue(self.layer)
+        with self.settings(QUEUE_MAX_ATTEMPTS=2, QUEUE_RETRY_DELAY=60):
+            GazetteerUpdateJob.objects.lease().fail(Exception("boom"))
+            job = GazetteerUpdateJob.objects.get()
+            self.assertEquals('pending', job.status)
+            self.assertTrue(job.available_at > datetime.now() + timedelta(seconds=50))
+            self.assertEquals(None, GazetteerUpdateJob.objects.lease())
+
+            GazetteerUpdateJob.objects.update(available_at=datetime.now())
+            GazetteerUpdateJob.objects.lease().fail(Exception("boom"))
+            job = GazetteerUpdateJob.objects.get()
+            self.assertEquals('failed', job.status)
+            self.assertEquals(u'boom', job.last_error)
+            self.assertEquals(None, GazetteerUpdateJob.objects.lease())
+
+        GazetteerUpdateJob.objects.enqueue(self.layer)
+        self.assertEquals('pending', GazetteerUpdateJob.objects.get().status)
+
+
+class LeaseRenewalTest(TransactionTestCase):
+    # The lease heartbeat runs in its own thread, with its own connection
+
+    fixtures = ['map_data.json']
+
+    def test_lease_is_renewed_while_running(self):
+        layer = Layer.objects.get(pk=1)
+        GazetteerUpdateJob.objects.enqueue(layer)
+        taken_over = []
+
+        def run(layer):
+            # Longer than the lease timeout
+            time.sleep(2.5)
+            taken_over.append(GazetteerUpdateJob.objects.lease())
+        with self.settings(QUEUE_VISIBILITY_TIMEOUT=1):
+            run_jobs(GazetteerUpdateJob, run)
+        self.assertEquals([None], taken_over)
+        self.assertFalse(GazetteerUpdateJob.objects.exists())
+
+    def test_renew_after_takeover(self):
+        layer = Layer.objects.get(pk=1)
+        GazetteerUpdateJob.objects.enqueue(layer)
+        stale = GazetteerUpdateJob.objects.lease()
+        GazetteerUpdateJob.objects.update(leased_until=datetime.now() - timedelta(seconds=1))
+        job = GazetteerUpdateJob.objects.lease()
+        self.assertFalse(stale.renew())
+        self.assertTrue(job.renew())
+
+
+class LocalWorkerPoolTest(TestCase):
+
+    def test_bounded_queue_and_drain(self):
+        pool = LocalWorkerPool(1, 2)
+        done = []
+
+        def slow(i):
+            time.sleep(0.05)
+            done.append(i)
+        submitted = [i for i in range(10) if pool.submit(slow, i)]
+        self.assertTrue(len(submitted) < 10)
+        self.assertEquals(10 - len(submitted), pool.counters['dropped'])
+        pool.shutdown(5)
+        self.assertEquals(submitted, done)
+        self.assertFalse(pool.submit(slow, 10))
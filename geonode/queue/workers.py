@@ -0,0 +1,196 @@
+"""
+In-process background workers for the queue app.
+
+With settings.QUEUE_BACKEND = 'local', queue tasks run in a pool of
+settings.QUEUE_LOCAL_WORKERS threads of the web server process instead of
+in a Celery worker, so small deployments get asynchronous layer updates
+without a broker.  A poller thread takes the place of celery beat and
+starts draining the job queues every QUEUE_LOCAL_POLL_INTERVAL seconds,
+which picks up retries and jobs queued while the pool was busy.
+
+At most QUEUE_LOCAL_MAX_QUEUED tasks wait for a worker; tasks submitted
+beyond that are dropped (queued jobs stay in the database for the next
+poll).  On interpreter exit, the tasks already queued are given
+QUEUE_LOCAL_SHUTDOWN_TIMEOUT seconds to finish; the leases of jobs that do
+not finish expire and the jobs are run again later.
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+import Queue
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger("geonode.queue.workers")
+
+_STOP = object()
+
+
+class LocalWorkerPool(object):
+    """
+    Fixed pool of daemon threads running tasks from a bounded queue.
+    """
+
+    def __init__(self, workers, max_queued, name="queue-worker"):
+        self.tasks = Queue.Queue(max_queued)
+        self.accepting = True
+        self.counters = dict.fromkeys(('submitted', 'dropped', 'completed', 'failed'), 0)
+        self._lock = threading.Lock()
+        self.threads = [threading.Thread(target=self._work, name="%s-%d" % (name, i)) for i in range(workers)]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Queue ``func(*args, **kwargs)``.  Returns False if the task was
+        dropped because the queue is full or the pool is shutting down.
+        """
+        if not self.accepting:
+            return False
+        try:
+            self.tasks.put_nowait((func, args, kwargs))
+            self.count('submitted')
+            return True
+        except Queue.Full:
+            self.count('dropped')
+            logger.warning("Queue worker pool is full, dropping %s", getattr(func, 'name', func))
+            return False
+
+    def count(self, counter):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def _work(self):
+        while True:
+            task = self.tasks.get()
+            if task is _STOP:
+                return
+            func, args, kwargs = task
+            try:
+                func(*args, **kwargs)
+                self.count('completed')
+            except Exception:
+                self.count('failed')
+                logger.exception("Background task %s failed", getattr(func, 'name', func))
+            finally:
+                # Threads do not share Django connections, do not leave them open
+                for connection in connections.all():
+                    connection.close()
+
+    def shutdown(self, timeout):
+        """
+        Stop accepting tasks and wait up to ``timeout`` seconds for the
+        queued ones to finish.
+        """
+        self.accepting = False
+        deadline = time.time() + timeout
+        try:
+            for thread in self.threads:
+                # The sentinels go after the queued tasks
+                self.tasks.put(_STOP, timeout=max(deadline - time.time(), 0.01))
+        except Queue.Full:
+            pass
+        for thread in self.threads:
+            thread.join(max(deadline - time.time(), 0))
+        unfinished = [thread.name for thread in self.threads if thread.is_alive()]
+        if unfinished:
+            logger.warning("Queue workers %s did not finish before shutdown", ", ".join(unfinished))
+
+
+class LeaseHeartbeat(object):
+    """
+    Renew the leases of jobs every third of settings.QUEUE_VISIBILITY_TIMEOUT
+    from a background thread while they run, so that long jobs are not taken
+    over by another worker:
+
+        with LeaseHeartbeat([job]):
+            run(job.layer)
+    """
+
+    def __init__(self, jobs):
+        self.jobs = list(jobs)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._beat, name="queue-lease-heartbeat")
+        self.thread.daemon = True
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+    def _beat(self):
+        interval = settings.QUEUE_VISIBILITY_TIMEOUT / 3.0
+        try:
+            while self.jobs and not self.stopped.wait(interval):
+                for job in list(self.jobs):
+                    try:
+                        renewed = job.renew()
+                    except Exception:
+                        logger.exception("Could not renew the lease of %s", job)
+                        continue
+                    if not renewed:
+                        logger.warning("Lost the lease of %s to another worker", job)
+                        self.jobs.remove(job)
+        finally:
+            for connection in connections.all():
+                connection.close()
+
+
+def poll(stopped):
+    from geonode.queue.tasks import dispatch_jobs
+    while True:
+        stopped.wait(settings.QUEUE_LOCAL_POLL_INTERVAL)
+        if stopped.is_set():
+            return
+        try:
+            dispatch_jobs()
+        except Exception:
+            logger.exception("Could not check the job queues")
+        finally:
+            for connection in connections.all():
+                connection.close()
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Return this process's worker pool, starting it (and the poller) on first
+    use.
+    """
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                pool = LocalWorkerPool(settings.QUEUE_LOCAL_WORKERS, settings.QUEUE_LOCAL_MAX_QUEUED)
+                stopped = threading.Event()
+                poller = threading.Thread(target=poll, args=(stopped,), name="queue-poller")
+                poller.daemon = True
+                poller.start()
+
+                def shutdown():
+                    stopped.set()
+                    pool.shutdown(settings.QUEUE_LOCAL_SHUTDOWN_TIMEOUT)
+                atexit.register(shutdown)
+                _pool, _pool_pid = pool, os.getpid()
+    return _pool
+
+
+def run_async(task, *args, **kwargs):
+    """
+    Run a queue task asynchronously with the configured backend: in the
+    local worker pool, or through Celery with task.delay().
+    """
+    if settings.QUEUE_BACKEND == 'local':
+        return get_pool().submit(task, *args, **kwargs)
+    return task.delay(*args, **kwargs)
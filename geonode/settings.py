@@ -259,6 +259,13 @@ INTERNAL_IPS = ('127.0.0.1',)
 # permissions per object.
 AUTHENTICATION_BACKENDS = ('geonode.core.auth.GranularBackend',)
 
+# Object permissions are cached across requests, at most this many entries
+# per process, for PERMISSION_CACHE_TIMEOUT seconds (see geonode.core.permcache).
+# Needs a shared CACHE_BACKEND, the permissions are only cached for the
+# duration of a request otherwise.
+PERMISSION_CACHE_SIZE = 10000
+PERMISSION_CACHE_TIMEOUT = 300
+
 
 def get_user_url(u):
     from django.contrib.sites.models import Site
@@ -517,6 +524,18 @@ DB_DATASTORE_TYPE = ''
 DB_DATASTORE_NAME = ''
 DB_DATASTORE_ENGINE = 'django.contrib.gis.db.backends.postgis'
 
+# Pools of direct (psycopg2) connections to the datastore and layer stores,
+# see geonode/dbpool.py.  Connections per database and process; 0 disables pooling.
+DB_POOL_MAX_SIZE = 5
+# Seconds to wait for a connection when all of them are in use
+DB_POOL_TIMEOUT = 30
+# Seconds to wait for the database server when opening a connection
+DB_POOL_CONNECT_TIMEOUT = 10
+# Check connections idle for longer than this many seconds before reuse
+DB_POOL_CHECK_INTERVAL = 30
+# Close connections idle for longer than this many seconds
+DB_POOL_MAX_IDLE = 600
+
 """
 START GAZETTEER SETTINGS
 """
@@ -526,6 +545,43 @@ START GAZETTEER SETTINGS
 USE_GAZETTEER = False
 GAZETTEER_DB_ALIAS = "wmdata"
 GAZETTEER_FULLTEXTSEARCH = False
+# Answer placename prefix searches from an in-process index instead of
+# the database (ignored when GAZETTEER_FULLTEXTSEARCH = True).
+# Needs a shared CACHE_BACKEND to stay current across worker processes.
+GAZETTEER_PREFIX_INDEX = False
+# Filter searches by date through a GiST index on placename date ranges
+# (requires PostgreSQL 9.2+ and gazetteer migration 0004)
+GAZETTEER_TEMPORAL_INDEX = False
+# Maximum number of placenames per gazetteer search response; further
+# results are reached through the cursor in the response's Link header.
+GAZETTEER_PAGE_SIZE = 500
+# Number of placenames read from the database at a time while streaming
+GAZETTEER_CHUNK_SIZE = 100
+# Searches with a zoom parameter up to this web map zoom level return
+# placename counts per grid cell instead of placenames
+GAZETTEER_CLUSTER_MAX_ZOOM = 6
+# Width of the clustering grid cells, in map pixels
+GAZETTEER_CLUSTER_CELL_PIXELS = 64
+# Track feature edits in layer stores with triggers, and only update the
+# placenames of changed features when a layer's gazetteer entries are updated
+GAZETTEER_INCREMENTAL_SYNC = False
+# Load the placenames of layers that are not in the gazetteer yet with
+# the COPY based bulk loader, reading this many features at a time
+GAZETTEER_BULK_LOAD = False
+GAZETTEER_BULK_LOAD_BATCH_SIZE = 5000
+# External geocoding services (Google, Nominatim, GeoNames) are queried in
+# parallel; slower services are dropped after this many seconds
+GAZETTEER_SERVICES_DEADLINE = 5
+# Seconds to cache external geocoding results for a placename
+GAZETTEER_SERVICES_CACHE_TIMEOUT = 60 * 60 * 24
+# Stop querying a service after this many consecutive failures, retrying
+# every GAZETTEER_SERVICES_RETRY_INTERVAL seconds
+GAZETTEER_SERVICES_FAILURE_THRESHOLD = 3
+GAZETTEER_SERVICES_RETRY_INTERVAL = 60
+# Threads of each process querying an external geocoding service, and
+# queries waiting for one; further searches skip the service
+GAZETTEER_SERVICES_WORKERS = 4
+GAZETTEER_SERVICES_MAX_QUEUED = 4
 # Uncomment the following if USE_GAZETTEER = True
 # DATABASE_ROUTERS = ['geonode.utils.WorldmapDatabaseRouter']
 # SOUTH_DATABASE_ADAPTERS = {
@@ -542,7 +598,31 @@ END GAZETTEER SETTINGS
 #layer bounds updates (after creating/editing features)
 #and gazetteer updates
 USE_QUEUE = False
+# 'celery' runs queue tasks in Celery workers, 'local' in a pool of
+# background threads of each web server process (see geonode/queue/workers.py)
+QUEUE_BACKEND = 'celery'
+QUEUE_LOCAL_WORKERS = 2
+# Tasks waiting for a local worker; further tasks are dropped until the next poll
+QUEUE_LOCAL_MAX_QUEUED = 100
+# Seconds between checks of the job queues by the local backend
+QUEUE_LOCAL_POLL_INTERVAL = 60
+# Seconds given to queued local tasks to finish when the process exits
+QUEUE_LOCAL_SHUTDOWN_TIMEOUT = 30
 QUEUE_INTERVAL = '*/10'
+# Number of workers started every QUEUE_INTERVAL to drain each job queue
+QUEUE_CONCURRENCY = 4
+# Seconds a job stays leased to a worker that stopped renewing its lease
+# (running jobs renew it every third of that) before another worker can take
+# it over
+QUEUE_VISIBILITY_TIMEOUT = 60 * 60
+# Failed jobs are retried after QUEUE_RETRY_DELAY seconds, doubling the delay
+# on every attempt up to QUEUE_MAX_RETRY_DELAY, and are kept as failed after
+# QUEUE_MAX_ATTEMPTS attempts
+QUEUE_MAX_ATTEMPTS = 5
+QUEUE_RETRY_DELAY = 60
+QUEUE_MAX_RETRY_DELAY = 60 * 60 * 6
+# Number of layer bounds refreshed together, with one extent query per store
+BOUNDS_BATCH_SIZE = 100
 CELERY_IMPORTS = ("geonode.queue", )
 BROKER_URL = "django://"
 if USE_QUEUE:
@@ -565,6 +645,12 @@ DEFAULT_WORKSPACE = 'geonode'
 
 HGL_VALIDATION_KEY='Contact Harvard Geospatial Library to request the validation key'
 CACHE_BACKEND = 'dummy://'
+# Seconds to keep compiled map viewer configurations.  They are replaced
+# whenever the map, its layers or their attributes change.
+MAP_CONFIG_CACHE_TIMEOUT = 60 * 60 * 24
+# Directory of the pre-rendered viewer configurations of official maps,
+# see geonode.maps.bundles
+MAP_BUNDLE_ROOT = os.path.join(PROJECT_ROOT, "site_media", "bundles")
 
 # Regular expression to prevent uploading of SLD's containing links to external images,
 # for example: 'http://[a-zA-Z0-9\.\-]*harvard\.edu'.  Default will allow any link.
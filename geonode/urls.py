@@ -110,6 +110,7 @@ official_site_url_patterns = patterns('',
     (r'^(?P<site>[A-Za-z0-9_\-]+)/$', 'geonode.maps.views.official_site'),
     (r'^(?P<site>[A-Za-z0-9_\-]+)/mobile/?$', 'geonode.maps.views.official_site_mobile'),
     (r'^(?P<site>[A-Za-z0-9_\-]+)/info$', 'geonode.maps.views.official_site_controller'),
+    (r'^(?P<site>[A-Za-z0-9_\-]+)/config$', 'geonode.maps.views.official_site_config'),
 )
 
 urlpatterns += official_site_url_patterns